@@ -1,21 +1,116 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template_string, session, redirect, url_for
+from flask import Flask, request, jsonify, send_from_directory, render_template_string, session, redirect, url_for, Response, stream_with_context, json, g
 from flask_cors import CORS
-from db import get_db_connection
+from db import get_db_connection, iter_rows, require_database_url, REPLICA_CHECK_INTERVAL
+from settings import settings
+from file_gc import enqueue_file_deletion, variant_urls, start_file_gc, family_base
+from media_scheduler import queue_stats, EncodeCancelled
+from media_jobs import create_job, finish_job, get_jobs, cancel_jobs, ProgressTracker
+from upload_validation import UploadRequest, UploadStream, UploadRejected, MAX_REQUEST_SIZE
+import upload_admission
+import media_storage
+import request_profiler
+from static_assets import AssetCache, asset_response, PAGE_CACHE_CONTROL, ASSET_CACHE_CONTROL
+import shared_cache
+import queries
 from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import traceback
 import bcrypt
 import jwt
 import datetime
+import time
+import base64
 import os
 import uuid
+import random
+import select
+import threading
 from werkzeug.utils import secure_filename
 
 
 print("Starting Flask server...")
+require_database_url()  # Fail at startup rather than on the first request
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this-in-production'  # Required for sessions
+app.secret_key = settings.secret_key  # Required for sessions; also signs the login JWTs
 CORS(app)  # Enable CORS for all routes
+app.request_class = UploadRequest  # Validates uploads while they stream in
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE
+start_file_gc()  # Background file deletion and orphan sweeping
+media_storage.start_retention()  # Drops intermediates, moves old originals to the cold tier
+shared_cache.start_cache_listener()  # Drops cached data when another worker writes
+
+# HTML pages and their scripts/styles, precompressed in memory
+assets = AssetCache()
+assets.load()
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Uploads can be at most {MAX_REQUEST_SIZE // (1024 * 1024)} MB per request"}), 413
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    return e.response()
+
+def admit_upload():
+    """
+    Take an upload_admission lease for this request before its body is read;
+    raises UploadRejected (429/507) when saturated. The lease is released
+    when the response is closed, after any streamed body. If the lease table
+    can't be reached the upload is admitted.
+    """
+    try:
+        g.upload_lease = upload_admission.admit(session['user_id'], request.content_length)
+    except UploadRejected as e:
+        print(f"Upload not admitted for user {session['user_id']}: {e.message}")
+        raise
+    except Exception as e:
+        print(f"Error checking upload admission: {e}")
+
+@app.after_request
+def hand_lease_to_response(response):
+    # Teardown runs before a stream_with_context body, so the lease goes with the response
+    lease = g.pop('upload_lease', None)
+    if lease is not None:
+        response.call_on_close(lambda: upload_admission.release(lease))
+    return response
+
+@app.teardown_request
+def release_upload_lease(exc):
+    # Only still set when no response was made
+    upload_admission.release(g.pop('upload_lease', None))
+
+# Requests are profiled when an admin sends this header, or at random with PROFILE_SAMPLE_RATE
+PROFILE_HEADER = 'X-Profile'
+
+@app.before_request
+def start_profiling():
+    wanted = request.headers.get(PROFILE_HEADER) == '1' and session.get('role') == 'admin'
+    if wanted or random.random() < settings.profile_sample_rate:
+        g.profile = request_profiler.start(request.method, request.full_path.rstrip('?'))
+
+def finish_profile(profile, endpoint, status):
+    try:
+        request_profiler.stop(endpoint, status, profile=profile)
+    except Exception as e:
+        print(f"Error writing request profile: {e}")
+
+@app.after_request
+def tag_profile(response):
+    # Stopped when the response is closed, so a streamed body is profiled too
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.id
+        endpoint, status = request.endpoint, response.status_code
+        response.call_on_close(lambda: finish_profile(profile, endpoint, status))
+    return response
+
+@app.teardown_request
+def finish_profiling(exc):
+    # Only still set when no response was made
+    profile = g.pop('profile', None)
+    if profile is not None:
+        finish_profile(profile, request.endpoint, 500)
 
 def require_auth(f):
     """Decorator to require authentication"""
@@ -28,24 +123,225 @@ def require_auth(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def require_admin(f):
+    """Decorator to restrict a route to the admin role"""
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        if session.get('role') != 'admin':
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+# Grant permissions that satisfy each access level; 'owner' is the owner only
+ACCESS_LEVELS = {'view': ['view', 'edit'], 'edit': ['edit'], 'owner': []}
+
+def timeline_access(column, level='view'):
+    """
+    SQL condition limiting the timeline id in `column` to timelines the
+    session user may access at `level`, as (sql, params) to splice into a
+    WHERE clause. Admins can access everything; everyone else their own
+    timelines and those shared with them (timeline_grants).
+    """
+    if session.get('role') == 'admin':
+        return "TRUE", []
+    user_id = session['user_id']
+    return f"""{column} IN (
+        SELECT id FROM timelines WHERE user_id = %s
+        UNION ALL
+        SELECT timeline_id FROM timeline_grants WHERE user_id = %s AND permission = ANY(%s)
+    )""", [user_id, user_id, ACCESS_LEVELS[level]]
+
+def occurrence_access(column, level='view'):
+    """Like timeline_access, for an occurrence id column"""
+    sql, params = timeline_access('timeline_id', level)
+    return f"{column} IN (SELECT id FROM occurrences WHERE {sql})", params
+
+# After a write, or after taking a /changes baseline, the session reads from the
+# primary for this long, so it sees its own changes (and everything up to the
+# baseline) even through a replica that is up to REPLICA_MAX_LAG behind
+READ_YOUR_WRITES_WINDOW = settings.replica_max_lag + REPLICA_CHECK_INTERVAL
+
+@app.after_request
+def remember_write(response):
+    """Note when this session last changed something (only matters with replicas)"""
+    if (settings.database_replica_urls and request.method not in ('GET', 'HEAD', 'OPTIONS')
+            and response.status_code < 400 and 'user_id' in session):
+        session['last_write_at'] = time.time()
+    return response
+
+def get_read_connection():
+    """Connection for read-only handlers: a replica unless this session wrote or took a baseline recently"""
+    last_primary_read = max(session.get('last_write_at', 0), session.get('baseline_at', 0))
+    recent = time.time() - last_primary_read < READ_YOUR_WRITES_WINDOW
+    return get_db_connection(replica=not recent)
+
+# Rows fetched per round trip (and encoded per chunk) by streaming listings
+STREAM_BATCH_SIZE = settings.stream_batch_size
+
+def stream_rows(rows, conn):
+    """
+    Stream an iterable of rows back as a chunked JSON array, or as NDJSON when
+    the client asks for it with ?format=ndjson or an application/x-ndjson
+    Accept header. The connection is closed once the stream ends. An error
+    mid-stream aborts the response without closing the array, so clients see
+    a broken transfer rather than a complete-looking, truncated listing.
+    """
+    ndjson = (request.args.get('format') == 'ndjson'
+              or 'application/x-ndjson' in request.headers.get('Accept', ''))
+
+    def generate():
+        count = 0
+        buffer = [] if ndjson else ['[']
+        try:
+            for row in rows:
+                encoded = json.dumps(dict(row))
+                if ndjson:
+                    buffer.append(encoded + '\n')
+                else:
+                    buffer.append(encoded if count == 0 else ',' + encoded)
+                count += 1
+                if count % STREAM_BATCH_SIZE == 0:
+                    yield ''.join(buffer)
+                    buffer = []
+            if not ndjson:
+                buffer.append(']')
+            print(f"Streamed {count} rows")
+            yield ''.join(buffer)
+        except Exception as e:
+            # Headers are already sent; re-raising makes the server drop the
+            # connection mid-body instead of ending the document cleanly
+            print(f"Error while streaming rows after {count} rows: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            raise
+        finally:
+            conn.close()
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def format_occurrence(row):
+    """Occurrence row as the frontend expects it in listings"""
+    occ_dict = dict(row)
+    occ_dict['is_span'] = False
+    return occ_dict
+
+def format_span(row):
+    """Span row as the frontend expects it in listings"""
+    span_dict = dict(row)
+    span_dict['is_span'] = True
+    span_dict['span'] = True  # For frontend compatibility
+    return span_dict
+
+# Change feed: max changes per /changes response, and SSE keepalive interval
+CHANGE_FEED_LIMIT = 1000
+CHANGE_STREAM_HEARTBEAT = 15  # seconds
+# Open /changes/stream responses per process (CHANGE_STREAM_MAX). A stream ends
+# after CHANGE_STREAM_MAX_AGE so its thread goes back to the pool; the browser
+# reconnects after CHANGE_STREAM_RETRY_MS and resumes from Last-Event-ID.
+CHANGE_STREAM_MAX = settings.change_stream_max
+CHANGE_STREAM_MAX_AGE = 300  # seconds
+CHANGE_STREAM_RETRY_MS = 10000
+change_stream_slots = threading.BoundedSemaphore(CHANGE_STREAM_MAX)
+CHANGE_FEED_LOCK_KEY = 728001
+
+# The insert selects from the lock, so the id is only drawn once the lock is held
+RECORD_CHANGE = queries.register('change_feed.record', """
+    WITH locked AS (
+        SELECT pg_advisory_xact_lock(%s::bigint)
+    ), change AS (
+        INSERT INTO timeline_changes (timeline_id, entity_type, entity_id, op)
+        SELECT %s::integer, %s::varchar, %s::integer, %s::varchar FROM locked
+        RETURNING id
+    )
+    SELECT pg_notify('timeline_changes', id::text) FROM change
+""")
+
+def record_change(cur, timeline_id, entity_type, entity_id, op='upsert'):
+    """
+    Append a row to the change feed inside the caller's transaction.
+    The advisory lock is held until commit so versions become visible in
+    order, and the NOTIFY wakes /changes/stream listeners on commit.
+    """
+    queries.execute(cur, RECORD_CHANGE, (CHANGE_FEED_LOCK_KEY, timeline_id, entity_type, entity_id, op))
+
+CHANGE_FEED_VERSION = queries.register('change_feed.version',
+                                       "SELECT COALESCE(max(id), 0) AS version FROM timeline_changes")
+
+def fetch_changes(cur, since, timeline_id=None, access=("TRUE", [])):
+    """
+    Collapse the change log after `since` to the latest change per entity and
+    attach the current row for upserts. Without `since` only the current
+    version is returned, which clients use as the baseline for a full load.
+    `access` is a timeline_access() condition; changes to timelines that no
+    longer exist always pass so clients learn about the deletion.
+    """
+    queries.execute(cur, CHANGE_FEED_VERSION)
+    version = cur.fetchone()['version']
+    if since is None or since >= version:
+        return {"version": version, "changes": [], "has_more": False}
+
+    timeline_filter = "AND timeline_id = %s" if timeline_id is not None else ""
+    access_sql, access_params = access
+    params = [since] + ([timeline_id] if timeline_id is not None else []) + access_params + [CHANGE_FEED_LIMIT + 1]
+    cur.execute(f"""
+        SELECT * FROM (
+            SELECT DISTINCT ON (entity_type, entity_id)
+                id AS version, timeline_id, entity_type, entity_id, op
+            FROM timeline_changes
+            WHERE id > %s {timeline_filter}
+              AND ({access_sql} OR NOT EXISTS (SELECT 1 FROM timelines t WHERE t.id = timeline_changes.timeline_id))
+            ORDER BY entity_type, entity_id, id DESC
+        ) latest
+        ORDER BY version
+        LIMIT %s
+    """, params)
+    changes = [dict(change) for change in cur.fetchall()]
+    has_more = len(changes) > CHANGE_FEED_LIMIT
+    if has_more:
+        changes = changes[:CHANGE_FEED_LIMIT]
+        version = changes[-1]['version']
+
+    # One query per entity type for the rows that still exist
+    entity_queries = {
+        'timeline': ("SELECT id, title, description, start_date::text, end_date::text FROM timelines WHERE id = ANY(%s)", dict),
+        'occurrence': ("SELECT *, 'occurrence' as type FROM occurrences WHERE id = ANY(%s)", format_occurrence),
+        'span': ("SELECT *, 'span' as type FROM spans WHERE id = ANY(%s)", format_span),
+    }
+    for entity_type, (query, formatter) in entity_queries.items():
+        ids = [c['entity_id'] for c in changes if c['entity_type'] == entity_type and c['op'] == 'upsert']
+        if not ids:
+            continue
+        cur.execute(query, (ids,))
+        rows = {row['id']: formatter(row) for row in cur.fetchall()}
+        for change in changes:
+            if change['entity_type'] == entity_type and change['op'] == 'upsert':
+                change['row'] = rows.get(change['entity_id'])
+                if change['row'] is None:
+                    # Deleted by a change we haven't reached yet
+                    change['op'] = 'delete'
+    for change in changes:
+        change.setdefault('row', None)
+
+    return {"version": version, "changes": changes, "has_more": has_more}
+
 @app.route("/timelines", methods=["GET", "POST"])
 @require_auth
 def timelines():
     if request.method == "GET":
         try:
             print("Attempting to connect to database...")
-            conn = get_db_connection()
+            conn = get_read_connection()
             print("Database connection successful")
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute("SELECT id, title, description, start_date::text, end_date::text FROM timelines;")
-            timelines = cur.fetchall()
-            cur.close()
-            conn.close()
-            
-            # Convert RealDictRow objects to regular dictionaries
-            timeline_list = [dict(timeline) for timeline in timelines]
-            print(f"Returning {len(timeline_list)} timelines")
-            return jsonify(timeline_list)
+            access_sql, access_params = timeline_access('id')
+            rows = iter_rows(
+                conn,
+                f"SELECT id, title, description, start_date::text, end_date::text FROM timelines WHERE {access_sql} ORDER BY id",
+                access_params,
+                itersize=STREAM_BATCH_SIZE
+            )
+            return stream_rows(rows, conn)
         except Exception as e:
             print(f"Error fetching timelines: {e}")
             print(f"Traceback: {traceback.format_exc()}")
@@ -61,9 +357,10 @@ def timelines():
                 INSERT INTO timelines (title, description, start_date, end_date, user_id)
                 VALUES (%s, %s, %s, %s, %s)
                 RETURNING *
-            """, (data['title'], data['description'], data['start_date'], data['end_date'], 1))
+            """, (data['title'], data['description'], data['start_date'], data['end_date'], session['user_id']))
             
             new_timeline = cur.fetchone()
+            record_change(cur, new_timeline['id'], 'timeline', new_timeline['id'])
             conn.commit()
             cur.close()
             conn.close()
@@ -73,26 +370,26 @@ def timelines():
             print(f"Error creating timeline: {e}")
             return jsonify({"error": str(e)}), 500
 
+# Editable columns; PATCH bodies may send any subset
+TIMELINE_FIELDS = (('title', 'text'), ('description', 'text'), ('start_date', 'date'), ('end_date', 'date'))
+UPDATE_TIMELINE = queries.register('timeline.update', queries.patch_statement('timelines', TIMELINE_FIELDS))
+
 @app.route("/timelines/<int:timeline_id>", methods=["PATCH", "DELETE"])
 @require_auth
 def update_timeline(timeline_id):
     if request.method == "PATCH":
         try:
             data = request.get_json()
-            fields = []
-            values = []
-            for key in ["title", "description", "start_date", "end_date"]:
-                if key in data:
-                    fields.append(f"{key} = %s")
-                    values.append(data[key])
-            if not fields:
+            if not any(key in data for key, _ in TIMELINE_FIELDS):
                 return jsonify({"error": "No fields to update."}), 400
-            values.append(timeline_id)
-            set_clause = ", ".join(fields)
+            access_sql, access_params = timeline_access('id', 'edit')
+            values = queries.patch_params(data, TIMELINE_FIELDS) + [timeline_id] + access_params
             conn = get_db_connection()
             cur = conn.cursor(cursor_factory=RealDictCursor)
-            cur.execute(f"UPDATE timelines SET {set_clause} WHERE id = %s RETURNING *", values)
+            queries.execute(cur, UPDATE_TIMELINE, values, access_sql)
             updated = cur.fetchone()
+            if updated:
+                record_change(cur, timeline_id, 'timeline', timeline_id)
             conn.commit()
             cur.close()
             conn.close()
@@ -109,60 +406,271 @@ def update_timeline(timeline_id):
             conn = get_db_connection()
             cur = conn.cursor()
             
-            # Delete related occurrences and spans first
-            cur.execute("DELETE FROM occurrences WHERE timeline_id = %s", (timeline_id,))
-            cur.execute("DELETE FROM spans WHERE timeline_id = %s", (timeline_id,))
-            
-            # Delete the timeline
-            cur.execute("DELETE FROM timelines WHERE id = %s", (timeline_id,))
-            
-            if cur.rowcount == 0:
-                return jsonify({"error": "Timeline not found."}), 404
-                
+            # Spans, occurrences, instances and media go with the timeline via
+            # ON DELETE CASCADE; the CTE collects file URLs from the pre-delete snapshot.
+            # Only the owner (or an admin) may delete a timeline.
+            access_sql, access_params = timeline_access('id', 'owner')
+            cur.execute(f"""
+                WITH files AS (
+                    SELECT m.file_url
+                    FROM media m
+                    JOIN instances i ON i.id = m.instance_id
+                    LEFT JOIN occurrences o ON o.id = i.occurrence_id
+                    LEFT JOIN spans s ON s.id = i.span_id
+                    WHERE o.timeline_id = %s OR s.timeline_id = %s
+                ), deleted AS (
+                    DELETE FROM timelines WHERE id = %s AND {access_sql} RETURNING id
+                )
+                SELECT (SELECT count(*) FROM deleted), ARRAY(SELECT file_url FROM files)
+            """, [timeline_id, timeline_id, timeline_id] + access_params)
+            deleted, file_urls = cur.fetchone()
+            if deleted:
+                record_change(cur, timeline_id, 'timeline', timeline_id, 'delete')
+                cancel_jobs(cur, file_urls=file_urls)
             conn.commit()
             cur.close()
             conn.close()
+            
+            if deleted == 0:
+                return jsonify({"error": "Timeline not found."}), 404
+            
+            enqueue_file_deletion(file_urls)
             return '', 204
         except Exception as e:
             print(f"Error deleting timeline: {e}")
             return jsonify({"error": str(e)}), 500
 
+# Copies a timeline in one statement. New span, occurrence and instance ids are
+# drawn from their sequences up front (ordered like the originals), so the
+# *_ids CTEs map each old id to its new one for the rows that point at it.
+# Media rows are copied as references: both timelines share the files, and the
+# GC keeps a file while any media row still points at it.
+CLONE_TIMELINE = """
+    WITH source AS (
+        SELECT * FROM timelines WHERE id = %s AND {access}
+    ), new_timeline AS (
+        INSERT INTO timelines (user_id, title, description, start_date, end_date)
+        SELECT %s, COALESCE(%s, title || ' (copy)'), description, start_date, end_date FROM source
+        RETURNING id, title, description, start_date::text, end_date::text
+    ), span_ids AS (
+        SELECT s.id AS old_id, nextval(pg_get_serial_sequence('spans', 'id')) AS new_id
+        FROM spans s JOIN source ON s.timeline_id = source.id
+        ORDER BY s.id
+    ), new_spans AS (
+        INSERT INTO spans (id, timeline_id, title, start_date, end_date, description)
+        SELECT ids.new_id, nt.id, s.title, s.start_date, s.end_date, s.description
+        FROM span_ids ids JOIN spans s ON s.id = ids.old_id CROSS JOIN new_timeline nt
+        RETURNING id
+    ), occurrence_ids AS (
+        SELECT o.id AS old_id, nextval(pg_get_serial_sequence('occurrences', 'id')) AS new_id
+        FROM occurrences o JOIN source ON o.timeline_id = source.id
+        ORDER BY o.id
+    ), new_occurrences AS (
+        INSERT INTO occurrences (id, timeline_id, title, date, description)
+        SELECT ids.new_id, nt.id, o.title, o.date, o.description
+        FROM occurrence_ids ids JOIN occurrences o ON o.id = ids.old_id CROSS JOIN new_timeline nt
+        RETURNING id
+    ), instance_ids AS (
+        SELECT i.id AS old_id, nextval(pg_get_serial_sequence('instances', 'id')) AS new_id,
+               si.new_id AS span_id, oi.new_id AS occurrence_id
+        FROM instances i
+        LEFT JOIN span_ids si ON si.old_id = i.span_id
+        LEFT JOIN occurrence_ids oi ON oi.old_id = i.occurrence_id
+        WHERE si.old_id IS NOT NULL OR oi.old_id IS NOT NULL
+        ORDER BY i.id
+    ), new_instances AS (
+        -- created_at is kept so message pages come out in the same order
+        INSERT INTO instances (id, span_id, occurrence_id, content, created_at)
+        SELECT ids.new_id, ids.span_id, ids.occurrence_id, i.content, i.created_at
+        FROM instance_ids ids JOIN instances i ON i.id = ids.old_id
+        RETURNING id
+    ), new_media AS (
+        INSERT INTO media (instance_id, file_url, file_type, width, height, duration, waveform, uploaded_at)
+        SELECT ids.new_id, m.file_url, m.file_type, m.width, m.height, m.duration, m.waveform, m.uploaded_at
+        FROM instance_ids ids JOIN media m ON m.instance_id = ids.old_id
+        ORDER BY m.id
+        RETURNING id
+    ), new_event_links AS (
+        INSERT INTO timeline_events (event_id, timeline_id, added_by_user_id)
+        SELECT te.event_id, nt.id, %s
+        FROM timeline_events te JOIN source ON te.timeline_id = source.id CROSS JOIN new_timeline nt
+        RETURNING id
+    )
+    SELECT nt.*,
+           (SELECT count(*) FROM new_spans) AS spans,
+           (SELECT count(*) FROM new_occurrences) AS occurrences,
+           (SELECT count(*) FROM new_instances) AS instances,
+           (SELECT count(*) FROM new_media) AS media,
+           (SELECT count(*) FROM new_event_links) AS global_events
+    FROM new_timeline nt
+"""
+
+@app.route("/timelines/<int:timeline_id>/clone", methods=["POST"])
+@require_auth
+def clone_timeline(timeline_id):
+    """
+    Copy a timeline the user can see, with its spans, occurrences, messages,
+    attachments and global event links, into a new timeline they own.
+    Optional body: {"title": ...}, default "<title> (copy)".
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        access_sql, access_params = timeline_access('id')
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(CLONE_TIMELINE.replace('{access}', access_sql),
+                    [timeline_id] + access_params + [session['user_id'], data.get('title'), session['user_id']])
+        clone = cur.fetchone()
+        if clone is None:
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Timeline not found."}), 404
+        # The timeline's change takes the feed lock; its items follow in one insert
+        record_change(cur, clone['id'], 'timeline', clone['id'])
+        cur.execute("""
+            INSERT INTO timeline_changes (timeline_id, entity_type, entity_id, op)
+            SELECT timeline_id, 'span', id, 'upsert' FROM spans WHERE timeline_id = %s
+            UNION ALL
+            SELECT timeline_id, 'occurrence', id, 'upsert' FROM occurrences WHERE timeline_id = %s
+        """, (clone['id'], clone['id']))
+        if clone['global_events']:
+            global_events_changed(cur)
+        conn.commit()
+        cur.close()
+        conn.close()
+        print(f"Cloned timeline {timeline_id} as {clone['id']}: {clone['spans']} spans, "
+              f"{clone['occurrences']} occurrences, {clone['instances']} instances, {clone['media']} media")
+        return jsonify(dict(clone)), 201
+    except Exception as e:
+        print(f"Error cloning timeline: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/timelines/<int:timeline_id>/grants", methods=["GET", "POST"])
+@app.route("/timelines/<int:timeline_id>/grants/<int:user_id>", methods=["DELETE"])
+@require_auth
+def timeline_grants(timeline_id, user_id=None):
+    """List, add or revoke who a timeline is shared with (owner or admin only)"""
+    try:
+        access_sql, access_params = timeline_access('t.id', 'owner')
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if request.method == "GET":
+            cur.execute(f"""
+                SELECT g.user_id, u.username, g.permission, g.created_at
+                FROM timelines t
+                JOIN timeline_grants g ON g.timeline_id = t.id
+                JOIN users u ON u.id = g.user_id
+                WHERE t.id = %s AND {access_sql}
+                ORDER BY u.username
+            """, [timeline_id] + access_params)
+            grants = [dict(row) for row in cur.fetchall()]
+            cur.close()
+            conn.close()
+            return jsonify(grants)
+
+        if request.method == "POST":
+            data = request.get_json() or {}
+            permission = data.get('permission', 'view')
+            if permission not in ('view', 'edit') or not data.get('username'):
+                return jsonify({"error": "username and a permission of 'view' or 'edit' are required."}), 400
+            cur.execute(f"""
+                INSERT INTO timeline_grants (timeline_id, user_id, permission, granted_by)
+                SELECT t.id, u.id, %s, %s
+                FROM timelines t JOIN users u ON u.username = %s AND u.id <> t.user_id
+                WHERE t.id = %s AND {access_sql}
+                ON CONFLICT (timeline_id, user_id) DO UPDATE SET permission = EXCLUDED.permission
+                RETURNING user_id, permission
+            """, [permission, session['user_id'], data['username'], timeline_id] + access_params)
+            grant = cur.fetchone()
+            if grant:
+                # Lets the new viewer's change feed pick up the timeline
+                record_change(cur, timeline_id, 'timeline', timeline_id)
+            conn.commit()
+            cur.close()
+            conn.close()
+            if not grant:
+                return jsonify({"error": "Timeline or user not found."}), 404
+            return jsonify({**dict(grant), "username": data['username']})
+
+        cur.execute(f"""
+            DELETE FROM timeline_grants g USING timelines t
+            WHERE g.timeline_id = t.id AND t.id = %s AND g.user_id = %s AND {access_sql}
+        """, [timeline_id, user_id] + access_params)
+        revoked = cur.rowcount
+        conn.commit()
+        cur.close()
+        conn.close()
+        if not revoked:
+            return jsonify({"error": "Grant not found."}), 404
+        return '', 204
+    except Exception as e:
+        print(f"Error managing timeline grants: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def date_window(start, end):
+    """
+    (start, end) dates from ?start=&end= query arguments, either of which may be
+    left out for an open-ended window; None when neither is given. Raises
+    ValueError for anything that isn't YYYY-MM-DD.
+    """
+    if not start and not end:
+        return None
+    start = datetime.date.fromisoformat(start) if start else None
+    end = datetime.date.fromisoformat(end) if end else None
+    if start and end and start > end:
+        start, end = end, start
+    return start, end
+
+TIMELINE_EDITABLE = queries.register('timeline.editable',
+                                     "SELECT EXISTS (SELECT 1 FROM timelines WHERE id = %s AND {access}) AS allowed")
+INSERT_SPAN = queries.register('span.insert', """
+    INSERT INTO spans (timeline_id, title, start_date, end_date, description)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING *
+""")
+INSERT_OCCURRENCE = queries.register('occurrence.insert', """
+    INSERT INTO occurrences (timeline_id, title, date, description)
+    VALUES (%s, %s, %s, %s)
+    RETURNING *
+""")
+
 @app.route("/occurrences", methods=["GET", "POST"])
 @require_auth
 def occurrences():
     if request.method == "GET":
         try:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Get occurrences
-            cur.execute("SELECT *, 'occurrence' as type FROM occurrences;")
-            occurrences = cur.fetchall()
-            
-            # Get spans
-            cur.execute("SELECT *, 'span' as type FROM spans;")
-            spans = cur.fetchall()
-            
-            cur.close()
-            conn.close()
-            
-            # Combine and format results
-            result = []
-            
-            # Add occurrences with is_span=false
-            for occ in occurrences:
-                occ_dict = dict(occ)
-                occ_dict['is_span'] = False
-                result.append(occ_dict)
-            
-            # Add spans with is_span=true
-            for span in spans:
-                span_dict = dict(span)
-                span_dict['is_span'] = True
-                span_dict['span'] = True  # For frontend compatibility
-                result.append(span_dict)
-            
-            return jsonify(result)
+            # Optional filter so a single timeline can be exported on its own
+            timeline_id = request.args.get('timeline_id', type=int)
+            try:
+                window = date_window(request.args.get('start'), request.args.get('end'))
+            except ValueError:
+                return jsonify({"error": "start and end must be YYYY-MM-DD dates"}), 400
+            where, params = timeline_access('timeline_id')
+            where = f"WHERE {where}"
+            if timeline_id is not None:
+                where += " AND timeline_id = %s"
+                params = params + [timeline_id]
+            occurrence_where, span_where = where, where
+            if window is not None:
+                # Only items intersecting the window (GiST indexes on date_period)
+                occurrence_where += " AND date_period(date, date) && daterange(%s, %s, '[]')"
+                span_where += " AND date_period(start_date, end_date) && daterange(%s, %s, '[]')"
+                params = params + list(window)
+            conn = get_read_connection()
+
+            def combined_rows():
+                # Occurrences first with is_span=false
+                for occ in iter_rows(conn, f"SELECT *, 'occurrence' as type FROM occurrences {occurrence_where} ORDER BY id",
+                                     params, itersize=STREAM_BATCH_SIZE):
+                    yield format_occurrence(occ)
+
+                # Then spans with is_span=true
+                for span in iter_rows(conn, f"SELECT *, 'span' as type FROM spans {span_where} ORDER BY id",
+                                      params, itersize=STREAM_BATCH_SIZE):
+                    yield format_span(span)
+
+            return stream_rows(combined_rows(), conn)
         except Exception as e:
             print(f"Error fetching occurrences: {e}")
             return jsonify([])
@@ -173,23 +681,26 @@ def occurrences():
             conn = get_db_connection()
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
+            access_sql, access_params = timeline_access('id', 'edit')
+            queries.execute(cur, TIMELINE_EDITABLE, [data['timeline_id']] + access_params, access_sql)
+            if not cur.fetchone()['allowed']:
+                cur.close()
+                conn.close()
+                return jsonify({"error": "You can't add items to this timeline."}), 403
+            
             # Check if this is a span or occurrence
             if data.get('is_span'):
                 # Insert as span
-                cur.execute("""
-                    INSERT INTO spans (timeline_id, title, start_date, end_date, description)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING *
-                """, (data['timeline_id'], data['title'], data.get('start_date'), data.get('end_date'), data.get('description')))
+                queries.execute(cur, INSERT_SPAN, (data['timeline_id'], data['title'], data.get('start_date'),
+                                                   data.get('end_date'), data.get('description')))
             else:
                 # Insert as occurrence
-                cur.execute("""
-                    INSERT INTO occurrences (timeline_id, title, date, description)
-                    VALUES (%s, %s, %s, %s)
-                    RETURNING *
-                """, (data['timeline_id'], data['title'], data.get('date'), data.get('description')))
+                queries.execute(cur, INSERT_OCCURRENCE, (data['timeline_id'], data['title'], data.get('date'),
+                                                         data.get('description')))
             
             new_occurrence = cur.fetchone()
+            record_change(cur, new_occurrence['timeline_id'], 'span' if data.get('is_span') else 'occurrence',
+                          new_occurrence['id'])
             conn.commit()
             cur.close()
             conn.close()
@@ -201,6 +712,67 @@ def occurrences():
 
 
 
+@app.route("/spans/<int:span_id>/overlaps", methods=["GET"])
+@require_auth
+def span_overlaps(span_id):
+    """Other spans in the same timeline whose dates overlap this span's"""
+    try:
+        access_sql, access_params = timeline_access('s.timeline_id')
+        conn = get_read_connection()
+        cur = conn.cursor()
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM spans s WHERE s.id = %s AND {access_sql})",
+                    [span_id] + access_params)
+        found = cur.fetchone()[0]
+        cur.close()
+        if not found:
+            conn.close()
+            return jsonify({"error": "Span not found"}), 404
+        rows = iter_rows(conn, """
+            SELECT o.*, 'span' AS type
+            FROM spans s
+            JOIN spans o ON o.timeline_id = s.timeline_id AND o.id <> s.id
+                AND date_period(o.start_date, o.end_date) && date_period(s.start_date, s.end_date)
+            WHERE s.id = %s
+            ORDER BY o.start_date NULLS FIRST, o.id
+        """, (span_id,), itersize=STREAM_BATCH_SIZE)
+        return stream_rows((format_span(row) for row in rows), conn)
+    except Exception as e:
+        print(f"Error fetching overlapping spans: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/timelines/<int:timeline_id>/span-conflicts", methods=["GET"])
+@require_auth
+def span_conflicts(timeline_id):
+    """
+    Every pair of overlapping spans in a timeline, with the dates they share
+    (overlap_start/overlap_end are inclusive; null means open-ended)
+    """
+    try:
+        access_sql, access_params = timeline_access('a.timeline_id')
+        conn = get_read_connection()
+        rows = iter_rows(conn, f"""
+            SELECT a.id AS span_id, b.id AS other_span_id,
+                   lower(overlap)::text AS overlap_start, (upper(overlap) - 1)::text AS overlap_end
+            FROM spans a
+            JOIN spans b ON b.timeline_id = a.timeline_id AND b.id > a.id
+                AND date_period(b.start_date, b.end_date) && date_period(a.start_date, a.end_date)
+            CROSS JOIN LATERAL (
+                SELECT date_period(a.start_date, a.end_date) * date_period(b.start_date, b.end_date) AS overlap
+            ) shared
+            WHERE a.timeline_id = %s AND {access_sql}
+            ORDER BY a.id, b.id
+        """, [timeline_id] + access_params, itersize=STREAM_BATCH_SIZE)
+        return stream_rows(rows, conn)
+    except Exception as e:
+        print(f"Error fetching span conflicts: {e}")
+        return jsonify({"error": str(e)}), 500
+
+SPAN_FIELDS = (('title', 'text'), ('start_date', 'date'), ('end_date', 'date'), ('description', 'text'))
+OCCURRENCE_FIELDS = (('title', 'text'), ('date', 'date'), ('description', 'text'))
+SPAN_EXISTS = queries.register('span.exists', "SELECT id FROM spans WHERE id = %s")
+UPDATE_SPAN = queries.register('span.update', queries.patch_statement('spans', SPAN_FIELDS))
+UPDATE_OCCURRENCE = queries.register('occurrence.update', queries.patch_statement('occurrences', OCCURRENCE_FIELDS))
+
 @app.route("/occurrences/<int:occurrence_id>", methods=["PATCH", "DELETE"])
 @require_auth
 def update_or_delete_occurrence(occurrence_id):
@@ -211,37 +783,22 @@ def update_or_delete_occurrence(occurrence_id):
             cur = conn.cursor(cursor_factory=RealDictCursor)
             
             # Check if it's a span or occurrence
-            cur.execute("SELECT id FROM spans WHERE id = %s", (occurrence_id,))
+            queries.execute(cur, SPAN_EXISTS, (occurrence_id,))
             is_span = cur.fetchone() is not None
+            access_sql, access_params = timeline_access('timeline_id', 'edit')
             
-            if is_span:
-                # Update span
-                fields = []
-                values = []
-                for key in ["title", "start_date", "end_date", "description"]:
-                    if key in data:
-                        fields.append(f"{key} = %s")
-                        values.append(data[key])
-                if not fields:
-                    return jsonify({"error": "No fields to update."}), 400
-                values.append(occurrence_id)
-                set_clause = ", ".join(fields)
-                cur.execute(f"UPDATE spans SET {set_clause} WHERE id = %s RETURNING *", values)
-            else:
-                # Update occurrence
-                fields = []
-                values = []
-                for key in ["title", "date", "description"]:
-                    if key in data:
-                        fields.append(f"{key} = %s")
-                        values.append(data[key])
-                if not fields:
-                    return jsonify({"error": "No fields to update."}), 400
-                values.append(occurrence_id)
-                set_clause = ", ".join(fields)
-                cur.execute(f"UPDATE occurrences SET {set_clause} WHERE id = %s RETURNING *", values)
+            # Update the span or occurrence
+            columns, statement = (SPAN_FIELDS, UPDATE_SPAN) if is_span else (OCCURRENCE_FIELDS, UPDATE_OCCURRENCE)
+            if not any(key in data for key, _ in columns):
+                cur.close()
+                conn.close()
+                return jsonify({"error": "No fields to update."}), 400
+            values = queries.patch_params(data, columns) + [occurrence_id] + access_params
+            queries.execute(cur, statement, values, access_sql)
             
             updated = cur.fetchone()
+            if updated:
+                record_change(cur, updated['timeline_id'], 'span' if is_span else 'occurrence', occurrence_id)
             conn.commit()
             cur.close()
             conn.close()
@@ -257,15 +814,42 @@ def update_or_delete_occurrence(occurrence_id):
             conn = get_db_connection()
             cur = conn.cursor()
             
-            # Try to delete from spans first
-            cur.execute("DELETE FROM spans WHERE id = %s", (occurrence_id,))
-            if cur.rowcount == 0:
+            access_sql, access_params = timeline_access('timeline_id', 'edit')
+            
+            # Try to delete from spans first; attached instances and media cascade
+            cur.execute(f"""
+                WITH files AS (
+                    SELECT m.file_url FROM media m JOIN instances i ON i.id = m.instance_id
+                    WHERE i.span_id = %s
+                ), deleted AS (
+                    DELETE FROM spans WHERE id = %s AND {access_sql} RETURNING timeline_id
+                )
+                SELECT (SELECT timeline_id FROM deleted), ARRAY(SELECT file_url FROM files)
+            """, [occurrence_id, occurrence_id] + access_params)
+            timeline_id, file_urls = cur.fetchone()
+            entity_type = 'span'
+            if timeline_id is None:
                 # If not found in spans, try occurrences
-                cur.execute("DELETE FROM occurrences WHERE id = %s", (occurrence_id,))
+                cur.execute(f"""
+                    WITH files AS (
+                        SELECT m.file_url FROM media m JOIN instances i ON i.id = m.instance_id
+                        WHERE i.occurrence_id = %s
+                    ), deleted AS (
+                        DELETE FROM occurrences WHERE id = %s AND {access_sql} RETURNING timeline_id
+                    )
+                    SELECT (SELECT timeline_id FROM deleted), ARRAY(SELECT file_url FROM files)
+                """, [occurrence_id, occurrence_id] + access_params)
+                timeline_id, file_urls = cur.fetchone()
+                entity_type = 'occurrence'
             
+            if timeline_id is not None:
+                record_change(cur, timeline_id, entity_type, occurrence_id, 'delete')
+                cancel_jobs(cur, file_urls=file_urls)
             conn.commit()
             cur.close()
             conn.close()
+            if timeline_id is not None:
+                enqueue_file_deletion(file_urls)
             return '', 204
         except Exception as e:
             print(f"Error deleting item: {e}")
@@ -273,6 +857,316 @@ def update_or_delete_occurrence(occurrence_id):
 
 
 
+def load_global_events():
+    """Every global event with the timelines it appears on, for the shared cache"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT e.id, e.title, e.date::text, e.description, e.created_at,
+                   COALESCE(json_agg(json_build_object('id', t.id, 'title', t.title) ORDER BY t.id)
+                            FILTER (WHERE t.id IS NOT NULL), '[]') AS timelines
+            FROM events e
+            LEFT JOIN timeline_events te ON te.event_id = e.id
+            LEFT JOIN timelines t ON t.id = te.timeline_id
+            GROUP BY e.id
+            ORDER BY e.date, e.id
+        """)
+        events = [dict(row) for row in cur.fetchall()]
+        cur.close()
+        return events
+    finally:
+        conn.close()
+
+# Global events are the same for everyone, so one cached copy serves all users
+global_events_cache = shared_cache.register('global_events', load_global_events)
+
+def global_events_changed(cur):
+    """Call before commit of any write to events/timeline_events"""
+    shared_cache.notify_invalidation(cur, 'global_events')
+
+def visible_global_events(timeline_id=None):
+    """The cached events, with each one's timelines narrowed to those the session user can see"""
+    events = global_events_cache.get()
+    visible = None
+    if session.get('role') != 'admin':
+        access_sql, access_params = timeline_access('id')
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"SELECT id FROM timelines WHERE {access_sql}", access_params)
+        visible = {row[0] for row in cur.fetchall()}
+        cur.close()
+        conn.close()
+    result = []
+    for event in events:
+        event_timelines = event['timelines']
+        if visible is not None:
+            event_timelines = [t for t in event_timelines if t['id'] in visible]
+        if timeline_id is not None and not any(t['id'] == timeline_id for t in event_timelines):
+            continue
+        result.append({**event, 'timelines': event_timelines,
+                       'timeline_ids': [t['id'] for t in event_timelines]})
+    return result
+
+@app.route('/global-events', methods=['GET', 'POST'])
+@require_auth
+def global_events():
+    """List global events (optionally ?timeline_id=), or create one (admin only)"""
+    if request.method == 'GET':
+        try:
+            return jsonify(visible_global_events(request.args.get('timeline_id', type=int)))
+        except Exception as e:
+            print(f"Error fetching global events: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            return jsonify([])
+
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Only admins can create global events."}), 403
+    try:
+        data = request.get_json() or {}
+        if not data.get('title') or not data.get('date'):
+            return jsonify({"error": "Title and date required."}), 400
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # The event and its timeline links in one statement
+        cur.execute("""
+            WITH new_event AS (
+                INSERT INTO events (title, date, description)
+                VALUES (%s, %s, %s)
+                RETURNING *
+            ), links AS (
+                INSERT INTO timeline_events (event_id, timeline_id, added_by_user_id)
+                SELECT new_event.id, t.id, %s
+                FROM new_event JOIN timelines t ON t.id = ANY(%s)
+            )
+            SELECT id, title, date::text, description, created_at FROM new_event
+        """, (data['title'], data['date'], data.get('description'),
+              session['user_id'], data.get('timeline_ids') or []))
+        new_event = cur.fetchone()
+        global_events_changed(cur)
+        conn.commit()
+        cur.close()
+        conn.close()
+        global_events_cache.invalidate()
+        return jsonify(dict(new_event)), 201
+    except Exception as e:
+        print(f"Error creating global event: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/global-events/<int:event_id>', methods=['GET', 'PATCH', 'DELETE'])
+@require_auth
+def global_event(event_id):
+    """Read one global event; update or delete it (admin only)"""
+    if request.method == 'GET':
+        try:
+            event = next((e for e in visible_global_events() if e['id'] == event_id), None)
+            if event is None:
+                return jsonify({"error": "Event not found."}), 404
+            return jsonify(event)
+        except Exception as e:
+            print(f"Error fetching global event: {e}")
+            return jsonify({"error": str(e)}), 500
+
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Only admins can change global events."}), 403
+
+    if request.method == 'PATCH':
+        try:
+            data = request.get_json() or {}
+            fields = []
+            values = []
+            for key in ["title", "date", "description"]:
+                if key in data:
+                    fields.append(f"{key} = %s")
+                    values.append(data[key])
+            if not fields and 'timeline_ids' not in data:
+                return jsonify({"error": "No fields to update."}), 400
+            conn = get_db_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            if fields:
+                cur.execute(f"UPDATE events SET {', '.join(fields)} WHERE id = %s RETURNING id",
+                            values + [event_id])
+            else:
+                cur.execute("SELECT id FROM events WHERE id = %s", (event_id,))
+            if cur.fetchone() is None:
+                cur.close()
+                conn.close()
+                return jsonify({"error": "Event not found."}), 404
+            if 'timeline_ids' in data:
+                # Replace the event's timeline links with the given set
+                cur.execute("""
+                    WITH removed AS (
+                        DELETE FROM timeline_events WHERE event_id = %s AND NOT (timeline_id = ANY(%s))
+                    )
+                    INSERT INTO timeline_events (event_id, timeline_id, added_by_user_id)
+                    SELECT %s, t.id, %s FROM timelines t
+                    WHERE t.id = ANY(%s)
+                    ON CONFLICT (event_id, timeline_id) DO NOTHING
+                """, (event_id, data['timeline_ids'], event_id, session['user_id'], data['timeline_ids']))
+            global_events_changed(cur)
+            conn.commit()
+            cur.close()
+            conn.close()
+            global_events_cache.invalidate()
+            event = next((e for e in visible_global_events() if e['id'] == event_id), None)
+            return jsonify(event)
+        except Exception as e:
+            print(f"Error updating global event: {e}")
+            return jsonify({"error": str(e)}), 500
+
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        # Timeline links, instances and media go with the event via ON DELETE CASCADE
+        cur.execute("""
+            WITH files AS (
+                SELECT m.file_url FROM media m JOIN instances i ON i.id = m.instance_id
+                WHERE i.event_id = %s
+            ), deleted AS (
+                DELETE FROM events WHERE id = %s RETURNING id
+            )
+            SELECT (SELECT count(*) FROM deleted), ARRAY(SELECT file_url FROM files)
+        """, (event_id, event_id))
+        deleted, file_urls = cur.fetchone()
+        if deleted:
+            global_events_changed(cur)
+            cancel_jobs(cur, file_urls=file_urls)
+        conn.commit()
+        cur.close()
+        conn.close()
+        if not deleted:
+            return jsonify({"error": "Event not found."}), 404
+        global_events_cache.invalidate()
+        enqueue_file_deletion(file_urls)
+        return '', 204
+    except Exception as e:
+        print(f"Error deleting global event: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/timelines/<int:timeline_id>/global-events/<int:event_id>', methods=['POST', 'DELETE'])
+@require_auth
+def timeline_global_event(timeline_id, event_id):
+    """Show (POST) or hide (DELETE) a global event on a timeline the user can edit"""
+    try:
+        access_sql, access_params = timeline_access('t.id', 'edit')
+        conn = get_db_connection()
+        cur = conn.cursor()
+        if request.method == 'POST':
+            cur.execute(f"""
+                WITH target AS (
+                    SELECT e.id AS event_id, t.id AS timeline_id FROM events e, timelines t
+                    WHERE e.id = %s AND t.id = %s AND {access_sql}
+                ), inserted AS (
+                    INSERT INTO timeline_events (event_id, timeline_id, added_by_user_id)
+                    SELECT event_id, timeline_id, %s FROM target
+                    ON CONFLICT (event_id, timeline_id) DO NOTHING
+                    RETURNING id
+                )
+                SELECT (SELECT count(*) FROM target), (SELECT count(*) FROM inserted)
+            """, [event_id, timeline_id] + access_params + [session['user_id']])
+            found, inserted = cur.fetchone()
+            if not found:
+                cur.close()
+                conn.close()
+                return jsonify({"error": "Event or timeline not found."}), 404
+            changed = inserted > 0
+        else:
+            cur.execute(f"""
+                DELETE FROM timeline_events te USING timelines t
+                WHERE te.timeline_id = t.id AND te.event_id = %s AND t.id = %s AND {access_sql}
+            """, [event_id, timeline_id] + access_params)
+            changed = cur.rowcount > 0
+        if changed:
+            global_events_changed(cur)
+        conn.commit()
+        cur.close()
+        conn.close()
+        if changed:
+            global_events_cache.invalidate()
+        elif request.method == 'DELETE':
+            return jsonify({"error": "Event is not on this timeline."}), 404
+        return jsonify({"success": True, "timeline_id": timeline_id, "event_id": event_id})
+    except Exception as e:
+        print(f"Error linking global event: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/changes', methods=['GET'])
+@require_auth
+def changes():
+    """Timelines, occurrences and spans changed since ?since=<version>"""
+    try:
+        since = request.args.get('since', type=int)
+        timeline_id = request.args.get('timeline_id', type=int)
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        payload = fetch_changes(cur, since, timeline_id, timeline_access('timeline_id'))
+        cur.close()
+        conn.close()
+        if since is None and settings.database_replica_urls:
+            # The version comes from the primary; the listings loaded against it
+            # must too, or a lagging replica could miss changes before it
+            session['baseline_at'] = time.time()
+        # Tells clients whether /changes/stream is served or they should keep polling
+        payload['stream'] = CHANGE_STREAM_MAX > 0
+        return jsonify(payload)
+    except Exception as e:
+        print(f"Error fetching changes: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/changes/stream', methods=['GET'])
+@require_auth
+def change_stream():
+    """
+    Server-Sent Events version of /changes. Holds one LISTEN connection per
+    client and pushes a `changes` event whenever a mutation commits. At most
+    CHANGE_STREAM_MAX streams per process; beyond that (or with SSE turned
+    off) clients get 503 and poll /changes.
+    """
+    if not change_stream_slots.acquire(blocking=False):
+        return jsonify({"error": "Live updates are unavailable, poll /changes"}), 503, {
+            'Retry-After': str(CHANGE_STREAM_MAX_AGE)}
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+    timeline_id = request.args.get('timeline_id', type=int)
+    access = timeline_access('timeline_id')
+
+    def generate(since):
+        conn = get_db_connection(dedicated=True)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        ends_at = time.monotonic() + CHANGE_STREAM_MAX_AGE
+        try:
+            cur.execute("LISTEN timeline_changes")
+            yield f"retry: {CHANGE_STREAM_RETRY_MS}\n\n"
+            first = True
+            while time.monotonic() < ends_at:
+                payload = fetch_changes(cur, since, timeline_id, access)
+                if first or payload['changes']:
+                    first = False
+                    since = payload['version']
+                    yield f"id: {since}\nevent: changes\ndata: {json.dumps(payload)}\n\n"
+                    if payload['has_more']:
+                        continue
+                # Sleep until a NOTIFY arrives, sending a comment line as keepalive
+                if select.select([conn], [], [], CHANGE_STREAM_HEARTBEAT) == ([], [], []):
+                    yield ": keepalive\n\n"
+                    continue
+                conn.poll()
+                conn.notifies.clear()
+        except Exception as e:
+            print(f"Change stream closed: {e}")
+        finally:
+            cur.close()
+            conn.close()
+
+    response = Response(stream_with_context(generate(since)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the response is closed, whether or not the stream ever started
+    response.call_on_close(change_stream_slots.release)
+    return response
+
 @app.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -314,37 +1208,40 @@ def login():
 
 # Add more routes like /occurrences, /events, /messages here
 
+def serve_page(name, missing_message):
+    """Cached page; in debug mode it's rebuilt whenever the file changes"""
+    page = assets.page(name, check_changes=app.debug)
+    if page is None:
+        return missing_message, 404
+    return asset_response(page, PAGE_CACHE_CONTROL)
+
 @app.route('/')
 def index():
     """Redirect to login if not authenticated, otherwise serve timeline"""
     if 'user_id' not in session:
         return redirect('/login')
-    try:
-        with open('timeline.html', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "Timeline application not found", 404
+    return serve_page('timeline.html', "Timeline application not found")
 
 @app.route('/login')
 def login_page():
     """Serve the login page"""
     if 'user_id' in session:
         return redirect('/')
-    try:
-        with open('login.html', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "Login page not found", 404
+    return serve_page('login.html', "Login page not found")
 
 @app.route('/timeline')
 @require_auth
 def timeline_page():
     """Serve the timeline page (requires authentication)"""
-    try:
-        with open('timeline.html', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "Timeline page not found", 404
+    return serve_page('timeline.html', "Timeline page not found")
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Content-hashed scripts and styles split out of the pages, cached forever"""
+    asset = assets.asset(filename)
+    if asset is None:
+        return "Asset not found", 404
+    return asset_response(asset, ASSET_CACHE_CONTROL)
 
 @app.route('/logout')
 def logout():
@@ -365,11 +1262,186 @@ def serve_media(filename):
     except FileNotFoundError:
         return jsonify({"error": "File not found"}), 404
 
+def store_upload(file):
+    """
+    Move one uploaded file into uploads/ under a unique name, raising
+    UploadRejected if it failed validation. Runs while the request's files
+    are still open; returns what process_upload() needs.
+    """
+    # Create uploads directory if it doesn't exist
+    uploads_dir = 'uploads'
+    if not os.path.exists(uploads_dir):
+        os.makedirs(uploads_dir)
+
+    # Generate unique filename
+    filename = secure_filename(file.filename)
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+
+    # Move the validated temp file into place (raises UploadRejected)
+    upload_path = os.path.join(uploads_dir, unique_filename)
+    checksum = None
+    content_type = file.content_type
+    if isinstance(file.stream, UploadStream):
+        file.stream.commit(upload_path)
+        content_type = file.stream.content_type
+        checksum = file.stream.sha256.hexdigest()
+    else:
+        file.save(upload_path)
+    return {"filename": filename, "unique_filename": unique_filename, "path": upload_path,
+            "content_type": content_type, "sha256": checksum}
+
+# Content types of the display copies the image and audio pipelines write
+PROCESSED_CONTENT_TYPES = {'.jpg': 'image/jpeg', '.webp': 'image/webp', '.m4a': 'audio/mp4'}
+
+def cancelled_upload(filename, unique_filename, job_id):
+    """The upload (or what it was attached to) was deleted while processing"""
+    finish_job(job_id, 'cancelled')
+    enqueue_file_deletion(variant_urls(f"/uploads/{unique_filename}"))
+    return {"success": False, "cancelled": True, "filename": filename, "job_id": job_id,
+            "error": "Processing was cancelled"}
+
+def finish_processing(job_id, job_status, unique_filename, final_path, decision):
+    """Close the media job and record the processing decision; returns the URL to serve"""
+    file_url = f"/uploads/{os.path.basename(final_path)}"
+    try:
+        finish_job(job_id, job_status, output_url=file_url)
+    except Exception as e:
+        print(f"Error finishing media job: {e}")
+
+    # Record what was done; a failure here shouldn't fail the upload
+    if decision:
+        try:
+            from video_pipeline import record_decision
+            conn = get_db_connection()
+            cur = conn.cursor()
+            record_decision(cur, f"/uploads/{unique_filename}", file_url, decision)
+            conn.commit()
+            cur.close()
+            conn.close()
+        except Exception as e:
+            print(f"Error recording processing decision: {e}")
+    return file_url
+
+def process_upload(stored, job_id=None, upload_id=None):
+    """
+    Run video or image processing on a stored upload (see store_upload); returns the file info for the client.
+    Processing is tracked as media job `job_id` (generated when not given).
+    """
+    filename, unique_filename = stored['filename'], stored['unique_filename']
+    upload_path, content_type = stored['path'], stored['content_type']
+    original_url = None  # Set when a display copy is served instead of the uploaded file
+
+    # Check if it's a video file
+    decision = None
+    if content_type and content_type.startswith('video/'):
+        print(f"Video uploaded: {unique_filename}, type: {content_type}")
+        final_path = upload_path
+
+        job_id = job_id or str(uuid.uuid4())
+        try:
+            create_job(job_id, f"/uploads/{unique_filename}", upload_id, user_id=session.get('user_id'))
+        except Exception as e:
+            print(f"Error creating media job: {e}")
+
+        # Probe once, then passthrough / remux / re-encode only what browsers can't play
+        job_status = 'failed'
+        try:
+            from video_pipeline import process_video
+            processed_path, decision = process_video(upload_path, job_id=job_id)
+            if processed_path:
+                final_path = processed_path
+                job_status = 'done'
+
+                # Quick orientation fix if the video stream was re-encoded
+                if decision['video'] == 'encode':
+                    try:
+                        from fix_video_orientation import fix_video_orientation
+                        from segment_encode import encode_timeout
+                        fixed_path = fix_video_orientation(
+                            processed_path,
+                            on_progress=ProgressTracker(job_id, decision['duration'], stage='orientation'),
+                            timeout=encode_timeout(decision['duration'])
+                        )
+                        if fixed_path:
+                            print(f"Successfully fixed video orientation to: {os.path.basename(fixed_path)}")
+                            final_path = fixed_path
+                    except EncodeCancelled:
+                        raise
+                    except Exception as e:
+                        print(f"Error during orientation fixing: {e}")
+            else:
+                print(f"Failed to process video, using original")
+        except EncodeCancelled:
+            return cancelled_upload(filename, unique_filename, job_id)
+        except Exception as e:
+            print(f"Error processing video: {e}")
+
+        file_url = finish_processing(job_id, job_status, unique_filename, final_path, decision)
+        file_size = os.path.getsize(final_path)
+    elif content_type and content_type.startswith(('image/', 'audio/')):
+        # Photos get a rotated, metadata-free display copy, audio a web codec
+        # and waveform peaks; the original is kept
+        kind = content_type.split('/')[0]
+        job_id = job_id or str(uuid.uuid4())
+        try:
+            create_job(job_id, f"/uploads/{unique_filename}", upload_id, kind=kind, user_id=session.get('user_id'))
+        except Exception as e:
+            print(f"Error creating media job: {e}")
+        final_path = upload_path
+        job_status = 'failed'
+        try:
+            if kind == 'image':
+                from image_pipeline import process_image as process
+            else:
+                from audio_pipeline import process_audio as process
+            processed_path, decision = process(upload_path, job_id=job_id)
+            if processed_path and decision:
+                final_path = processed_path
+                job_status = 'done'
+        except EncodeCancelled:
+            return cancelled_upload(filename, unique_filename, job_id)
+        except Exception as e:
+            print(f"Error processing {kind}: {e}")
+
+        file_url = finish_processing(job_id, job_status, unique_filename, final_path, decision)
+        file_size = os.path.getsize(final_path)
+        if final_path != upload_path:
+            content_type = PROCESSED_CONTENT_TYPES[os.path.splitext(final_path)[1]]
+            original_url = f"/uploads/{unique_filename}"
+    else:
+        # Non-video file
+        file_url = f"/uploads/{unique_filename}"
+        file_size = os.path.getsize(upload_path)
+
+    # Track every file of the upload for retention and usage accounting
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        media_storage.record_variants(cur, f"/uploads/{unique_filename}", file_url, session.get('user_id'))
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error recording upload variants: {e}")
+
+    return {
+        "success": True,
+        "filename": filename,
+        "url": file_url,
+        "original_url": original_url,
+        "type": content_type,
+        "size": file_size,
+        "sha256": stored['sha256'],
+        "processing": decision,
+        "job_id": job_id
+    }
+
 @app.route('/upload', methods=['POST'])
 @require_auth
 def upload_file():
     """Handle file uploads with optimized video processing"""
     try:
+        admit_upload()
         if 'file' not in request.files:
             return jsonify({"error": "No file provided"}), 400
         
@@ -377,103 +1449,112 @@ def upload_file():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Create uploads directory if it doesn't exist
-        uploads_dir = 'uploads'
-        if not os.path.exists(uploads_dir):
-            os.makedirs(uploads_dir)
-        
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        
-        # Save file to uploads directory
-        upload_path = os.path.join(uploads_dir, unique_filename)
-        file.save(upload_path)
-        
-        # Check if it's a video file
-        if file.content_type and file.content_type.startswith('video/'):
-            print(f"Video uploaded: {unique_filename}, type: {file.content_type}")
-            
-            # Quick check if video is already web-compatible
-            try:
-                import subprocess
-                result = subprocess.run([
-                    'ffprobe', '-v', 'quiet', '-select_streams', 'v:0', 
-                    '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', upload_path
-                ], capture_output=True, text=True, timeout=5)
-                
-                codec = result.stdout.strip()
-                print(f"Video codec: {codec}")
-                
-                # If it's already H.264, skip transcoding
-                if codec == 'h264':
-                    print(f"Video is already H.264, skipping transcoding")
-                    file_url = f"/uploads/{unique_filename}"
-                    file_size = os.path.getsize(upload_path)
-                else:
-                    # Only transcode if necessary (HEVC/H.265)
-                    if codec in ['hevc', 'h265']:
-                        print(f"Transcoding HEVC video to H.264...")
-                        try:
-                            from transcode_video import transcode_video
-                            transcoded_path = transcode_video(upload_path)
-                            if transcoded_path:
-                                transcoded_filename = os.path.basename(transcoded_path)
-                                print(f"Successfully transcoded video to: {transcoded_filename}")
-                                
-                                # Quick orientation fix if needed
-                                try:
-                                    from fix_video_orientation import fix_video_orientation
-                                    fixed_path = fix_video_orientation(transcoded_path)
-                                    if fixed_path:
-                                        fixed_filename = os.path.basename(fixed_path)
-                                        print(f"Successfully fixed video orientation to: {fixed_filename}")
-                                        file_url = f"/uploads/{fixed_filename}"
-                                        file_size = os.path.getsize(fixed_path)
-                                    else:
-                                        file_url = f"/uploads/{transcoded_filename}"
-                                        file_size = os.path.getsize(transcoded_path)
-                                except Exception as e:
-                                    print(f"Error during orientation fixing: {e}")
-                                    file_url = f"/uploads/{transcoded_filename}"
-                                    file_size = os.path.getsize(transcoded_path)
-                            else:
-                                print(f"Failed to transcode video, using original")
-                                file_url = f"/uploads/{unique_filename}"
-                                file_size = os.path.getsize(upload_path)
-                        except Exception as e:
-                            print(f"Error during video transcoding: {e}")
-                            file_url = f"/uploads/{unique_filename}"
-                            file_size = os.path.getsize(upload_path)
-                    else:
-                        # For other codecs, just use the original
-                        print(f"Using original video (codec: {codec})")
-                        file_url = f"/uploads/{unique_filename}"
-                        file_size = os.path.getsize(upload_path)
-                        
-            except Exception as e:
-                print(f"Error checking video codec: {e}")
-                # Fallback to original file
-                file_url = f"/uploads/{unique_filename}"
-                file_size = os.path.getsize(upload_path)
-        else:
-            # Non-video file
-            file_url = f"/uploads/{unique_filename}"
-            file_size = os.path.getsize(upload_path)
-        
-        # Return file info immediately
-        return jsonify({
-            "success": True,
-            "filename": filename,
-            "url": file_url,
-            "type": file.content_type,
-            "size": file_size
-        })
+        # Clients pick the upload id so they can poll /media/jobs while this request runs
+        upload_id = request.headers.get('X-Upload-Id')
+        result = process_upload(store_upload(file), job_id=upload_id, upload_id=upload_id)
+        if result.get('cancelled'):
+            return jsonify(result), 409
+        return jsonify(result)
         
+    except UploadRejected as e:
+        print(f"Upload rejected: {e.message}")
+        return e.response()
     except Exception as e:
         print(f"Error uploading file: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/media/queue', methods=['GET'])
+@require_admin
+def media_queue():
+    """Encode queue depth and slot usage, and uploads against the admission limits"""
+    stats = queue_stats()
+    try:
+        stats['uploads'] = upload_admission.admission_stats()
+    except Exception as e:
+        print(f"Error reading upload admission stats: {e}")
+    return jsonify(stats)
+
+@app.route('/queries/stats', methods=['GET'])
+@require_admin
+def query_stats():
+    """Timings of the registered queries in this worker"""
+    return jsonify(queries.query_stats())
+
+@app.route('/profiles', methods=['GET'])
+@app.route('/profiles/<profile_id>', methods=['GET'])
+@require_admin
+def request_profiles(profile_id=None):
+    """Recent request profiles, or one profile's summary (SQL and subprocess timings included)"""
+    if profile_id is None:
+        return jsonify(request_profiler.list_profiles(request.args.get('limit', 50, type=int)))
+    path = request_profiler.profile_path(profile_id, '.json')
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    with open(path) as f:
+        return Response(f.read(), mimetype='application/json')
+
+@app.route('/profiles/<profile_id>/folded', methods=['GET'])
+@require_admin
+def request_profile_stacks(profile_id):
+    """A profile's collapsed stacks, for flamegraph.pl or speedscope"""
+    path = request_profiler.profile_path(profile_id, '.folded')
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_from_directory(os.path.abspath(request_profiler.PROFILE_DIR), os.path.basename(path),
+                               mimetype='text/plain', as_attachment=True, download_name=f"{profile_id}.folded")
+
+@app.route('/storage/usage', methods=['GET'])
+@require_auth
+def storage_usage():
+    """Hot and cold storage used by the session user's uploads and the timelines they own (admins: everyone's)"""
+    try:
+        conn = get_read_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        is_admin = session.get('role') == 'admin'
+        users = media_storage.usage_by_user(cur, None if is_admin else session['user_id'])
+        access_sql, access_params = timeline_access('t.id', 'owner')
+        timelines = media_storage.usage_by_timeline(cur, access_sql, access_params)
+        cur.close()
+        conn.close()
+        return jsonify({"users": users, "timelines": timelines})
+    except Exception as e:
+        print(f"Error reading storage usage: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/media/jobs', methods=['GET'])
+@app.route('/media/jobs/<job_id>', methods=['GET', 'DELETE'])
+@require_auth
+def media_jobs(job_id=None):
+    """Progress of the session user's processing jobs by id or ?upload_id=, or DELETE to cancel one (admins: anyone's)"""
+    owner = None if session.get('role') == 'admin' else session['user_id']
+    try:
+        if request.method == 'DELETE':
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cancelled = cancel_jobs(cur, job_id=job_id, user_id=owner)
+            conn.commit()
+            cur.close()
+            conn.close()
+            if not cancelled:
+                return jsonify({"error": "No running job with that id"}), 404
+            return jsonify({"success": True, "cancel_requested": True})
+
+        upload_id = request.args.get('upload_id')
+        if job_id is None and upload_id is None:
+            return jsonify({"error": "Job id or upload_id required"}), 400
+        jobs = get_jobs(job_id=job_id, upload_id=upload_id, user_id=owner)
+        if job_id is not None:
+            if not jobs:
+                return jsonify({"error": "Job not found"}), 404
+            return jsonify(jobs[0])
+        return jsonify(jobs)
+    except Exception as e:
+        print(f"Error handling media job request: {e}")
+        return jsonify({"error": str(e)}), 500
+
+AUDIO_CONTENT_TYPES = {'.m4a': 'audio/mp4', '.mp3': 'audio/mpeg', '.wav': 'audio/wav', '.flac': 'audio/flac',
+                       '.oga': 'audio/ogg', '.opus': 'audio/ogg'}
+
 @app.route('/uploads/<path:filename>', methods=['GET', 'DELETE'])
 def serve_uploads(filename):
     """Serve uploaded files from the uploads directory with proper headers"""
@@ -485,6 +1566,13 @@ def serve_uploads(filename):
         if '?' in filename:
             filename = filename.split('?')[0]
         
+        # Originals moved to the cold tier come back on first request
+        if not os.path.exists(os.path.join('uploads', filename)):
+            try:
+                media_storage.restore(filename)
+            except Exception as e:
+                print(f"Error restoring {filename} from the cold tier: {e}")
+
         # Set proper headers for video files
         response = send_from_directory('uploads', filename)
         
@@ -493,9 +1581,16 @@ def serve_uploads(filename):
         response.headers['Access-Control-Allow-Methods'] = 'GET, DELETE, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Range'
         
+        # Audio streams with range requests (seeking); names are unique, so it can be cached
+        audio_type = AUDIO_CONTENT_TYPES.get(os.path.splitext(filename.lower())[1])
+        if audio_type:
+            response.headers['Content-Type'] = audio_type
+            response.headers['Accept-Ranges'] = 'bytes'
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+
         # Set proper content type for video files
         if filename.lower().endswith(('.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv')):
-            response.headers['Content-Type'] = 'video/mp4'
+            response.headers['Content-Type'] = 'video/webm' if filename.lower().endswith('.webm') else 'video/mp4'
             # Enable range requests for video streaming
             response.headers['Accept-Ranges'] = 'bytes'
             # Add cache control headers
@@ -508,97 +1603,77 @@ def serve_uploads(filename):
         return jsonify({"error": "File not found"}), 404
 
 def delete_uploaded_file(filename):
-    """Delete an uploaded file from disk and database"""
+    """
+    Delete an uploaded file's database records and queue the file (and its
+    variants) for removal. A file with no attachments the user can edit may
+    only be removed by its uploader (or an admin).
+    """
     try:
         print(f"Attempting to delete file: {filename}")
         
         # Clean the filename
         clean_filename = filename.split('?')[0]
-        file_path = os.path.join('uploads', clean_filename)
+        file_url = f'/uploads/{clean_filename}'
         
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
-            return jsonify({"error": "File not found"}), 404
-        
-        # Delete the file from disk
-        os.remove(file_path)
-        print(f"Successfully deleted file from disk: {file_path}")
-        
-        # Also try to delete all related versions of the file
-        base_name = clean_filename.replace('_web_fixed.mp4', '').replace('_web.mp4', '').replace('.mp4', '')
-        
-        # Delete original file
-        original_filename = f"{base_name}.mp4"
-        original_path = os.path.join('uploads', original_filename)
-        if os.path.exists(original_path) and original_filename != clean_filename:
-            os.remove(original_path)
-            print(f"Also deleted original file: {original_filename}")
-        
-        # Delete transcoded file
-        transcoded_filename = f"{base_name}_web.mp4"
-        transcoded_path = os.path.join('uploads', transcoded_filename)
-        if os.path.exists(transcoded_path) and transcoded_filename != clean_filename:
-            os.remove(transcoded_path)
-            print(f"Also deleted transcoded file: {transcoded_filename}")
-        
-        # Delete fixed file
-        fixed_filename = f"{base_name}_web_fixed.mp4"
-        fixed_path = os.path.join('uploads', fixed_filename)
-        if os.path.exists(fixed_path) and fixed_filename != clean_filename:
-            os.remove(fixed_path)
-            print(f"Also deleted fixed file: {fixed_filename}")
-        
-        # Also delete from database
+        # Deleting the instances takes their media rows with them (ON DELETE CASCADE).
+        # Only attachments on timelines the user can edit are removed; the GC
+        # keeps the file itself while anything else still references it.
+        occurrence_sql, occurrence_params = occurrence_access('i.occurrence_id', 'edit')
+        span_sql, span_params = timeline_access('timeline_id', 'edit')
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        # First find the instance_id for this file
+        cur.execute(f"""
+            WITH doomed AS (
+                SELECT m.instance_id FROM media m JOIN instances i ON i.id = m.instance_id
+                WHERE m.file_url = %s
+                  AND ({occurrence_sql} OR i.span_id IN (SELECT id FROM spans WHERE {span_sql}))
+            ), deleted AS (
+                DELETE FROM instances WHERE id IN (SELECT instance_id FROM doomed) RETURNING id
+            )
+            SELECT (SELECT count(*) FROM doomed), (SELECT count(*) FROM deleted)
+        """, [file_url] + occurrence_params + span_params)
+        media_deleted, instances_deleted = cur.fetchone()
+        owner = None if session.get('role') == 'admin' else session['user_id']
         cur.execute("""
-            SELECT instance_id FROM media WHERE file_url = %s
-        """, (f'/uploads/{clean_filename}',))
+            SELECT EXISTS (SELECT 1 FROM media_variants WHERE file_url = %s),
+                   %s::int IS NULL
+                   OR EXISTS (SELECT 1 FROM media_variants WHERE file_url = %s AND user_id = %s)
+                   OR EXISTS (SELECT 1 FROM media_jobs WHERE source_family = %s AND user_id = %s)
+        """, (file_url, owner, file_url, owner, family_base(clean_filename), owner))
+        tracked, uploaded_by_user = cur.fetchone()
+
+        if instances_deleted == 0:
+            if not tracked and not os.path.exists(os.path.join('uploads', clean_filename)):
+                conn.rollback()
+                cur.close()
+                conn.close()
+                print(f"File not found: {clean_filename}")
+                return jsonify({"error": "File not found"}), 404
+            if not uploaded_by_user:
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return jsonify({"error": "You can't delete this file."}), 403
+
+        # Stop any encode still working on this upload. Having removed its last
+        # attachments is enough; otherwise only the uploader's own jobs
+        cancel_jobs(cur, file_urls=[file_url], user_id=None if instances_deleted else owner)
+        conn.commit()
+        cur.close()
+        conn.close()
         
-        instance_result = cur.fetchone()
-        if instance_result:
-            instance_id = instance_result[0]
-            print(f"Found instance_id: {instance_id}")
-            
-            # Delete from media table first (due to foreign key constraint)
-            cur.execute("""
-                DELETE FROM media WHERE file_url = %s
-            """, (f'/uploads/{clean_filename}',))
-            
-            media_deleted = cur.rowcount
-            
-            # Then delete from instances table
-            cur.execute("""
-                DELETE FROM instances WHERE id = %s
-            """, (instance_id,))
-            
-            instances_deleted = cur.rowcount
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            print(f"Deleted {media_deleted} media records and {instances_deleted} instances")
-            
-            return jsonify({
-                "success": True, 
-                "message": "File deleted successfully",
-                "file": clean_filename,
-                "media_deleted": media_deleted,
-                "instances_deleted": instances_deleted
-            })
-        else:
-            print(f"No media record found for file: {clean_filename}")
-            conn.close()
-            return jsonify({
-                "success": True, 
-                "message": "File deleted from disk (no database record found)",
-                "file": clean_filename,
-                "media_deleted": 0,
-                "instances_deleted": 0
-            })
+        # Original, intermediate and served copies are unlinked by the background GC,
+        # which finds them in media_variants; older uploads' siblings are guessed by name
+        enqueue_file_deletion([file_url] if tracked else variant_urls(file_url))
+        print(f"Deleted {media_deleted} media records and {instances_deleted} instances, queued {clean_filename} and its variants for removal")
+        
+        return jsonify({
+            "success": True, 
+            "message": "File deleted successfully",
+            "file": clean_filename,
+            "media_deleted": media_deleted,
+            "instances_deleted": instances_deleted
+        })
         
     except Exception as e:
         print(f"Error deleting file {filename}: {e}")
@@ -606,6 +1681,44 @@ def delete_uploaded_file(filename):
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+def attach_media(cur, occurrence_id, files):
+    """
+    Attach files to an occurrence with one statement: instance ids are drawn
+    from the sequence up front so the instances and media multi-row INSERTs
+    line up without a round trip per file. Returns one row per file in input
+    order, or an empty list when the occurrence doesn't exist or the session
+    user can't edit its timeline.
+    """
+    access_sql, access_params = timeline_access('timeline_id', 'edit')
+    cur.execute(f"""
+        WITH files AS (
+            SELECT nextval(pg_get_serial_sequence('instances', 'id'))::int AS instance_id,
+                   f.file_url, f.file_type, f.ord
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS f(file_url, file_type, ord)
+            WHERE EXISTS (SELECT 1 FROM occurrences WHERE id = %s AND {access_sql})
+        ), new_instances AS (
+            INSERT INTO instances (id, occurrence_id, content)
+            SELECT instance_id, %s, 'File: ' || file_url FROM files
+        ), new_media AS (
+            -- Dimensions, duration and waveform come from the processing record of the uploaded file
+            INSERT INTO media (instance_id, file_url, file_type, width, height, duration, waveform)
+            SELECT f.instance_id, f.file_url, f.file_type, p.width, p.height, p.duration, p.waveform
+            FROM files f
+            LEFT JOIN LATERAL (
+                SELECT (decision->>'width')::int AS width, (decision->>'height')::int AS height,
+                       (decision->>'duration')::real AS duration, decode(decision->>'waveform', 'base64') AS waveform
+                FROM media_processing WHERE output_url = f.file_url
+                ORDER BY id DESC LIMIT 1
+            ) p ON true
+            RETURNING id, instance_id
+        )
+        SELECT f.instance_id, m.id AS media_id, f.file_url, f.file_type
+        FROM files f JOIN new_media m ON m.instance_id = f.instance_id
+        ORDER BY f.ord
+    """, [[f['file_url'] for f in files], [f.get('file_type') for f in files], occurrence_id]
+         + access_params + [occurrence_id])
+    return cur.fetchall()
+
 @app.route('/messages/<int:occurrence_id>/files', methods=['POST'])
 @require_auth
 def attach_file_to_message(occurrence_id):
@@ -623,52 +1736,26 @@ def attach_file_to_message(occurrence_id):
             print("No file URL provided")
             return jsonify({"error": "No file URL provided"}), 400
         
-        print(f"File URL: {file_url}")
-        print(f"File type: {file_type}")
-        print(f"File size: {file_size}")
-        
         conn = get_db_connection()
-        cur = conn.cursor()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Check if occurrence exists
-        cur.execute("SELECT id FROM occurrences WHERE id = %s", (occurrence_id,))
-        occurrence = cur.fetchone()
-        if not occurrence:
+        # Check the occurrence and create the instance and media record in one statement
+        attached = attach_media(cur, occurrence_id, [{'file_url': file_url, 'file_type': file_type}])
+        if not attached:
             print(f"Occurrence {occurrence_id} not found")
+            conn.rollback()
+            cur.close()
+            conn.close()
             return jsonify({"error": "Occurrence not found"}), 404
         
-        print(f"Occurrence {occurrence_id} found")
-        
-        # Create instance for the file
-        print("Creating instance...")
-        cur.execute("""
-            INSERT INTO instances (occurrence_id, content) 
-            VALUES (%s, %s) 
-            RETURNING id
-        """, (occurrence_id, f"File: {file_url}"))
-        
-        instance_id = cur.fetchone()[0]
-        print(f"Created instance {instance_id}")
-        
-        # Create media record with additional metadata
-        print("Creating media record...")
-        cur.execute("""
-            INSERT INTO media (instance_id, file_url, file_type) 
-            VALUES (%s, %s, %s)
-            RETURNING id
-        """, (instance_id, file_url, file_type))
-        
-        media_id = cur.fetchone()[0]
-        print(f"Created media record {media_id}")
-        
         conn.commit()
         cur.close()
         conn.close()
         
         result = {
             "success": True, 
-            "instance_id": instance_id,
-            "media_id": media_id,
+            "instance_id": attached[0]['instance_id'],
+            "media_id": attached[0]['media_id'],
             "file_url": file_url,
             "file_type": file_type,
             "file_size": file_size
@@ -681,63 +1768,275 @@ def attach_file_to_message(occurrence_id):
         print(f"Traceback: {traceback.format_exc()}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/occurrences/<int:occurrence_id>/messages', methods=['GET'])
+# Upper bound on files per batch attach/upload request
+MAX_BATCH_FILES = 500
+
+@app.route('/messages/<int:occurrence_id>/files/batch', methods=['POST'])
 @require_auth
-def get_occurrence_messages(occurrence_id):
-    """Get messages and files for a specific occurrence"""
+def attach_files_to_message(occurrence_id):
+    """Attach many already-uploaded files to an occurrence in one transaction"""
     try:
-        print(f"Fetching messages for occurrence {occurrence_id}")
+        data = request.get_json() or {}
+        files = data.get('files') or []
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({"error": f"At most {MAX_BATCH_FILES} files per batch"}), 400
+        if any(not f.get('file_url') for f in files):
+            return jsonify({"error": "Every file needs a file_url"}), 400
+        
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
+        attached = attach_media(cur, occurrence_id, files)
+        if not attached:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Occurrence not found"}), 404
+        conn.commit()
+        cur.close()
+        conn.close()
         
-        # Get instances (messages and files) for this occurrence
-        cur.execute("""
-            SELECT i.id, i.content, i.created_at, m.file_url, m.file_type
-            FROM instances i
-            LEFT JOIN media m ON i.id = m.instance_id
-            WHERE i.occurrence_id = %s
-            ORDER BY i.created_at
-        """, (occurrence_id,))
+        print(f"Attached {len(attached)} files to occurrence {occurrence_id}")
+        return jsonify({
+            "success": True,
+            "files": [
+                {**dict(row), "success": True, "file_size": f.get('file_size', 0)}
+                for row, f in zip(attached, files)
+            ]
+        })
+    except Exception as e:
+        print(f"Error attaching files: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/batch', methods=['POST'])
+@require_auth
+def upload_files():
+    """
+    Upload many files in one request. Each file's result is streamed back as
+    an NDJSON line as soon as it has been processed; when an `occurrence_id`
+    form field is given, the successful files are then attached in a single
+    transaction and a final `attached` line reports the new ids.
+    The whole batch counts as one upload for admission control.
+    """
+    admit_upload()
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({"error": f"At most {MAX_BATCH_FILES} files per batch"}), 400
+    occurrence_id = request.form.get('occurrence_id', type=int)
+    upload_id = request.headers.get('X-Upload-Id') or str(uuid.uuid4())
+
+    # Move every file into place now: the request's files are closed once the response starts
+    stored = []
+    for file in files:
+        try:
+            stored.append(store_upload(file))
+        except UploadRejected as e:
+            print(f"Upload of {file.filename} rejected: {e.message}")
+            stored.append({"success": False, "filename": file.filename, "error": e.message, "status": e.status})
+        except Exception as e:
+            print(f"Error storing file {file.filename}: {e}")
+            stored.append({"success": False, "filename": file.filename, "error": str(e)})
+
+    def generate():
+        uploaded = []
+        for index, upload in enumerate(stored):
+            if 'path' not in upload:
+                result = upload
+            else:
+                try:
+                    result = process_upload(upload, job_id=f"{upload_id}:{index}", upload_id=upload_id)
+                    if result['success']:
+                        uploaded.append(result)
+                except Exception as e:
+                    print(f"Error uploading file {upload['filename']}: {e}")
+                    result = {"success": False, "filename": upload['filename'], "error": str(e)}
+            yield json.dumps({"index": index, **result}) + '\n'
+
+        if occurrence_id is None or not uploaded:
+            return
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            attached = attach_media(cur, occurrence_id,
+                                    [{'file_url': u['url'], 'file_type': u['type']} for u in uploaded])
+            if attached:
+                conn.commit()
+                yield json.dumps({"attached": [dict(row) for row in attached]}) + '\n'
+            else:
+                conn.rollback()
+                yield json.dumps({"attached": [], "error": "Occurrence not found"}) + '\n'
+            cur.close()
+            conn.close()
+        except Exception as e:
+            print(f"Error attaching uploaded files: {e}")
+            yield json.dumps({"attached": [], "error": str(e)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Messages per page of an occurrence's history, newest first
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+def format_instance(instance):
+    """An instance row as the detail view expects it: a file attachment or a text message"""
+    if instance['file_url']:
+        local_path = os.path.join('uploads', os.path.basename(instance['file_url']))
+        return {
+            'type': instance['file_type'] or '',
+            'name': os.path.basename(instance['file_url']),
+            'url': instance['file_url'],
+            'timestamp': instance['created_at'].isoformat(),
+            'size': os.path.getsize(local_path) if os.path.exists(local_path) else 0,
+            'width': instance.get('width'),
+            'height': instance.get('height'),
+            'duration': instance.get('duration'),
+            # Signed (min, max) byte pairs, base64; see audio_pipeline.waveform_peaks
+            'waveform': base64.b64encode(instance['waveform']).decode('ascii') if instance.get('waveform') else None,
+            'media_id': instance['id']  # This is the instance_id, which is what we need for the old delete endpoint
+        }
+    return {
+        'type': 'message',
+        'id': instance['id'],
+        'text': instance['content'],
+        'timestamp': instance['created_at'].isoformat()
+    }
+
+def message_cursor(instance):
+    """Opaque keyset cursor pointing just past `instance`"""
+    return f"{instance['created_at'].isoformat()},{instance['id']}"
+
+def message_page_query(keyset):
+    return f"""
+        SELECT i.id, i.content, i.created_at, m.file_url, m.file_type, m.width, m.height,
+               m.duration, m.waveform
+        FROM instances i
+        LEFT JOIN media m ON i.id = m.instance_id
+        WHERE i.occurrence_id = %s {keyset} AND {{access}}
+        ORDER BY i.created_at DESC, i.id DESC
+        LIMIT %s
+    """
+
+MESSAGE_PAGE = queries.register('messages.page', message_page_query(""))
+MESSAGE_PAGE_BEFORE = queries.register('messages.page_before',
+                                       message_page_query("AND (i.created_at, i.id) < (%s::timestamp, %s::integer)"))
+
+@app.route('/occurrences/<int:occurrence_id>/messages', methods=['GET', 'POST'])
+@require_auth
+def get_occurrence_messages(occurrence_id):
+    """
+    GET: one page of an occurrence's messages and files, newest first.
+    Pass the returned `next_cursor` as ?before= for the next (older) page.
+    POST: add a text message.
+    """
+    if request.method == 'POST':
+        return create_message(occurrence_id)
+    try:
+        limit = min(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), MAX_MESSAGE_PAGE_SIZE)
+        before = request.args.get('before')
+        statement = MESSAGE_PAGE
+        params = [occurrence_id]
+        if before:
+            try:
+                before_created_at, before_id = before.rsplit(',', 1)
+                params += [datetime.datetime.fromisoformat(before_created_at), int(before_id)]
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+            statement = MESSAGE_PAGE_BEFORE
+        access_sql, access_params = occurrence_access('i.occurrence_id')
+        conn = get_read_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
+        # One extra row tells us whether there's an older page
+        queries.execute(cur, statement, params + access_params + [max(limit, 1) + 1], access_sql)
         instances = cur.fetchall()
-        print(f"Found {len(instances)} instances for occurrence {occurrence_id}")
-        
         cur.close()
         conn.close()
         
-        # Format the results
-        result = []
-        for instance in instances:
-            print(f"Processing instance: {instance}")
-            if instance['file_url']:
-                # This is a file attachment
-                file_data = {
-                    'type': instance['file_type'] or '',
-                    'name': os.path.basename(instance['file_url']),
-                    'url': instance['file_url'],
-                    'timestamp': instance['created_at'].isoformat(),
-                    'size': os.path.getsize(os.path.join('uploads', os.path.basename(instance['file_url']))) if os.path.exists(os.path.join('uploads', os.path.basename(instance['file_url']))) else 0,
-                    'media_id': instance['id']  # This is the instance_id, which is what we need for the old delete endpoint
-                }
-                print(f"Adding file: {file_data}")
-                result.append(file_data)
-            else:
-                # This is a text message
-                message_data = {
-                    'type': 'message',
-                    'text': instance['content'],
-                    'timestamp': instance['created_at'].isoformat()
-                }
-                print(f"Adding message: {message_data}")
-                result.append(message_data)
-        
-        print(f"Returning {len(result)} items")
-        return jsonify(result)
+        has_more = len(instances) > limit
+        instances = instances[:limit]
+        print(f"Fetched {len(instances)} instances for occurrence {occurrence_id}")
+        return jsonify({
+            "items": [format_instance(instance) for instance in instances],
+            "next_cursor": message_cursor(instances[-1]) if has_more and instances else None
+        })
         
     except Exception as e:
         print(f"Error fetching messages: {e}")
         print(f"Traceback: {traceback.format_exc()}")
-        return jsonify([])
+        return jsonify({"error": str(e)}), 500
+
+INSERT_MESSAGE = queries.register('message.insert', """
+    INSERT INTO instances (occurrence_id, content)
+    SELECT o.id, %s::text FROM occurrences o
+    WHERE o.id = %s AND {access}
+    RETURNING id, content, created_at, NULL AS file_url, NULL AS file_type
+""")
+
+def create_message(occurrence_id):
+    try:
+        text = ((request.get_json() or {}).get('text') or '').strip()
+        if not text:
+            return jsonify({"error": "Message text required"}), 400
+        access_sql, access_params = occurrence_access('o.id', 'edit')
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        queries.execute(cur, INSERT_MESSAGE, [text, occurrence_id] + access_params, access_sql)
+        message = cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+        if not message:
+            return jsonify({"error": "Occurrence not found"}), 404
+        return jsonify(format_instance(message)), 201
+    except Exception as e:
+        print(f"Error creating message: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Text messages only: instances without media
+TEXT_MESSAGE = """
+    i.id = %s AND i.occurrence_id = %s AND {access}
+    AND NOT EXISTS (SELECT 1 FROM media m WHERE m.instance_id = i.id)
+"""
+UPDATE_MESSAGE = queries.register('message.update', f"""
+    UPDATE instances i SET content = %s
+    WHERE {TEXT_MESSAGE}
+    RETURNING i.id, i.content, i.created_at, NULL AS file_url, NULL AS file_type
+""")
+DELETE_MESSAGE = queries.register('message.delete', f"DELETE FROM instances i WHERE {TEXT_MESSAGE} RETURNING i.id")
+
+@app.route('/occurrences/<int:occurrence_id>/messages/<int:message_id>', methods=['PATCH', 'DELETE'])
+@require_auth
+def update_or_delete_message(occurrence_id, message_id):
+    """Edit or delete a text message; file attachments go through the /messages/.../files routes"""
+    try:
+        access_sql, access_params = occurrence_access('i.occurrence_id', 'edit')
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if request.method == 'PATCH':
+            text = ((request.get_json() or {}).get('text') or '').strip()
+            if not text:
+                cur.close()
+                conn.close()
+                return jsonify({"error": "Message text required"}), 400
+            queries.execute(cur, UPDATE_MESSAGE, [text, message_id, occurrence_id] + access_params, access_sql)
+        else:
+            queries.execute(cur, DELETE_MESSAGE, [message_id, occurrence_id] + access_params, access_sql)
+        message = cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+        if not message:
+            return jsonify({"error": "Message not found"}), 404
+        if request.method == 'DELETE':
+            return '', 204
+        return jsonify(format_instance(message))
+    except Exception as e:
+        print(f"Error updating message: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/messages/<int:occurrence_id>/files/<int:instance_id>', methods=['DELETE'])
 @require_auth
@@ -752,47 +2051,31 @@ def delete_file(occurrence_id, instance_id):
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Get the file info before deleting
-        print(f"Checking database for instance {instance_id} in occurrence {occurrence_id}")
-        cur.execute("""
-            SELECT m.file_url, i.occurrence_id, i.id as instance_id, m.id as media_id
-            FROM instances i
-            LEFT JOIN media m ON i.id = m.instance_id
-            WHERE i.id = %s AND i.occurrence_id = %s
-        """, (instance_id, occurrence_id))
-        
-        file_info = cur.fetchone()
-        print(f"Database query result: {file_info}")
-        if not file_info:
-            print(f"No file found in database for instance {instance_id}")
-            return jsonify({"error": "File not found"}), 404
-        
-        # Delete from media table first
-        print(f"Deleting from media table where instance_id = {instance_id}")
-        cur.execute("DELETE FROM media WHERE instance_id = %s", (instance_id,))
-        media_deleted = cur.rowcount
-        print(f"Deleted {media_deleted} media records")
+        # Delete the instance (its media rows cascade) and collect the file URLs in one statement
+        print(f"Deleting instance {instance_id} from occurrence {occurrence_id}")
+        access_sql, access_params = occurrence_access('occurrence_id', 'edit')
+        cur.execute(f"""
+            WITH files AS (
+                SELECT file_url FROM media WHERE instance_id = %s AND file_url IS NOT NULL
+            ), deleted AS (
+                DELETE FROM instances WHERE id = %s AND occurrence_id = %s AND {access_sql} RETURNING id
+            )
+            SELECT (SELECT count(*) FROM deleted) AS instances_deleted,
+                   ARRAY(SELECT file_url FROM files) AS file_urls
+        """, [instance_id, instance_id, occurrence_id] + access_params)
         
-        # Delete from instances table
-        print(f"Deleting from instances table where id = {instance_id} AND occurrence_id = {occurrence_id}")
-        cur.execute("DELETE FROM instances WHERE id = %s AND occurrence_id = %s", (instance_id, occurrence_id))
-        instances_deleted = cur.rowcount
-        print(f"Deleted {instances_deleted} instance records")
+        result = cur.fetchone()
+        print(f"Deleted {result['instances_deleted']} instance records")
         
-        if instances_deleted == 0:
+        if result['instances_deleted'] == 0:
             print(f"No instances deleted - file not found")
             return jsonify({"error": "File not found"}), 404
         
-        # Delete the actual file from uploads folder
-        if file_info['file_url']:
-            file_path = os.path.join('uploads', os.path.basename(file_info['file_url']))
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Deleted file: {file_path}")
-        
+        cancel_jobs(cur, file_urls=result['file_urls'])
         conn.commit()
-        cur.close()
-        conn.close()
+        
+        # The files themselves are removed by the background GC
+        enqueue_file_deletion(result['file_urls'])
         
         print(f"Successfully deleted file instance {instance_id}")
         return jsonify({"success": True, "message": "File deleted successfully"})
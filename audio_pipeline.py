@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Probe-driven audio processing and waveform peaks
+MP3 and fast-start AAC are served as uploaded, AAC in another layout is
+remuxed, and everything else is encoded to AAC in .m4a. Each file also gets
+min/max peak pairs so the detail view can draw a waveform before playback.
+"""
+
+import os
+import sys
+import json
+import time
+import array
+import base64
+import threading
+import subprocess
+from media_scheduler import run_ffmpeg, encode_slot, EncodeCancelled, LOW_PRIORITY_PREFIX
+from video_pipeline import probe, moov_before_mdat, remove_partial, REMUX_TIMEOUT, ENCODE_TIMEOUT
+from segment_encode import encode_timeout
+from transcode_video import AUDIO_ENCODE_ARGS
+from media_jobs import ProgressTracker
+
+# Peaks are computed from mono PCM at this rate, in 10 ms blocks, then merged
+# down to at most WAVEFORM_BUCKETS (min, max) pairs stored as signed bytes
+PEAK_SAMPLE_RATE = 4000
+PEAK_BLOCK = PEAK_SAMPLE_RATE // 100
+WAVEFORM_BUCKETS = 800
+
+
+def plan(path, info):
+    """
+    Decide what to do with an audio file. Returns a decision dict like
+    video_pipeline.plan's: action is 'passthrough', 'remux' or 'transcode'.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    codec = info['audio_codec']
+    is_mp4 = 'mp4' in info['format'] or 'mov' in info['format']
+    decision = {**info, 'container': 'm4a'}
+
+    if codec is None:
+        return {**decision, 'action': 'passthrough', 'container': None, 'reason': 'no audio stream'}
+    if codec == 'mp3' and ext == '.mp3' and info['video_codec'] is None:
+        return {**decision, 'action': 'passthrough', 'container': 'mp3', 'reason': 'MP3 plays everywhere'}
+    if codec == 'aac':
+        if is_mp4 and ext == '.m4a' and info['video_codec'] is None and moov_before_mdat(path):
+            return {**decision, 'action': 'passthrough', 'reason': 'already web-ready AAC'}
+        return {**decision, 'action': 'remux', 'reason': 'AAC in another container or layout'}
+    return {**decision, 'action': 'transcode', 'reason': f"re-encoding {codec}"}
+
+
+def build_command(input_path, output_path, decision):
+    cmd = ['ffmpeg', '-i', input_path, '-map', '0:a:0', '-vn']
+    cmd += ['-c:a', 'copy'] if decision['action'] == 'remux' else AUDIO_ENCODE_ARGS
+    cmd += ['-movflags', '+faststart']  # Index first so playback and seeking start immediately
+    return cmd + ['-y', output_path]
+
+
+def _merge_peaks(mins, maxs, buckets):
+    """Merge per-block peaks down to at most `buckets` pairs"""
+    count = len(mins)
+    if count <= buckets:
+        return mins, maxs
+    merged_mins, merged_maxs = [], []
+    for i in range(buckets):
+        start = count * i // buckets
+        end = max(start + 1, count * (i + 1) // buckets)
+        merged_mins.append(min(mins[start:end]))
+        merged_maxs.append(max(maxs[start:end]))
+    return merged_mins, merged_maxs
+
+
+def waveform_peaks(path, buckets=WAVEFORM_BUCKETS, priority=0, timeout=ENCODE_TIMEOUT):
+    """
+    Decode `path` to low-rate mono PCM and return its peaks as bytes: one
+    signed (min, max) byte pair per bucket, scaled to -127..127. None if
+    ffmpeg can't decode it.
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-i', path, '-vn', '-ac', '1', '-ar', str(PEAK_SAMPLE_RATE),
+           '-f', 's16le', 'pipe:1']
+    mins, maxs = [], []
+    with encode_slot(priority):
+        process = subprocess.Popen(LOW_PRIORITY_PREFIX + cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            pending = b''
+            while True:
+                chunk = process.stdout.read(PEAK_BLOCK * 2 * 1000)
+                if not chunk:
+                    break
+                pending += chunk
+                usable = len(pending) - len(pending) % (PEAK_BLOCK * 2)
+                samples = array.array('h', pending[:usable])
+                pending = pending[usable:]
+                if sys.byteorder == 'big':
+                    samples.byteswap()
+                for start in range(0, len(samples), PEAK_BLOCK):
+                    block = samples[start:start + PEAK_BLOCK]
+                    mins.append(min(block))
+                    maxs.append(max(block))
+            if len(pending) >= 2:
+                samples = array.array('h', pending[:len(pending) - len(pending) % 2])
+                if sys.byteorder == 'big':
+                    samples.byteswap()
+                mins.append(min(samples))
+                maxs.append(max(samples))
+            process.wait()
+        finally:
+            timer.cancel()
+    if process.returncode != 0 or not mins:
+        return None
+    mins, maxs = _merge_peaks(mins, maxs, buckets)
+    peaks = array.array('b')
+    for low, high in zip(mins, maxs):
+        peaks.append(max(-127, round(low * 127 / 32768)))
+        peaks.append(min(127, round(high * 127 / 32768)))
+    return peaks.tobytes()
+
+
+def process_audio(input_path, priority=None, job_id=None):
+    """
+    Probe an audio file, make it browser-ready with the least work and
+    compute its waveform. Returns (output_path, decision) like
+    video_pipeline.process_video; output_path is None when ffmpeg failed.
+    The decision carries 'waveform' (base64 peak pairs) and 'duration'.
+    """
+    started = time.monotonic()
+    priority = os.path.getsize(input_path) if priority is None else priority
+    decision = plan(input_path, probe(input_path))
+    print(f"Audio decision for {os.path.basename(input_path)}: {decision['action']} ({decision['reason']})")
+
+    output_path = input_path
+    if decision['action'] != 'passthrough':
+        output_path = f"{os.path.splitext(input_path)[0]}_web.{decision['container']}"
+        cmd = build_command(input_path, output_path, decision)
+        print(f"Running: {' '.join(cmd)}")
+        try:
+            result = run_ffmpeg(
+                cmd,
+                priority=priority,
+                timeout=encode_timeout(decision['duration']) if decision['action'] == 'transcode' else REMUX_TIMEOUT,
+                on_progress=ProgressTracker(job_id, decision['duration']) if job_id else None
+            )
+            if result.returncode != 0 or not os.path.exists(output_path):
+                print(f"Audio {decision['action']} failed: {result.stderr}")
+                output_path = None
+        except subprocess.TimeoutExpired:
+            print(f"Audio {decision['action']} timed out")
+            output_path = None
+        except EncodeCancelled:
+            print(f"Audio {decision['action']} cancelled, removing partial output")
+            remove_partial(output_path)
+            raise
+
+    if decision['audio_codec'] is not None:
+        peaks = waveform_peaks(output_path or input_path, priority=priority,
+                               timeout=encode_timeout(decision['duration']))
+        decision['waveform'] = base64.b64encode(peaks).decode('ascii') if peaks else None
+    decision['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+    return output_path, decision
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python audio_pipeline.py <input_audio_path>")
+        sys.exit(1)
+
+    output, decision = process_audio(sys.argv[1])
+    print(json.dumps(decision, indent=2))
+    sys.exit(0 if output else 1)
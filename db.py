@@ -1,11 +1,221 @@
+import os
+import time
+import uuid
+import threading
+import itertools
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
+from settings import settings, SettingsError
+import request_profiler
 
-def get_db_connection():
-    conn = psycopg2.connect(
-        dbname="timeline_db",
-        user="timeline_user",
-        password="Paradox*456*",
-        host="localhost"
-    )
+# Seconds between replication lag checks on each replica
+REPLICA_CHECK_INTERVAL = 2
+# Seconds an unreachable replica is skipped before we try it again
+REPLICA_RETRY_DELAY = 30
+
+# 0 on a primary or a replica that has replayed everything it received;
+# otherwise the age of the last replayed transaction
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+
+def require_database_url():
+    """DATABASE_URL, or SettingsError when it isn't set"""
+    if not settings.database_url:
+        raise SettingsError("DATABASE_URL is required to connect to the database")
+    return settings.database_url
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which queries.py statements it has PREPAREd"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class PooledConnection:
+    """
+    A pooled psycopg2 connection; close() hands it back to the pool (rolled
+    back and reset) instead of disconnecting, so callers keep the usual
+    connect/close pattern.
+    """
+
+    def __init__(self, conn, owner):
+        self._conn = conn
+        self._owner = owner
+        self._returned = False
+
+    def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        self._owner.putconn(self._conn)
+
+    def cursor(self, *args, **kwargs):
+        cur = self._conn.cursor(*args, **kwargs)
+        # Requests being profiled get their statements timed
+        return request_profiler.ProfiledCursor(cur) if request_profiler.current() else cur
+
+    def __getattr__(self, name):
+        if name in ('_conn', '_owner'):
+            raise AttributeError(name)
+        return getattr(self._conn, name)
+
+    def __del__(self):
+        # A connection that was never closed still gives its slot back
+        if not getattr(self, '_returned', True):
+            try:
+                self.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """
+    Connections to one server, at most DB_POOL_MAX per process. The psycopg2
+    pool is created lazily so forked gunicorn workers don't share sockets.
+    """
+
+    def __init__(self, dsn, name):
+        self.dsn = dsn
+        self.name = name
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(settings.db_pool_max)
+        self.pool = None
+        self.pid = None
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                if not self.dsn:
+                    require_database_url()
+                self.pool = pool.ThreadedConnectionPool(settings.db_pool_min, settings.db_pool_max, self.dsn,
+                                                        connection_factory=PreparingConnection)
+                self.pid = os.getpid()
+            return self.pool
+
+    def getconn(self, timeout=None):
+        """A PooledConnection, or None if no slot frees up within `timeout` seconds"""
+        if not self.slots.acquire(timeout=timeout):
+            return None
+        try:
+            return PooledConnection(self._get_pool().getconn(), self)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed:
+                # Roll back and restore session defaults. Not conn.reset(): its
+                # DISCARD ALL would also drop the connection's prepared statements
+                conn.rollback()
+                conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT', deferrable='DEFAULT', autocommit=False)
+            self._get_pool().putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+
+class Replica(ConnectionPool):
+    """A read replica and what we last learned about its replication lag"""
+
+    def __init__(self, dsn, name):
+        super().__init__(dsn, name)
+        self.lag = None
+        self.checked_at = 0
+        self.down_until = 0
+
+    def usable(self, now):
+        if now < self.down_until:
+            return False
+        # Trust a stale measurement only until the next check
+        return self.lag is None or self.lag <= settings.replica_max_lag or now - self.checked_at >= REPLICA_CHECK_INTERVAL
+
+    def check_lag(self, conn, now):
+        cur = conn.cursor()
+        cur.execute(REPLICA_LAG_QUERY)
+        self.lag = float(cur.fetchone()[0])
+        cur.close()
+        conn.rollback()
+        self.checked_at = now
+        if self.lag > settings.replica_max_lag:
+            print(f"Replica {self.name} is {self.lag:.1f}s behind; reading from the primary")
+
+
+_primary = ConnectionPool(settings.database_url, 'primary')
+_replicas = [Replica(dsn.strip(), f"replica {n}")
+             for n, dsn in enumerate(settings.database_replica_urls.split(','), 1) if dsn.strip()]
+_next_replica = itertools.count()
+
+
+def _replica_connection():
+    """A connection to a replica that is reachable and caught up, or None"""
+    if not _replicas:
+        return None
+    start = next(_next_replica)
+    for i in range(len(_replicas)):
+        replica = _replicas[(start + i) % len(_replicas)]
+        now = time.monotonic()
+        if not replica.usable(now):
+            continue
+        conn = None
+        try:
+            # Don't queue for a busy replica; the primary can serve the read
+            conn = replica.getconn(timeout=0)
+            if conn is None:
+                continue
+            if now - replica.checked_at >= REPLICA_CHECK_INTERVAL:
+                replica.check_lag(conn, now)
+            if replica.lag <= settings.replica_max_lag:
+                return conn
+        except psycopg2.Error as e:
+            print(f"Replica {replica.name} unavailable, skipping for {REPLICA_RETRY_DELAY}s: {e}")
+            replica.down_until = now + REPLICA_RETRY_DELAY
+        if conn is not None:
+            conn.close()
+    return None
+
+
+def get_db_connection(dedicated=False, replica=False):
+    """
+    A connection from the pool, waiting up to DB_POOL_TIMEOUT for one to free
+    up. Pass dedicated=True for long-lived connections (LISTEN loops, SSE
+    streams) so they don't hold pool slots.
+
+    replica=True allows a read replica (DATABASE_REPLICA_URLS) for read-only
+    work; it falls back to the primary when no replica is configured,
+    reachable, free or within REPLICA_MAX_LAG seconds of the primary.
+    """
+    if dedicated:
+        return psycopg2.connect(require_database_url())
+    if replica:
+        conn = _replica_connection()
+        if conn is not None:
+            return conn
+    conn = _primary.getconn(timeout=settings.db_pool_timeout)
+    if conn is None:
+        raise pool.PoolError(f"No database connection free after {settings.db_pool_timeout}s")
     return conn
+
+def iter_rows(conn, query, params=None, itersize=1000):
+    """
+    Yield rows one at a time from a named (server-side) cursor.
+    Postgres keeps the result set and psycopg2 fetches `itersize` rows per
+    round trip, so memory stays flat no matter how many rows match.
+    """
+    cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+    cur.itersize = itersize
+    try:
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Background garbage collection for uploaded files
+Deletes run off the request path, in batches, after the database commit
+"""
+
+import os
+import re
+import sys
+import time
+import queue
+import threading
+from db import get_db_connection
+from settings import settings
+
+UPLOADS_DIR = 'uploads'
+COLD_DIR = settings.cold_storage_dir  # originals moved off hot storage (media_storage.py)
+
+# How many files to unlink per batch, and how long to wait to fill a batch
+GC_BATCH_SIZE = settings.gc_batch_size
+GC_BATCH_WAIT = 2.0  # seconds
+
+# Orphan sweeper schedule; files younger than the grace period are left alone
+# because uploads are attached to an occurrence in a second request
+SWEEP_INTERVAL = settings.orphan_sweep_interval
+ORPHAN_GRACE_PERIOD = settings.orphan_grace_period
+
+# Arbitrary key so only one worker process sweeps at a time
+SWEEP_LOCK_KEY = 727001
+
+# Suffixes the video pipeline appends to processed copies
+VARIANT_SUFFIXES = ('_web_fixed', '_web', '_fixed')
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv')
+# Photos get a _web.jpg/_web.webp display copy and audio a _web.m4a; the
+# original may have any of these extensions
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif', '.tif', '.tiff', '.bmp')
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.wav', '.flac', '.ogg', '.oga', '.opus', '.aac', '.aiff', '.amr')
+
+S3_URL_PATTERN = re.compile(r'^https?://([^./]+)\.s3[.-]?[^/]*\.amazonaws\.com/(.+)$')
+
+_pending = queue.Queue()
+_start_lock = threading.Lock()
+_started = False
+
+
+def enqueue_file_deletion(file_urls):
+    """Queue file URLs (local /uploads/... or S3) for background deletion"""
+    for file_url in file_urls:
+        if file_url:
+            _pending.put(file_url)
+
+
+def family_base(filename):
+    """Strip extension and processing suffixes: `x_web_fixed.mp4` -> `x`"""
+    base = os.path.splitext(filename)[0]
+    for suffix in VARIANT_SUFFIXES:
+        if base.endswith(suffix):
+            return base[:-len(suffix)]
+    return base
+
+
+def variant_urls(file_url):
+    """All URLs the video, image or audio pipeline may have produced alongside `file_url`"""
+    prefix = file_url.rsplit('/', 1)[0]
+    filename = file_url.rsplit('/', 1)[-1]
+    ext = os.path.splitext(filename)[1]
+    base = family_base(filename)
+    if ext.lower() in VIDEO_EXTENSIONS:
+        names = {filename, f"{base}{ext}", f"{base}.mp4"}
+        names.update(f"{base}{suffix}.mp4" for suffix in VARIANT_SUFFIXES)
+        names.add(f"{base}_web.webm")  # WebM remux output
+        return [f"{prefix}/{name}" for name in sorted(names)]
+    for extensions, outputs in ((IMAGE_EXTENSIONS, ('_web.jpg', '_web.webp')), (AUDIO_EXTENSIONS, ('_web.m4a',))):
+        if ext.lower() in extensions:
+            names = {filename}
+            names.update(f"{base}{output}" for output in outputs)
+            names.update(f"{base}{original_ext}" for original_ext in extensions)
+            return [f"{prefix}/{name}" for name in sorted(names)]
+    return [file_url]
+
+
+def _collect_batch():
+    """Block until something is queued, then drain up to GC_BATCH_SIZE items"""
+    batch = [_pending.get()]
+    deadline = time.monotonic() + GC_BATCH_WAIT
+    while len(batch) < GC_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_pending.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return list(dict.fromkeys(batch))
+
+
+def _families(cur, file_urls):
+    """
+    The recorded variants (media_variants) of the uploads behind `file_urls`,
+    as {file_url: source_url}; URLs without a record map to themselves
+    """
+    cur.execute("""
+        SELECT v.file_url, v.source_url FROM media_variants v
+        WHERE v.source_url IN (SELECT source_url FROM media_variants WHERE file_url = ANY(%s))
+    """, (file_urls,))
+    families = {file_url: file_url for file_url in file_urls}
+    families.update(dict(cur.fetchall()))
+    return families
+
+
+def _still_referenced(cur, file_urls):
+    """Return the subset of URLs that some media row still points at"""
+    cur.execute("SELECT DISTINCT file_url FROM media WHERE file_url = ANY(%s)", (file_urls,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def _unlink_local(filenames, directory=UPLOADS_DIR):
+    removed = 0
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(directory, filename))
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"GC could not remove {filename}: {e}")
+    return removed
+
+
+def _delete_s3(keys_by_bucket):
+    try:
+        import boto3
+    except ImportError:
+        print("boto3 not installed, skipping object store deletes")
+        return 0
+    s3 = boto3.client('s3')
+    removed = 0
+    for bucket, keys in keys_by_bucket.items():
+        # delete_objects accepts at most 1000 keys per call
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i:i + 1000]
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': k} for k in chunk], 'Quiet': True})
+            removed += len(chunk)
+    return removed
+
+
+def delete_batch(file_urls):
+    """
+    Delete a batch of unreferenced files from disk and the object store.
+    Recorded uploads go as a whole (original, intermediates, served copy,
+    hot or cold) once no media row references any of their files.
+    """
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        families = _families(cur, file_urls)
+        referenced = _still_referenced(cur, list(families))
+        kept = {families[url] for url in referenced}
+        doomed = [url for url, family in families.items() if family not in kept]
+        cur.execute("DELETE FROM media_variants WHERE file_url = ANY(%s)", (doomed,))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    local = []
+    keys_by_bucket = {}
+    for file_url in doomed:
+        match = S3_URL_PATTERN.match(file_url)
+        if match:
+            keys_by_bucket.setdefault(match.group(1), []).append(match.group(2))
+        elif file_url.startswith('/uploads/'):
+            local.append(os.path.basename(file_url))
+    cold = [name for filename in local for name in (filename, f"{filename}.gz")]
+    removed = _unlink_local(local) + _unlink_local(cold, COLD_DIR) + _delete_s3(keys_by_bucket)
+    print(f"GC removed {removed} files ({len(families) - len(doomed)} still referenced, skipped)")
+    return removed
+
+
+def _gc_loop():
+    while True:
+        batch = _collect_batch()
+        try:
+            delete_batch(batch)
+        except Exception as e:
+            print(f"Error in file GC batch: {e}")
+
+
+def sweep_orphans(grace_period=ORPHAN_GRACE_PERIOD):
+    """
+    Remove files in uploads/ that no media row references (directly or as a
+    processed variant of a referenced file), and mark their media_variants
+    rows deleted. Returns the number removed.
+    """
+    if not os.path.isdir(UPLOADS_DIR):
+        return 0
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (SWEEP_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            print("Another worker is sweeping, skipping")
+            return 0
+        try:
+            cur.execute("SELECT DISTINCT file_url FROM media WHERE file_url LIKE '/uploads/%%'")
+            referenced = {family_base(os.path.basename(row[0])) for row in cur.fetchall()}
+            cutoff = time.time() - grace_period
+            orphans = []
+            with os.scandir(UPLOADS_DIR) as entries:
+                for entry in entries:
+                    if not entry.is_file() or family_base(entry.name) in referenced:
+                        continue
+                    if entry.stat().st_mtime < cutoff:
+                        orphans.append(entry.name)
+            removed = _unlink_local(orphans)
+            # Tombstoned like retention's deleted intermediates, so usage stops counting them
+            gone = [f"/uploads/{name}" for name in orphans if not os.path.exists(os.path.join(UPLOADS_DIR, name))]
+            cur.execute("""
+                UPDATE media_variants SET tier = 'deleted', bytes = 0, tiered_at = CURRENT_TIMESTAMP
+                WHERE file_url = ANY(%s) AND tier = 'hot'
+            """, (gone,))
+            conn.commit()
+            print(f"Orphan sweep removed {removed} files")
+            return removed
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (SWEEP_LOCK_KEY,))
+            cur.close()
+    finally:
+        conn.close()
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            sweep_orphans()
+        except Exception as e:
+            print(f"Error in orphan sweep: {e}")
+
+
+def start_file_gc():
+    """Start the GC and sweeper threads once per process"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        threading.Thread(target=_gc_loop, name='file-gc', daemon=True).start()
+        threading.Thread(target=_sweep_loop, name='orphan-sweeper', daemon=True).start()
+        _started = True
+
+
+if __name__ == "__main__":
+    # Manual sweep, e.g. from cron: python3 file_gc.py sweep [grace_seconds]
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        grace = int(sys.argv[2]) if len(sys.argv) > 2 else ORPHAN_GRACE_PERIOD
+        sweep_orphans(grace)
+    else:
+        print("Usage: python3 file_gc.py sweep [grace_seconds]")
@@ -7,12 +7,20 @@ Only applies rotation when necessary
 import os
 import sys
 import subprocess
+import media_scheduler
+from media_scheduler import run_ffmpeg, EncodeCancelled
+from settings import settings
+from transcode_video import VIDEO_ENCODE_ARGS
 
-def fix_video_orientation(input_path):
+def fix_video_orientation(input_path, priority=None, on_progress=None, timeout=None):
     """
     Fix video orientation by rotating 180 degrees if needed
     Returns the path to the fixed file, or None if failed
+    Encodes wait for a scheduler slot; smaller `priority` runs first (default: file size)
+    `timeout` defaults to ORIENTATION_TIMEOUT; pass one scaled to the duration for long videos
+    A cancel from `on_progress` removes the partial output and raises EncodeCancelled
     """
+    timeout = settings.orientation_timeout if timeout is None else timeout
     try:
         if not os.path.exists(input_path):
             print(f"Input file not found: {input_path}")
@@ -23,7 +31,7 @@ def fix_video_orientation(input_path):
             result = subprocess.run([
                 'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
                 '-show_entries', 'stream_tags=rotate', '-of', 'csv=p=0', input_path
-            ], capture_output=True, text=True, timeout=10)
+            ], capture_output=True, text=True, timeout=settings.probe_timeout)
             
             rotation = result.stdout.strip()
             print(f"Video rotation metadata: {rotation}")
@@ -45,12 +53,11 @@ def fix_video_orientation(input_path):
         cmd = [
             'ffmpeg',
             '-i', input_path,
-            '-c:v', 'libx264',           # H.264 codec
-            '-preset', 'ultrafast',       # Fastest encoding preset
-            '-crf', '23',                 # Good quality
+            *VIDEO_ENCODE_ARGS,           # H.264 with the configured preset/crf
             '-c:a', 'copy',               # Copy audio without re-encoding
             '-vf', 'rotate=PI',           # Rotate 180 degrees
             '-movflags', '+faststart',    # Optimize for web streaming
+            '-threads', str(media_scheduler.ENCODE_THREADS),  # Share the CPU with other encodes
             '-y',                         # Overwrite output file
             output_path
         ]
@@ -58,12 +65,12 @@ def fix_video_orientation(input_path):
         print(f"Fixing video orientation: {os.path.basename(input_path)}")
         print(f"Running: {' '.join(cmd)}")
         
-        # Run orientation fix with timeout
-        result = subprocess.run(
+        # Run orientation fix with timeout once a slot is free
+        result = run_ffmpeg(
             cmd,
-            capture_output=True,
-            text=True,
-            timeout=180  # 3 minute timeout
+            priority=os.path.getsize(input_path) if priority is None else priority,
+            timeout=timeout,
+            on_progress=on_progress
         )
         
         if result.returncode == 0 and os.path.exists(output_path):
@@ -74,8 +81,13 @@ def fix_video_orientation(input_path):
             return None
             
     except subprocess.TimeoutExpired:
-        print("Orientation fix timed out after 3 minutes")
+        print(f"Orientation fix timed out after {timeout} seconds")
         return None
+    except EncodeCancelled:
+        print("Orientation fix cancelled, removing partial output")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
     except Exception as e:
         print(f"Error during orientation fix: {e}")
         return None
@@ -0,0 +1,9 @@
+# gunicorn reads this file automatically; values come from settings.py
+# (GUNICORN_WORKERS, GUNICORN_THREADS, GUNICORN_TIMEOUT, GUNICORN_BIND)
+from settings import settings
+
+workers = settings.gunicorn_workers
+threads = settings.gunicorn_threads  # more than 1 selects the gthread worker
+timeout = settings.gunicorn_timeout  # uploads wait for video processing
+if settings.gunicorn_bind:
+    bind = settings.gunicorn_bind
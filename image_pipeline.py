@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Display copies for uploaded photos
+Decodes once (at reduced scale for big JPEGs), applies the EXIF rotation,
+drops the metadata and writes a right-sized progressive JPEG (or WebP) next
+to the original, which is kept as uploaded
+"""
+
+import os
+import sys
+import json
+import time
+from media_scheduler import encode_slot, EncodeCancelled
+from media_jobs import ProgressTracker
+from settings import settings
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Without Pillow images are stored exactly as uploaded
+    Image = None
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:  # Optional; HEIC/HEIF uploads are then kept as-is
+    pass
+
+# Longest side of the display copy, and its encoder quality
+MAX_DIMENSION = settings.image_max_dimension
+QUALITY = settings.image_quality
+
+# Formats browsers show as-is; anything else always gets a display copy
+WEB_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+
+EXIF_ORIENTATION = 0x0112
+
+
+def plan(img, path):
+    """Decide what to do with an opened image. Returns a decision dict like video_pipeline.plan's"""
+    exif = img.getexif()
+    orientation = exif.get(EXIF_ORIENTATION, 1)
+    width, height = img.size
+    decision = {
+        'format': img.format,
+        'original_width': width,
+        'original_height': height,
+        'original_bytes': os.path.getsize(path),
+        'orientation': orientation,
+    }
+    if getattr(img, 'is_animated', False):
+        return {**decision, 'action': 'passthrough', 'reason': 'animated', 'width': width, 'height': height}
+    if max(width, height) > MAX_DIMENSION:
+        return {**decision, 'action': 'resize', 'reason': f"larger than {MAX_DIMENSION}px"}
+    if img.format not in WEB_FORMATS:
+        return {**decision, 'action': 'recompress', 'reason': f"{img.format} isn't shown by all browsers"}
+    if orientation != 1:
+        return {**decision, 'action': 'recompress', 'reason': 'rotated by EXIF'}
+    if len(exif) or img.info.get('xmp'):
+        return {**decision, 'action': 'recompress', 'reason': 'stripping metadata'}
+    return {**decision, 'action': 'recompress', 'reason': 'recompressing'}
+
+
+def render(img, output_base):
+    """Rotate, downscale and encode `img`; returns the output path and its (width, height)"""
+    if img.format == 'JPEG':
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full size
+        img.draft('RGB', (MAX_DIMENSION, MAX_DIMENSION))
+    icc_profile = img.info.get('icc_profile')
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+    if has_alpha or settings.image_format == 'webp':
+        output_path = f"{output_base}.webp"
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        img.save(output_path, 'WEBP', quality=QUALITY, method=4, icc_profile=icc_profile)
+    else:
+        output_path = f"{output_base}.jpg"
+        img = img.convert('RGB')
+        img.save(output_path, 'JPEG', quality=QUALITY, optimize=True, progressive=True, icc_profile=icc_profile)
+    return output_path, img.size
+
+
+def process_image(input_path, priority=None, job_id=None):
+    """
+    Make a display copy of a photo. Returns (output_path, decision) like
+    video_pipeline.process_video; output_path is the input for passthrough
+    and when the image couldn't be processed (decision is then None).
+    With a `job_id` a cancelled job raises EncodeCancelled.
+    """
+    if Image is None:
+        print("Pillow not installed, storing image as uploaded")
+        return input_path, None
+    started = time.monotonic()
+    tracker = ProgressTracker(job_id, 0, stage='image') if job_id else None
+    output_base = f"{os.path.splitext(input_path)[0]}_web"
+    output_path = None
+    # Decoding a 12MP photo is as CPU-heavy as a short encode, so share the encode slots
+    with encode_slot(os.path.getsize(input_path) if priority is None else priority):
+        if tracker and tracker({}) is False:
+            raise EncodeCancelled()
+        try:
+            with Image.open(input_path) as img:
+                decision = plan(img, input_path)
+                if decision['action'] != 'passthrough':
+                    output_path, (decision['width'], decision['height']) = render(img, output_base)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            print(f"Could not process image {os.path.basename(input_path)}: {e}")
+            for ext in ('.jpg', '.webp'):
+                remove_partial(output_base + ext)
+            return input_path, None
+
+    if output_path:
+        decision['bytes'] = os.path.getsize(output_path)
+        # A clean web image we couldn't shrink is better served as uploaded
+        if decision['reason'] == 'recompressing' and decision['bytes'] >= decision['original_bytes']:
+            remove_partial(output_path)
+            output_path = None
+            decision.update(action='passthrough', reason='already web-ready')
+    if output_path is None:
+        decision['bytes'] = decision['original_bytes']
+    decision['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+    print(f"Image decision for {os.path.basename(input_path)}: {decision['action']} ({decision['reason']}), "
+          f"{decision['original_bytes']} -> {decision['bytes']} bytes")
+    if tracker and tracker({'progress': 'end'}) is False:
+        if output_path:
+            remove_partial(output_path)
+        raise EncodeCancelled()
+    return output_path or input_path, decision
+
+
+def remove_partial(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python image_pipeline.py <input_image_path>")
+        sys.exit(1)
+
+    output, decision = process_image(sys.argv[1])
+    print(json.dumps(decision, indent=2))
+    sys.exit(0 if decision else 1)
@@ -1,4 +1,4 @@
-DROP TABLE IF EXISTS media_chunks, media, messages, occurrences, global_events, timelines, users CASCADE;
+DROP TABLE IF EXISTS media_variants, upload_leases, timeline_grants, media_jobs, media_processing, timeline_changes, media_chunks, media, messages, timeline_events, events, occurrences, global_events, timelines, users CASCADE;
 
 CREATE TABLE users (
     id SERIAL PRIMARY KEY,
@@ -18,9 +18,19 @@ CREATE TABLE timelines (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Timelines shared with other users; the owner is timelines.user_id
+CREATE TABLE timeline_grants (
+    timeline_id INTEGER NOT NULL REFERENCES timelines(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    permission VARCHAR(10) NOT NULL CHECK (permission IN ('view', 'edit')),
+    granted_by INTEGER REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (timeline_id, user_id)
+);
+
 CREATE TABLE spans (
     id SERIAL PRIMARY KEY,
-    timeline_id INTEGER NOT NULL REFERENCES timelines(id),
+    timeline_id INTEGER NOT NULL REFERENCES timelines(id) ON DELETE CASCADE,
     title TEXT,
     start_date DATE,
     end_date DATE,
@@ -30,7 +40,7 @@ CREATE TABLE spans (
 
 CREATE TABLE occurrences (
     id SERIAL PRIMARY KEY,
-    timeline_id INTEGER NOT NULL REFERENCES timelines(id),
+    timeline_id INTEGER NOT NULL REFERENCES timelines(id) ON DELETE CASCADE,
     title TEXT,
     date DATE,
     description TEXT,
@@ -47,16 +57,16 @@ CREATE TABLE events (
 
 CREATE TABLE timeline_events (
     id SERIAL PRIMARY KEY,
-    event_id INTEGER NOT NULL REFERENCES events(id),
-    timeline_id INTEGER NOT NULL REFERENCES timelines(id),
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    timeline_id INTEGER NOT NULL REFERENCES timelines(id) ON DELETE CASCADE,
     added_by_user_id INTEGER REFERENCES users(id)
 );
 
 CREATE TABLE instances (
     id SERIAL PRIMARY KEY,
-    span_id INTEGER REFERENCES spans(id),
-    occurrence_id INTEGER REFERENCES occurrences(id),
-    event_id INTEGER REFERENCES events(id),
+    span_id INTEGER REFERENCES spans(id) ON DELETE CASCADE,
+    occurrence_id INTEGER REFERENCES occurrences(id) ON DELETE CASCADE,
+    event_id INTEGER REFERENCES events(id) ON DELETE CASCADE,
     content TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     CHECK (
@@ -68,12 +78,121 @@ CREATE TABLE instances (
 
 CREATE TABLE media (
     id SERIAL PRIMARY KEY,
-    instance_id INTEGER NOT NULL REFERENCES instances(id),
+    instance_id INTEGER NOT NULL REFERENCES instances(id) ON DELETE CASCADE,
     file_url VARCHAR(255),
     file_type VARCHAR(50), -- e.g., "mp3", "mp4", "pdf", "jpg"
+    width INTEGER,         -- images: pixel size of the served file
+    height INTEGER,
+    duration REAL,         -- audio: seconds, and (min, max) peak byte pairs
+    waveform BYTEA,
     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Foreign key indexes so cascading deletes don't scan whole tables
+CREATE INDEX idx_timelines_user_id ON timelines(user_id);
+CREATE INDEX idx_timeline_grants_user_id ON timeline_grants(user_id, timeline_id);
+CREATE INDEX idx_spans_timeline_id ON spans(timeline_id);
+CREATE INDEX idx_occurrences_timeline_id ON occurrences(timeline_id);
+CREATE INDEX idx_timeline_events_timeline_id ON timeline_events(timeline_id);
+CREATE UNIQUE INDEX idx_timeline_events_event_timeline ON timeline_events(event_id, timeline_id);
+CREATE INDEX idx_events_date ON events(date);
+CREATE INDEX idx_instances_span_id ON instances(span_id);
+CREATE INDEX idx_instances_occurrence_created ON instances(occurrence_id, created_at, id);
+CREATE INDEX idx_instances_event_id ON instances(event_id);
+CREATE INDEX idx_media_instance_id ON media(instance_id);
+CREATE INDEX idx_media_file_url ON media(file_url);
+
+-- Date ranges for window and overlap queries (see migrations/008_date_periods.sql)
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE OR REPLACE FUNCTION date_period(start_date DATE, end_date DATE) RETURNS daterange
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN start_date IS NULL AND end_date IS NULL THEN NULL
+        WHEN start_date > end_date THEN daterange(end_date, start_date, '[]')
+        ELSE daterange(start_date, end_date, '[]')
+    END
+$$;
+
+CREATE INDEX idx_spans_timeline_period ON spans USING gist (timeline_id, date_period(start_date, end_date));
+CREATE INDEX idx_occurrences_timeline_period ON occurrences USING gist (timeline_id, date_period(date, date));
+
+-- What the upload pipeline decided for each video or image
+CREATE TABLE media_processing (
+    id SERIAL PRIMARY KEY,
+    source_url VARCHAR(255) NOT NULL,
+    output_url VARCHAR(255),
+    action VARCHAR(20) NOT NULL,       -- 'passthrough', 'remux', 'transcode'; images 'resize' or 'recompress'
+    decision JSONB,
+    elapsed_ms INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_media_processing_output_url ON media_processing(output_url);
+
+-- Progress and cancellation state for video processing jobs
+CREATE TABLE media_jobs (
+    id VARCHAR(100) PRIMARY KEY,
+    upload_id VARCHAR(100),            -- client-supplied X-Upload-Id, shared by a batch
+    source_url VARCHAR(255) NOT NULL,
+    source_family VARCHAR(255) NOT NULL,
+    output_url VARCHAR(255),
+    kind VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL,       -- 'queued', 'running', 'done', 'failed' or 'cancelled'
+    stage VARCHAR(20),
+    percent REAL DEFAULT 0,
+    fps REAL,
+    eta_seconds REAL,
+    error TEXT,
+    cancel_requested BOOLEAN NOT NULL DEFAULT false,
+    user_id INTEGER,                   -- who started it (see migrations/013_media_job_owner.sql)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_media_jobs_upload_id ON media_jobs(upload_id);
+CREATE INDEX idx_media_jobs_source_family ON media_jobs(source_family);
+
+-- Uploads in progress, for admission control (see migrations/011_upload_leases.sql)
+CREATE TABLE upload_leases (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    bytes BIGINT NOT NULL,             -- declared request size
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX idx_upload_leases_user_id ON upload_leases(user_id);
+
+-- Files of each upload by role and storage tier (see migrations/012_media_variants.sql)
+CREATE TABLE media_variants (
+    id BIGSERIAL PRIMARY KEY,
+    source_url VARCHAR(255) NOT NULL,  -- the uploaded file; groups the variants of one upload
+    file_url VARCHAR(255) NOT NULL UNIQUE,
+    role VARCHAR(20) NOT NULL,         -- 'original', 'intermediate' or 'served'
+    tier VARCHAR(20) NOT NULL DEFAULT 'hot',  -- 'hot', 'cold' or 'deleted'
+    compressed BOOLEAN NOT NULL DEFAULT false,  -- gzipped on the cold tier
+    bytes BIGINT NOT NULL DEFAULT 0,   -- size in its current tier
+    user_id INTEGER,                   -- uploader
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    tiered_at TIMESTAMP
+);
+
+CREATE INDEX idx_media_variants_source_url ON media_variants(source_url);
+CREATE INDEX idx_media_variants_user_id ON media_variants(user_id);
+
+-- Change log behind GET /changes; the id is the version clients sync from
+CREATE TABLE timeline_changes (
+    id BIGSERIAL PRIMARY KEY,
+    timeline_id INTEGER NOT NULL,      -- no foreign key so deletes stay recorded
+    entity_type VARCHAR(20) NOT NULL,  -- 'timeline', 'occurrence' or 'span'
+    entity_id INTEGER NOT NULL,
+    op VARCHAR(10) NOT NULL,           -- 'upsert' or 'delete'
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_timeline_changes_timeline_id ON timeline_changes(timeline_id, id);
+
 CREATE TABLE media_chunks (
     id SERIAL PRIMARY KEY,
     upload_id VARCHAR(255),  -- UUID for the upload session
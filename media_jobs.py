@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Progress tracking and cancellation for media processing jobs
+Job state lives in the media_jobs table so any worker can report or cancel it
+"""
+
+import time
+from psycopg2.extras import RealDictCursor
+from db import get_db_connection
+from file_gc import family_base
+
+# Minimum seconds between progress writes for one job
+PROGRESS_WRITE_INTERVAL = 1.0
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _family(file_url):
+    """Files of one upload (original, _web, _web_fixed ...) share this key"""
+    return family_base(file_url.rsplit('/', 1)[-1])
+
+
+def create_job(job_id, source_url, upload_id=None, kind='video', user_id=None):
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        # Job ids come from the client's X-Upload-Id; only its owner may restart one
+        cur.execute("""
+            INSERT INTO media_jobs (id, upload_id, source_url, source_family, kind, status, user_id)
+            VALUES (%s, %s, %s, %s, %s, 'queued', %s)
+            ON CONFLICT (id) DO UPDATE SET status = 'queued', percent = 0, cancel_requested = false,
+                                           updated_at = CURRENT_TIMESTAMP
+            WHERE media_jobs.user_id IS NOT DISTINCT FROM EXCLUDED.user_id
+        """, (job_id, upload_id, source_url, _family(source_url), kind, user_id))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def finish_job(job_id, status, output_url=None, error=None):
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE media_jobs
+            SET status = %s, output_url = %s, error = %s, eta_seconds = NULL,
+                percent = CASE WHEN %s = 'done' THEN 100 ELSE percent END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (status, output_url, error, status, job_id))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+class ProgressTracker:
+    """
+    Progress callback for media_scheduler.run_ffmpeg: turns ffmpeg's
+    -progress blocks into percent/fps/ETA, writes them at most once per
+    PROGRESS_WRITE_INTERVAL and returns False once a cancel was requested.
+    """
+
+    def __init__(self, job_id, duration, stage='processing'):
+        self.job_id = job_id
+        self.duration = duration or 0
+        self.stage = stage
+        self.last_write = 0
+
+    def __call__(self, block):
+        now = time.monotonic()
+        if block and block.get('progress') != 'end' and now - self.last_write < PROGRESS_WRITE_INTERVAL:
+            return True
+        self.last_write = now
+
+        percent = fps = eta = None
+        out_time_us = block.get('out_time_us') or block.get('out_time_ms')  # both are microseconds
+        if out_time_us and out_time_us.lstrip('-').isdigit() and self.duration:
+            done = max(0, int(out_time_us)) / 1_000_000
+            percent = min(100.0, done / self.duration * 100)
+            speed = block.get('speed', '').rstrip('x')
+            try:
+                speed = float(speed)
+                eta = (self.duration - done) / speed if speed > 0 else None
+            except ValueError:
+                pass
+        try:
+            fps = float(block['fps']) if block.get('fps') else None
+        except ValueError:
+            pass
+
+        try:
+            conn = get_db_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute("""
+                    UPDATE media_jobs
+                    SET status = 'running', stage = %s, percent = COALESCE(%s, percent),
+                        fps = %s, eta_seconds = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    RETURNING cancel_requested
+                """, (self.stage, percent, fps, eta, self.job_id))
+                row = cur.fetchone()
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            # Losing a progress update shouldn't kill the encode
+            print(f"Error writing progress for job {self.job_id}: {e}")
+            return True
+        return not (row and row[0])
+
+
+def get_jobs(job_id=None, upload_id=None, user_id=None):
+    """Jobs by id or upload id; only `user_id`'s when given"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT id, upload_id, source_url, output_url, kind, status, stage, percent, fps,
+                   eta_seconds, error, cancel_requested, created_at, updated_at
+            FROM media_jobs
+            WHERE (id = %s OR upload_id = %s) AND (%s::int IS NULL OR user_id = %s)
+            ORDER BY id
+        """, (job_id, upload_id, user_id, user_id))
+        jobs = [dict(row) for row in cur.fetchall()]
+        cur.close()
+        return jobs
+    finally:
+        conn.close()
+
+
+def cancel_jobs(cur, job_id=None, file_urls=(), user_id=None):
+    """
+    Ask running/queued jobs to stop, by id or by any file of the upload they
+    work on; only `user_id`'s when given. Uploads still attached elsewhere
+    (a cloned timeline, another occurrence) keep processing. Runs in the
+    caller's transaction, after the media rows are deleted; returns the
+    number flagged.
+    """
+    file_urls = [file_url for file_url in file_urls if file_url]
+    families = [_family(file_url) for file_url in file_urls]
+    cur.execute("""
+        UPDATE media_jobs SET cancel_requested = true, updated_at = CURRENT_TIMESTAMP
+        WHERE status = ANY(%s) AND (%s::int IS NULL OR user_id = %s) AND (id = %s OR (
+            source_family = ANY(%s) AND NOT EXISTS (
+                SELECT 1 FROM unnest(%s::text[], %s::text[]) AS f(file_url, family)
+                JOIN media m ON m.file_url = f.file_url
+                WHERE f.family = media_jobs.source_family)))
+    """, (list(ACTIVE_STATUSES), user_id, user_id, job_id, families, file_urls, families))
+    return cur.rowcount
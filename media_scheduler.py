@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Scheduling for ffmpeg encodes
+Caps how many encodes run at once, smallest files first, at low CPU/IO priority
+"""
+
+import os
+import heapq
+import shutil
+import tempfile
+import itertools
+import threading
+import subprocess
+import time
+from contextlib import contextmanager
+from settings import settings
+import request_profiler
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX; fall back to per-process limits only
+    fcntl = None
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Concurrent encodes across the machine, and ffmpeg threads per encode
+# (ENCODE_SLOTS / ENCODE_THREADS settings). By default one core is left
+# over for the API workers.
+ENCODE_SLOTS = settings.encode_slots or max(1, CPU_COUNT // 4)
+ENCODE_THREADS = settings.encode_threads or max(1, (CPU_COUNT - 1) // ENCODE_SLOTS)
+
+# Encodes run under nice/ionice when those tools exist
+NICE_LEVEL = 10
+LOW_PRIORITY_PREFIX = (
+    (['nice', '-n', str(NICE_LEVEL)] if shutil.which('nice') else []) +
+    (['ionice', '-c', '2', '-n', '7'] if shutil.which('ionice') else [])
+)
+
+# Lock files shared by every worker process on the machine, one per slot
+SLOT_LOCK_DIR = tempfile.gettempdir()
+SLOT_POLL_INTERVAL = 0.25  # seconds
+
+_cond = threading.Condition()
+_waiting = []  # heap of (priority, sequence) tickets
+_sequence = itertools.count()
+_running = 0
+
+
+def configure(slots=None, threads=None):
+    """Override the slot count and per-encode threads, e.g. for offline batch jobs"""
+    global ENCODE_SLOTS, ENCODE_THREADS
+    with _cond:
+        if slots:
+            ENCODE_SLOTS = max(1, slots)
+            ENCODE_THREADS = max(1, CPU_COUNT // ENCODE_SLOTS)
+        if threads:
+            ENCODE_THREADS = max(1, threads)
+        _cond.notify_all()
+
+
+def _slot_path(index):
+    return os.path.join(SLOT_LOCK_DIR, f"chronofacts-encode-slot-{index}.lock")
+
+
+def _try_lock_slot(index):
+    """Return an open, flock'd file for slot `index`, or None if it's taken"""
+    f = open(_slot_path(index), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return f
+    except OSError:
+        f.close()
+        return None
+
+
+def _acquire_machine_slot():
+    """Block until one of the machine-wide slot locks is free"""
+    if fcntl is None:
+        return None
+    while True:
+        for index in range(ENCODE_SLOTS):
+            f = _try_lock_slot(index)
+            if f:
+                return f
+        time.sleep(SLOT_POLL_INTERVAL)
+
+
+@contextmanager
+def encode_slot(priority=0):
+    """
+    Wait for an encode slot. Lower `priority` values go first (callers pass
+    the input size so small files aren't stuck behind long videos).
+    """
+    global _running
+    ticket = (priority, next(_sequence))
+    with _cond:
+        heapq.heappush(_waiting, ticket)
+        while _waiting[0] != ticket or _running >= ENCODE_SLOTS:
+            _cond.wait()
+        heapq.heappop(_waiting)
+        _running += 1
+        _cond.notify_all()
+    slot = None
+    try:
+        slot = _acquire_machine_slot()
+        yield
+    finally:
+        if slot:
+            slot.close()  # Closing the file releases the flock
+        with _cond:
+            _running -= 1
+            _cond.notify_all()
+
+
+class EncodeCancelled(Exception):
+    """Raised by run_ffmpeg when the progress callback asks to stop"""
+
+
+def run_ffmpeg(cmd, priority=0, timeout=None, on_progress=None):
+    """
+    Run an ffmpeg command in an encode slot at low priority.
+    With `on_progress`, ffmpeg reports through `-progress pipe:1` and the
+    callback gets each block of key/value pairs; returning False kills the
+    process and raises EncodeCancelled.
+    """
+    started = time.perf_counter()
+    with encode_slot(priority):
+        # Shows up in a profiled request (request_profiler.py) as subprocess waits
+        request_profiler.record('subprocess', 'wait for encode slot', time.perf_counter() - started)
+        started = time.perf_counter()
+        try:
+            if on_progress is None:
+                return subprocess.run(
+                    LOW_PRIORITY_PREFIX + cmd,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout
+                )
+            if on_progress({}) is False:
+                raise EncodeCancelled()
+            return _run_with_progress(cmd, timeout, on_progress)
+        finally:
+            request_profiler.record('subprocess', ' '.join(cmd[:3]), time.perf_counter() - started)
+
+
+def _run_with_progress(cmd, timeout, on_progress):
+    # Progress options go right after 'ffmpeg'; stderr goes to a temp file so
+    # a chatty encode can't fill the pipe and stall
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    deadline = time.monotonic() + timeout if timeout else None
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(LOW_PRIORITY_PREFIX + cmd, stdout=subprocess.PIPE,
+                                   stderr=stderr, text=True)
+        timer = None
+        if deadline:
+            timer = threading.Timer(timeout, process.kill)
+            timer.start()
+        try:
+            block = {}
+            for line in process.stdout:
+                key, _, value = line.strip().partition('=')
+                block[key] = value
+                if key != 'progress':
+                    continue
+                if on_progress(block) is False:
+                    process.kill()
+                    process.wait()
+                    raise EncodeCancelled()
+                block = {}
+            process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+        if deadline and time.monotonic() >= deadline and process.returncode != 0:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        stderr.seek(0)
+        return subprocess.CompletedProcess(cmd, process.returncode, '', stderr.read())
+
+
+def queue_stats():
+    """Queue depth for this process and slot usage across the machine"""
+    with _cond:
+        stats = {
+            "queued": len(_waiting),
+            "running": _running,
+            "slots": ENCODE_SLOTS,
+            "threads_per_encode": ENCODE_THREADS,
+            "cpu_count": CPU_COUNT,
+        }
+    if fcntl is not None:
+        busy = 0
+        for index in range(ENCODE_SLOTS):
+            f = _try_lock_slot(index)
+            if f:
+                f.close()
+            else:
+                busy += 1
+        stats["running_machine_wide"] = busy
+    return stats
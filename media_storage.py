@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Variant tracking, retention and disk-usage accounting for uploads
+Every file an upload produces (original, intermediates, the served copy) is
+a media_variants row. A periodic retention pass deletes intermediates once
+processing is done and moves originals that have a processed copy to the
+cold tier (COLD_STORAGE_DIR, gzipped where that helps). Cold files come back
+on first request.
+
+    python3 media_storage.py retain           # one retention pass
+    python3 media_storage.py restore NAME     # bring an original back from the cold tier
+    python3 media_storage.py usage            # bytes per user
+"""
+
+import os
+import sys
+import gzip
+import time
+import shutil
+import threading
+from db import get_db_connection
+from file_gc import UPLOADS_DIR, COLD_DIR, variant_urls
+from settings import settings
+
+# Seconds an intermediate is kept after processing, and an unreferenced
+# original stays hot (0 keeps originals hot); RETENTION_* settings
+INTERMEDIATE_RETENTION = settings.retention_intermediate_seconds
+ORIGINAL_COLD_AFTER = settings.retention_cold_after_seconds
+RETENTION_INTERVAL = settings.retention_interval
+
+# Originals in these formats are gzipped on the cold tier; the rest are
+# already compressed and are moved as-is
+COMPRESSIBLE_EXTENSIONS = ('.wav', '.aiff', '.aif', '.bmp', '.tif', '.tiff', '.avi')
+
+# Arbitrary key so only one worker process runs retention at a time
+RETENTION_LOCK_KEY = 727002
+
+COPY_CHUNK = 1024 * 1024
+
+_start_lock = threading.Lock()
+_started = False
+
+
+def record_variants(cur, source_url, served_url, user_id=None):
+    """
+    Record the files of one processed upload: the uploaded file, the URL
+    served to clients and any intermediate outputs still on disk.
+    """
+    urls, roles, sizes = [], [], []
+    for url in variant_urls(source_url):
+        path = os.path.join(UPLOADS_DIR, os.path.basename(url))
+        if not os.path.exists(path):
+            continue
+        urls.append(url)
+        roles.append('served' if url == served_url else 'original' if url == source_url else 'intermediate')
+        sizes.append(os.path.getsize(path))
+    if not urls:
+        return
+    cur.execute("""
+        INSERT INTO media_variants (source_url, file_url, role, bytes, user_id)
+        SELECT %s, v.file_url, v.role, v.bytes, %s
+        FROM unnest(%s::text[], %s::text[], %s::bigint[]) AS v(file_url, role, bytes)
+        ON CONFLICT (file_url) DO UPDATE
+        SET source_url = EXCLUDED.source_url, role = EXCLUDED.role, bytes = EXCLUDED.bytes,
+            tier = 'hot', compressed = false, tiered_at = NULL
+    """, (source_url, user_id, urls, roles, sizes))
+
+
+def _cold_name(filename, compressed):
+    return f"{filename}.gz" if compressed else filename
+
+
+def _copy(src, dst, compress=False, decompress=False):
+    """Copy through a temp file and fsync, so `dst` is complete or absent"""
+    partial = f"{dst}.{os.getpid()}-{threading.get_ident()}.partial"
+    opener = gzip.open if decompress else open
+    with opener(src, 'rb') as source:
+        with (gzip.open(partial, 'wb', compresslevel=6) if compress else open(partial, 'wb')) as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK)
+    with open(partial, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(partial, dst)
+    return os.path.getsize(dst)
+
+
+def delete_intermediates(cur, min_age=INTERMEDIATE_RETENTION):
+    """Unlink intermediates of finished uploads that nothing references; returns bytes freed"""
+    cur.execute("""
+        SELECT id, file_url, bytes FROM media_variants v
+        WHERE role = 'intermediate' AND tier = 'hot'
+          AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+          AND NOT EXISTS (SELECT 1 FROM media m WHERE m.file_url = v.file_url)
+    """, (min_age,))
+    freed = 0
+    deleted = []
+    for variant_id, file_url, size in cur.fetchall():
+        try:
+            os.remove(os.path.join(UPLOADS_DIR, os.path.basename(file_url)))
+            freed += size or 0
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Retention could not remove {file_url}: {e}")
+            continue
+        deleted.append(variant_id)
+    cur.execute("""
+        UPDATE media_variants SET tier = 'deleted', bytes = 0, tiered_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s)
+    """, (deleted,))
+    return freed
+
+
+def move_originals_to_cold(cur, min_age=ORIGINAL_COLD_AFTER):
+    """
+    Move originals whose processed copy is being served, and that no media
+    row references directly, to the cold tier; returns hot bytes freed
+    """
+    if not min_age:
+        return 0
+    cur.execute("""
+        SELECT id, file_url, bytes FROM media_variants v
+        WHERE role = 'original' AND tier = 'hot'
+          AND COALESCE(tiered_at, created_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+          AND EXISTS (SELECT 1 FROM media_variants s
+                      WHERE s.source_url = v.source_url AND s.role = 'served' AND s.tier = 'hot')
+          AND NOT EXISTS (SELECT 1 FROM media m WHERE m.file_url = v.file_url)
+    """, (min_age,))
+    os.makedirs(COLD_DIR, exist_ok=True)
+    freed = 0
+    for variant_id, file_url, size in cur.fetchall():
+        filename = os.path.basename(file_url)
+        src = os.path.join(UPLOADS_DIR, filename)
+        if not os.path.exists(src):
+            continue
+        compressed = os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS
+        try:
+            cold_bytes = _copy(src, os.path.join(COLD_DIR, _cold_name(filename, compressed)), compress=compressed)
+        except OSError as e:
+            print(f"Retention could not move {filename} to the cold tier: {e}")
+            continue
+        cur.execute("""
+            UPDATE media_variants SET tier = 'cold', compressed = %s, bytes = %s, tiered_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (compressed, cold_bytes, variant_id))
+        cur.connection.commit()  # Recorded as cold before the hot copy goes
+        os.remove(src)
+        freed += size or 0
+    return freed
+
+
+def apply_retention():
+    """One retention pass across all uploads; returns hot bytes freed"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (RETENTION_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            print("Another worker is running retention, skipping")
+            return 0
+        try:
+            freed = delete_intermediates(cur)
+            conn.commit()
+            freed += move_originals_to_cold(cur)
+            conn.commit()
+            print(f"Retention freed {freed // (1024 * 1024)} MB of hot storage")
+            return freed
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_KEY,))
+            cur.close()
+    finally:
+        conn.close()
+
+
+def restore(filename):
+    """Bring a cold file back to uploads/; returns True if it is hot again"""
+    file_url = f"/uploads/{filename}"
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, compressed FROM media_variants WHERE file_url = %s AND tier = 'cold'", (file_url,))
+        row = cur.fetchone()
+        if row is None:
+            return False
+        variant_id, compressed = row
+        cold_path = os.path.join(COLD_DIR, _cold_name(filename, compressed))
+        hot_path = os.path.join(UPLOADS_DIR, filename)
+        if not os.path.exists(hot_path):
+            hot_bytes = _copy(cold_path, hot_path, decompress=compressed)
+        else:
+            hot_bytes = os.path.getsize(hot_path)  # Another request restored it first
+        # tiered_at restarts the clock before it goes cold again
+        cur.execute("""
+            UPDATE media_variants SET tier = 'hot', compressed = false, bytes = %s, tiered_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (hot_bytes, variant_id))
+        conn.commit()
+        cur.close()
+        try:
+            os.remove(cold_path)
+        except FileNotFoundError:
+            pass
+        print(f"Restored {filename} from the cold tier")
+        return True
+    finally:
+        conn.close()
+
+
+def usage_by_user(cur, user_id=None):
+    """Bytes per uploading user and tier; only `user_id`'s when given"""
+    cur.execute("""
+        SELECT v.user_id, u.username,
+               COALESCE(sum(v.bytes) FILTER (WHERE v.tier = 'hot'), 0) AS hot_bytes,
+               COALESCE(sum(v.bytes) FILTER (WHERE v.tier = 'cold'), 0) AS cold_bytes,
+               count(DISTINCT v.source_url) AS uploads
+        FROM media_variants v LEFT JOIN users u ON u.id = v.user_id
+        WHERE v.tier <> 'deleted' AND (%s::int IS NULL OR v.user_id = %s)
+        GROUP BY v.user_id, u.username
+        ORDER BY hot_bytes + cold_bytes DESC
+    """, (user_id, user_id))
+    return cur.fetchall()
+
+
+def usage_by_timeline(cur, access_sql="TRUE", access_params=()):
+    """
+    Bytes per timeline and tier, counting every variant of each attached
+    upload. `access_sql` (a timeline_access() condition on t.id) limits the
+    timelines. An upload attached to several timelines counts in each.
+    """
+    cur.execute(f"""
+        WITH attached AS (
+            SELECT DISTINCT COALESCE(o.timeline_id, s.timeline_id) AS timeline_id, served.source_url
+            FROM media m
+            JOIN instances i ON i.id = m.instance_id
+            LEFT JOIN occurrences o ON o.id = i.occurrence_id
+            LEFT JOIN spans s ON s.id = i.span_id
+            JOIN media_variants served ON served.file_url = m.file_url
+        )
+        SELECT t.id AS timeline_id, t.title,
+               COALESCE(sum(v.bytes) FILTER (WHERE v.tier = 'hot'), 0) AS hot_bytes,
+               COALESCE(sum(v.bytes) FILTER (WHERE v.tier = 'cold'), 0) AS cold_bytes,
+               count(DISTINCT a.source_url) AS uploads
+        FROM timelines t
+        JOIN attached a ON a.timeline_id = t.id
+        JOIN media_variants v ON v.source_url = a.source_url AND v.tier <> 'deleted'
+        WHERE {access_sql}
+        GROUP BY t.id, t.title
+        ORDER BY hot_bytes + cold_bytes DESC
+    """, list(access_params))
+    return cur.fetchall()
+
+
+def _retention_loop():
+    while True:
+        time.sleep(RETENTION_INTERVAL)
+        try:
+            apply_retention()
+        except Exception as e:
+            print(f"Error in retention pass: {e}")
+
+
+def start_retention():
+    """Start the retention thread once per process"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        threading.Thread(target=_retention_loop, name='media-retention', daemon=True).start()
+        _started = True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "retain":
+        apply_retention()
+    elif len(sys.argv) > 2 and sys.argv[1] == "restore":
+        sys.exit(0 if restore(sys.argv[2]) else 1)
+    elif len(sys.argv) > 1 and sys.argv[1] == "usage":
+        conn = get_db_connection()
+        cur = conn.cursor()
+        for user_id, username, hot_bytes, cold_bytes, uploads in usage_by_user(cur):
+            print(f"{username or user_id}: {hot_bytes // (1024 * 1024)} MB hot, "
+                  f"{cold_bytes // (1024 * 1024)} MB cold, {uploads} uploads")
+        cur.close()
+        conn.close()
+    else:
+        print("Usage: python3 media_storage.py retain | restore <filename> | usage")
@@ -8,17 +8,13 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import boto3  # For AWS S3
 import requests
+from db import require_database_url
 
 def export_database_data():
     """Export current database data"""
     try:
-        # Connect to local database
-        conn = psycopg2.connect(
-            host="localhost",
-            database="timeline_db",
-            user="timeline_user", 
-            password="your_password"
-        )
+        # Connect to local database (DATABASE_URL setting)
+        conn = psycopg2.connect(require_database_url())
         
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
@@ -0,0 +1,42 @@
+-- Let Postgres remove the rows hanging off a timeline/occurrence/instance
+-- in the same statement that deletes the parent, instead of leaving
+-- instances and media orphaned.
+-- Apply with: psql -d timeline_db -f migrations/001_cascade_deletes.sql
+
+BEGIN;
+
+ALTER TABLE spans DROP CONSTRAINT spans_timeline_id_fkey,
+    ADD CONSTRAINT spans_timeline_id_fkey FOREIGN KEY (timeline_id) REFERENCES timelines(id) ON DELETE CASCADE;
+
+ALTER TABLE occurrences DROP CONSTRAINT occurrences_timeline_id_fkey,
+    ADD CONSTRAINT occurrences_timeline_id_fkey FOREIGN KEY (timeline_id) REFERENCES timelines(id) ON DELETE CASCADE;
+
+ALTER TABLE timeline_events DROP CONSTRAINT timeline_events_event_id_fkey,
+    ADD CONSTRAINT timeline_events_event_id_fkey FOREIGN KEY (event_id) REFERENCES events(id) ON DELETE CASCADE;
+
+ALTER TABLE timeline_events DROP CONSTRAINT timeline_events_timeline_id_fkey,
+    ADD CONSTRAINT timeline_events_timeline_id_fkey FOREIGN KEY (timeline_id) REFERENCES timelines(id) ON DELETE CASCADE;
+
+ALTER TABLE instances DROP CONSTRAINT instances_span_id_fkey,
+    ADD CONSTRAINT instances_span_id_fkey FOREIGN KEY (span_id) REFERENCES spans(id) ON DELETE CASCADE;
+
+ALTER TABLE instances DROP CONSTRAINT instances_occurrence_id_fkey,
+    ADD CONSTRAINT instances_occurrence_id_fkey FOREIGN KEY (occurrence_id) REFERENCES occurrences(id) ON DELETE CASCADE;
+
+ALTER TABLE instances DROP CONSTRAINT instances_event_id_fkey,
+    ADD CONSTRAINT instances_event_id_fkey FOREIGN KEY (event_id) REFERENCES events(id) ON DELETE CASCADE;
+
+ALTER TABLE media DROP CONSTRAINT media_instance_id_fkey,
+    ADD CONSTRAINT media_instance_id_fkey FOREIGN KEY (instance_id) REFERENCES instances(id) ON DELETE CASCADE;
+
+-- Foreign key indexes so cascading deletes don't scan whole tables
+CREATE INDEX IF NOT EXISTS idx_spans_timeline_id ON spans(timeline_id);
+CREATE INDEX IF NOT EXISTS idx_occurrences_timeline_id ON occurrences(timeline_id);
+CREATE INDEX IF NOT EXISTS idx_timeline_events_timeline_id ON timeline_events(timeline_id);
+CREATE INDEX IF NOT EXISTS idx_instances_span_id ON instances(span_id);
+CREATE INDEX IF NOT EXISTS idx_instances_occurrence_id ON instances(occurrence_id);
+CREATE INDEX IF NOT EXISTS idx_instances_event_id ON instances(event_id);
+CREATE INDEX IF NOT EXISTS idx_media_instance_id ON media(instance_id);
+CREATE INDEX IF NOT EXISTS idx_media_file_url ON media(file_url);
+
+COMMIT;
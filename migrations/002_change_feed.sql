@@ -0,0 +1,18 @@
+-- Change log behind GET /changes: every mutation handler appends a row in
+-- its own transaction, and the row id is the version clients sync from.
+-- Apply with: psql -d timeline_db -f migrations/002_change_feed.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS timeline_changes (
+    id BIGSERIAL PRIMARY KEY,
+    timeline_id INTEGER NOT NULL,      -- no foreign key so deletes stay recorded
+    entity_type VARCHAR(20) NOT NULL,  -- 'timeline', 'occurrence' or 'span'
+    entity_id INTEGER NOT NULL,
+    op VARCHAR(10) NOT NULL,           -- 'upsert' or 'delete'
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_timeline_changes_timeline_id ON timeline_changes(timeline_id, id);
+
+COMMIT;
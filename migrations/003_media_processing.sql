@@ -0,0 +1,19 @@
+-- What the upload pipeline decided for each video (passthrough, remux or
+-- transcode), with the probe results and how long it took.
+-- Apply with: psql -d timeline_db -f migrations/003_media_processing.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS media_processing (
+    id SERIAL PRIMARY KEY,
+    source_url VARCHAR(255) NOT NULL,
+    output_url VARCHAR(255),
+    action VARCHAR(20) NOT NULL,       -- 'passthrough', 'remux' or 'transcode'
+    decision JSONB,
+    elapsed_ms INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_processing_output_url ON media_processing(output_url);
+
+COMMIT;
@@ -0,0 +1,29 @@
+-- Progress and cancellation state for video processing jobs, shared by all
+-- workers. The family column groups the files of one upload so deleting any
+-- of them can cancel the job.
+-- Apply with: psql -d timeline_db -f migrations/004_media_jobs.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS media_jobs (
+    id VARCHAR(100) PRIMARY KEY,
+    upload_id VARCHAR(100),            -- client-supplied X-Upload-Id, shared by a batch
+    source_url VARCHAR(255) NOT NULL,
+    source_family VARCHAR(255) NOT NULL,
+    output_url VARCHAR(255),
+    kind VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL,       -- 'queued', 'running', 'done', 'failed' or 'cancelled'
+    stage VARCHAR(20),
+    percent REAL DEFAULT 0,
+    fps REAL,
+    eta_seconds REAL,
+    error TEXT,
+    cancel_requested BOOLEAN NOT NULL DEFAULT false,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_jobs_upload_id ON media_jobs(upload_id);
+CREATE INDEX IF NOT EXISTS idx_media_jobs_source_family ON media_jobs(source_family);
+
+COMMIT;
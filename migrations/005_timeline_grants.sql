@@ -0,0 +1,20 @@
+-- Timeline sharing: owners (timelines.user_id) can grant other users view
+-- or edit access. Listings filter on these in SQL, so both lookups by user
+-- are indexed.
+-- Apply with: psql -d timeline_db -f migrations/005_timeline_grants.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS timeline_grants (
+    timeline_id INTEGER NOT NULL REFERENCES timelines(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    permission VARCHAR(10) NOT NULL CHECK (permission IN ('view', 'edit')),
+    granted_by INTEGER REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (timeline_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_timeline_grants_user_id ON timeline_grants(user_id, timeline_id);
+CREATE INDEX IF NOT EXISTS idx_timelines_user_id ON timelines(user_id);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Global events are linked to timelines through timeline_events. A unique
+-- (event_id, timeline_id) pair keeps links idempotent and serves lookups by
+-- event; events are listed by date.
+-- Apply with: psql -d timeline_db -f migrations/006_global_events.sql
+
+BEGIN;
+
+DELETE FROM timeline_events a USING timeline_events b
+WHERE a.event_id = b.event_id AND a.timeline_id = b.timeline_id AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_timeline_events_event_timeline ON timeline_events(event_id, timeline_id);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events(date);
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- Message history is read newest first, one page at a time, by keyset on
+-- (created_at, id) within an occurrence. This index serves that directly and
+-- replaces the plain occurrence_id index, which is its prefix.
+-- Apply with: psql -d timeline_db -f migrations/007_instance_history_index.sql
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_instances_occurrence_created ON instances(occurrence_id, created_at, id);
+DROP INDEX IF EXISTS idx_instances_occurrence_id;
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- Spans and occurrences as date ranges, so "what intersects this window" and
+-- "which spans overlap" are GiST index scans instead of full-table scans.
+-- date_period() is the one definition of an item's range: inclusive of both
+-- days, open-ended on a missing side, NULL when undated, and tolerant of
+-- start/end entered the wrong way round. Queries must use the same
+-- expression for the indexes to apply.
+-- btree_gist lets timeline_id sit in the same GiST index as the range.
+-- Apply with: psql -d timeline_db -f migrations/008_date_periods.sql
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE OR REPLACE FUNCTION date_period(start_date DATE, end_date DATE) RETURNS daterange
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN start_date IS NULL AND end_date IS NULL THEN NULL
+        WHEN start_date > end_date THEN daterange(end_date, start_date, '[]')
+        ELSE daterange(start_date, end_date, '[]')
+    END
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_spans_timeline_period ON spans USING gist (timeline_id, date_period(start_date, end_date));
+CREATE INDEX IF NOT EXISTS idx_occurrences_timeline_period ON occurrences USING gist (timeline_id, date_period(date, date));
+
+COMMIT;
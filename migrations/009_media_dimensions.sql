@@ -0,0 +1,11 @@
+-- Pixel size of attached images (filled from the image pipeline's
+-- media_processing record when a file is attached), so clients can reserve
+-- layout space before the image loads.
+-- Apply with: psql -d timeline_db -f migrations/009_media_dimensions.sql
+
+BEGIN;
+
+ALTER TABLE media ADD COLUMN IF NOT EXISTS width INTEGER;
+ALTER TABLE media ADD COLUMN IF NOT EXISTS height INTEGER;
+
+COMMIT;
@@ -0,0 +1,12 @@
+-- Duration and waveform peaks of attached audio (filled from the audio
+-- pipeline's media_processing record when a file is attached), so the detail
+-- view can draw a waveform without downloading the file. The waveform is
+-- signed (min, max) byte pairs, at most 800 of them.
+-- Apply with: psql -d timeline_db -f migrations/010_media_waveforms.sql
+
+BEGIN;
+
+ALTER TABLE media ADD COLUMN IF NOT EXISTS duration REAL;
+ALTER TABLE media ADD COLUMN IF NOT EXISTS waveform BYTEA;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Uploads in progress, for admission control (upload_admission.py). A row is
+-- held from before the request body is read until processing finishes, so
+-- every worker sees the same per-user and global totals. Rows left by a
+-- crashed worker expire.
+-- Apply with: psql -d timeline_db -f migrations/011_upload_leases.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS upload_leases (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    bytes BIGINT NOT NULL,             -- declared request size
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_leases_user_id ON upload_leases(user_id);
+
+COMMIT;
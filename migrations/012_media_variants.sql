@@ -0,0 +1,25 @@
+-- Every file an upload produced (original, intermediate encodes, the copy
+-- served to clients), its storage tier and size, for retention and disk
+-- usage accounting (media_storage.py). Rows are recorded when processing
+-- finishes; the GC removes an upload's rows with its files.
+-- Apply with: psql -d timeline_db -f migrations/012_media_variants.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS media_variants (
+    id BIGSERIAL PRIMARY KEY,
+    source_url VARCHAR(255) NOT NULL,  -- the uploaded file; groups the variants of one upload
+    file_url VARCHAR(255) NOT NULL UNIQUE,
+    role VARCHAR(20) NOT NULL,         -- 'original', 'intermediate' or 'served'
+    tier VARCHAR(20) NOT NULL DEFAULT 'hot',  -- 'hot', 'cold' or 'deleted'
+    compressed BOOLEAN NOT NULL DEFAULT false,  -- gzipped on the cold tier
+    bytes BIGINT NOT NULL DEFAULT 0,   -- size in its current tier
+    user_id INTEGER,                   -- uploader
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    tiered_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_variants_source_url ON media_variants(source_url);
+CREATE INDEX IF NOT EXISTS idx_media_variants_user_id ON media_variants(user_id);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Who started each media job, so /media/jobs only shows and cancels a
+-- user's own jobs (admins see all). Jobs created before this have no owner
+-- and are only visible to admins.
+-- Apply with: psql -d timeline_db -f migrations/013_media_job_owner.sql
+
+BEGIN;
+
+ALTER TABLE media_jobs ADD COLUMN IF NOT EXISTS user_id INTEGER;
+
+COMMIT;
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Named queries for the hot routes, prepared once per pooled connection
+The first execute() of a query on a connection PREPAREs it; later calls send
+only EXECUTE name (params), so Postgres skips parsing and, once its plan cache
+settles, planning. Every execution is timed per query name.
+"""
+
+import re
+import time
+import threading
+import itertools
+from settings import settings
+
+# name -> SQL with %s placeholders; '{access}' marks where a timeline_access() condition goes
+QUERIES = {}
+
+_statements = {}  # (name, final SQL) -> prepared statement name
+_statements_lock = threading.Lock()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+PLACEHOLDER = re.compile(r'%%|%s')
+
+
+def register(name, sql):
+    QUERIES[name] = sql
+    return name
+
+
+def patch_statement(table, columns, where="id = %s"):
+    """
+    One fixed UPDATE shape for partial updates of `columns` ((name, type)
+    pairs): every column is a (present, value) parameter pair, so each PATCH
+    reuses the same prepared statement whichever fields it sends.
+    """
+    assignments = ", ".join(f"{column} = CASE WHEN %s::boolean THEN %s::{sql_type} ELSE {column} END"
+                            for column, sql_type in columns)
+    return f"UPDATE {table} SET {assignments} WHERE {where} AND {{access}} RETURNING *"
+
+
+def patch_params(data, columns):
+    """Parameters for a patch_statement() query from a request body"""
+    params = []
+    for column, _ in columns:
+        params += [column in data, data.get(column)]
+    return params
+
+
+def _statement_name(name, sql):
+    key = (name, sql)
+    with _statements_lock:
+        if key not in _statements:
+            # One name per access variant of a query
+            variant = sum(1 for existing in _statements if existing[0] == name)
+            _statements[key] = f"q_{re.sub(r'[^a-z0-9]', '_', name.lower())}_{variant}"
+        return _statements[key]
+
+
+def _numbered(sql):
+    """psycopg2 %s placeholders to PREPARE's $1, $2, ..."""
+    counter = itertools.count(1)
+    return PLACEHOLDER.sub(lambda m: '%' if m.group() == '%%' else f"${next(counter)}", sql)
+
+
+def execute(cur, name, params=(), access="TRUE"):
+    """
+    Run registered query `name` on `cur`. `access` is the SQL half of a
+    timeline_access() condition; its params must already be in `params`.
+    Connections outside the pool (no `prepared` set) run the plain SQL.
+    """
+    sql = QUERIES[name].replace('{access}', access)
+    params = list(params)
+    prepared = getattr(cur.connection, 'prepared', None)
+    started = time.perf_counter()
+    if prepared is None:
+        cur.execute(sql, params)
+    else:
+        statement = _statement_name(name, sql)
+        if statement not in prepared:
+            cur.execute(f"PREPARE {statement} AS {_numbered(sql)}")
+            prepared.add(statement)
+        if params:
+            cur.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f"EXECUTE {statement}")
+    _record(name, time.perf_counter() - started)
+
+
+def _record(name, elapsed):
+    with _stats_lock:
+        stats = _stats.setdefault(name, {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['calls'] += 1
+        stats['total_ms'] += elapsed * 1000
+        stats['max_ms'] = max(stats['max_ms'], elapsed * 1000)
+    if elapsed * 1000 >= settings.slow_query_ms:
+        print(f"Slow query {name}: {elapsed * 1000:.0f} ms")
+
+
+def query_stats():
+    """Per-query call counts and timings for this worker process"""
+    with _stats_lock:
+        return {
+            name: {
+                'calls': stats['calls'],
+                'total_ms': round(stats['total_ms'], 1),
+                'avg_ms': round(stats['total_ms'] / stats['calls'], 2),
+                'max_ms': round(stats['max_ms'], 1),
+            }
+            for name, stats in sorted(_stats.items())
+        }
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Batch reprocessing of uploaded videos
+Re-encodes the back catalogue in parallel and points media rows at the new files.
+
+Replaces running transcode_video.py / fix_video_orientation.py per file and
+then `update_video_urls.py fix`. Progress goes to stderr, ffmpeg logs to
+stdout, so a typical run is:
+
+    python3 reprocess_media.py --jobs 8 > reprocess.log
+
+State is saved after every file, so an interrupted run picks up where it
+left off. Sources whose checksum and encoder version match the last run
+(and whose output still exists) are skipped.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from psycopg2.extras import RealDictCursor, execute_values
+from db import get_db_connection
+from file_gc import family_base, VARIANT_SUFFIXES, COLD_DIR
+import media_scheduler
+import media_storage
+from transcode_video import ENCODER_VERSION
+from fix_video_orientation import fix_video_orientation
+from video_pipeline import probe, plan, process_video
+
+UPLOADS_DIR = 'uploads'
+DEFAULT_STATE_FILE = 'reprocess_state.json'
+UPDATE_PAGE_SIZE = 500
+
+
+class State:
+    """Per-source results of previous runs, persisted as JSON after every update"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.sources = saved.get('sources', {})
+            # State files from before runs were grouped by source were keyed by media ID
+            for entry in saved.get('media', {}).values():
+                if entry.get('source'):
+                    self.sources.setdefault(entry['source'], entry)
+
+    def get(self, source_name):
+        with self.lock:
+            return dict(self.sources.get(source_name, {}))
+
+    def update(self, source_name, **fields):
+        with self.lock:
+            self.sources.setdefault(source_name, {}).update(fields)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'sources': self.sources}, f)
+            os.replace(tmp_path, self.path)
+
+
+class Progress:
+    """Single-line progress bar on stderr"""
+
+    def __init__(self, total):
+        self.total = total
+        self.counts = {'done': 0, 'skipped': 0, 'failed': 0}
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def advance(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+            finished = sum(self.counts.values())
+            elapsed = time.monotonic() - self.started
+            eta = elapsed / finished * (self.total - finished) if finished else 0
+            width = 30
+            filled = int(width * finished / self.total) if self.total else width
+            sys.stderr.write(
+                f"\r[{'#' * filled}{' ' * (width - filled)}] {finished}/{self.total} "
+                f"done={self.counts['done']} skipped={self.counts['skipped']} "
+                f"failed={self.counts['failed']} eta={eta:.0f}s "
+            )
+            sys.stderr.flush()
+
+    def finish(self):
+        sys.stderr.write("\n")
+
+
+def index_uploads():
+    """
+    One scan of uploads/ and the cold tier: original uploads by base name,
+    and every file name present in uploads/
+    """
+    originals = {}
+    names = set()
+    # Cold first, so a hot copy of the same original wins
+    if os.path.isdir(COLD_DIR):
+        with os.scandir(COLD_DIR) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.endswith('.gz') and os.path.splitext(name[:-3])[1].lower() in media_storage.COMPRESSIBLE_EXTENSIONS:
+                    name = name[:-3]
+                stem = os.path.splitext(name)[0]
+                if entry.is_file() and not name.endswith('.partial') and not stem.endswith(VARIANT_SUFFIXES):
+                    originals[stem] = name
+    if not os.path.isdir(UPLOADS_DIR):
+        return originals, names
+    with os.scandir(UPLOADS_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            names.add(entry.name)
+            stem = os.path.splitext(entry.name)[0]
+            if not stem.endswith(VARIANT_SUFFIXES):
+                originals[stem] = entry.name
+    return originals, names
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reprocess_one(source_name, names, state, force_all):
+    """Encodes one original upload; returns (outcome, output file name or None)"""
+    source_path = os.path.join(UPLOADS_DIR, source_name)
+    # Originals moved to the cold tier come back to uploads/ to be read
+    if not os.path.exists(source_path) and not media_storage.restore(source_name):
+        print(f"Could not restore {source_name} from the cold tier")
+        return 'failed', None
+    stat = os.stat(source_path)
+    previous = state.get(source_name)
+
+    # Reuse the checksum and decision while the source is unchanged on disk
+    if previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime \
+            and previous.get('sha256'):
+        checksum, action = previous['sha256'], previous.get('action')
+    else:
+        checksum, action = sha256_file(source_path), plan(source_path, probe(source_path))['action']
+        state.update(source_name, source=source_name, size=stat.st_size, mtime=stat.st_mtime,
+                     sha256=checksum, action=action)
+
+    # Already browser-ready; the upload path serves these as-is
+    if not force_all and action == 'passthrough':
+        return 'skipped', None
+
+    if previous.get('sha256') == checksum and previous.get('encoder_version') == ENCODER_VERSION \
+            and previous.get('output') in names:
+        return 'skipped', previous['output']
+
+    processed_path, decision = process_video(source_path, priority=stat.st_size, force_encode=force_all)
+    if not processed_path:
+        return 'failed', None
+    final_path = processed_path
+    if decision['video'] == 'encode':
+        final_path = fix_video_orientation(processed_path, priority=stat.st_size) or processed_path
+    output = os.path.basename(final_path)
+    state.update(source_name, encoder_version=ENCODER_VERSION, output=output)
+    return 'done', output
+
+
+def apply_url_updates(updates, outputs, dry_run=False):
+    """
+    Point media rows at their new files with batched UPDATEs, and record the
+    files of every re-encoded source in media_variants, in one transaction.
+    `outputs` maps source file names to the file now served for them.
+    """
+    if not updates and not outputs:
+        print("No media URLs to update")
+        return
+    if dry_run:
+        for media_id, new_url in updates:
+            print(f"Would update media ID {media_id} -> {new_url}")
+        return
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if updates:
+            execute_values(cur, """
+                UPDATE media SET file_url = v.file_url
+                FROM (VALUES %s) AS v(id, file_url)
+                WHERE media.id = v.id
+            """, updates, page_size=UPDATE_PAGE_SIZE)
+        # New outputs are tracked, and ones retention had deleted are hot again,
+        # still accounted to the uploader
+        for source_name, output in outputs.items():
+            source_url = f"/uploads/{source_name}"
+            cur.execute("""
+                SELECT user_id FROM media_variants
+                WHERE source_url = %s AND user_id IS NOT NULL LIMIT 1
+            """, (source_url,))
+            owner = cur.fetchone()
+            media_storage.record_variants(cur, source_url, f"/uploads/{output}", owner[0] if owner else None)
+        conn.commit()
+        print(f"Updated {len(updates)} media URLs, recorded the files of {len(outputs)} sources")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error updating media URLs, nothing was changed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess uploaded videos in parallel")
+    parser.add_argument('--jobs', type=int, default=max(1, media_scheduler.CPU_COUNT // 2),
+                        help="concurrent encodes (default: half the cores, two threads each)")
+    parser.add_argument('--state', default=DEFAULT_STATE_FILE, help="resumable state file")
+    parser.add_argument('--all', action='store_true', dest='force_all',
+                        help="re-encode every video, even ones that only need a remux or nothing")
+    parser.add_argument('--dry-run', action='store_true', help="don't write URL changes")
+    args = parser.parse_args()
+
+    media_scheduler.configure(slots=args.jobs)
+    state = State(args.state)
+    originals, names = index_uploads()
+
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT m.id, m.file_url, m.file_type
+        FROM media m
+        WHERE m.file_type LIKE 'video/%' OR m.file_url LIKE '%.mp4'
+        ORDER BY m.id
+    """)
+    records = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    # Cloned timelines and re-sent files share one original: encode it once
+    # and point every media row made from it at the result
+    jobs = {}
+    for record in records:
+        source_name = originals.get(family_base(os.path.basename(record['file_url'])))
+        if source_name:
+            jobs.setdefault(source_name, []).append(record)
+        else:
+            print(f"No original upload found for media ID {record['id']} ({record['file_url']})")
+    print(f"Reprocessing {len(jobs)} sources for {sum(len(group) for group in jobs.values())} "
+          f"of {len(records)} video records with {args.jobs} parallel encodes")
+
+    progress = Progress(len(jobs))
+    updates = []
+    outputs = {}  # source name -> new output, for sources encoded this run
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(reprocess_one, source_name, names, state, args.force_all): source_name
+            for source_name in jobs
+        }
+        for future in as_completed(futures):
+            source_name = futures[future]
+            try:
+                outcome, output = future.result()
+            except Exception as e:
+                print(f"Error reprocessing {source_name}: {e}")
+                outcome, output = 'failed', None
+            if outcome == 'done':
+                outputs[source_name] = output
+            if output:
+                updates += [(record['id'], f"/uploads/{output}") for record in jobs[source_name]
+                            if record['file_url'] != f"/uploads/{output}"]
+            progress.advance(outcome)
+    progress.finish()
+
+    apply_url_updates(updates, outputs, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+On-demand sampling profiler for single requests
+A profiled request's thread is sampled every PROFILE_INTERVAL_MS; its SQL
+statements (through pooled connections) and subprocess waits are timed as
+they happen, and the rows it fetches are counted. When the request ends a collapsed-stack file (<id>.folded, the
+input format of flamegraph.pl and speedscope) and a JSON summary are written
+to PROFILE_DIR, where any worker on the machine can serve them.
+
+    flamegraph.pl profiles/<id>.folded > profile.svg
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+from settings import settings
+
+PROFILE_DIR = settings.profile_dir
+PROFILE_INTERVAL = settings.profile_interval_ms / 1000
+PROFILE_KEEP = settings.profile_keep  # newest profiles kept on disk
+
+# Longest SQL text kept per statement, and functions listed in a summary
+SQL_TEXT_LIMIT = 500
+TOP_FUNCTIONS = 30
+
+_local = threading.local()
+_active = {}  # thread id -> Profile
+_active_lock = threading.Condition()
+_sampler = None
+
+
+class Profile:
+    """Samples and timed events of one request"""
+
+    def __init__(self, thread_id, method, path):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.thread_id = thread_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.stacks = Counter()
+        self.sql = []
+        self.rows_fetched = 0
+        self.subprocesses = []
+
+    def sample(self, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+            frames.append(f"{code.co_name} ({module}:{code.co_firstlineno})".replace(';', ':'))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(frames))] += 1
+
+    def summary(self, endpoint=None, status=None):
+        elapsed = time.perf_counter() - self.started
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        samples = sum(self.stacks.values())
+        sql_ms = sum(statement['ms'] for statement in self.sql)
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'endpoint': endpoint,
+            'status': status,
+            'started_at': self.started_at,
+            'duration_ms': round(elapsed * 1000, 1),
+            'samples': samples,
+            'interval_ms': settings.profile_interval_ms,
+            'self': [{'function': f, 'samples': c} for f, c in self_counts.most_common(TOP_FUNCTIONS)],
+            'total': [{'function': f, 'samples': c} for f, c in total_counts.most_common(TOP_FUNCTIONS)],
+            'sql_ms': round(sql_ms, 1),
+            'sql': self.sql,
+            'rows_fetched': self.rows_fetched,
+            'subprocess_ms': round(sum(wait['ms'] for wait in self.subprocesses), 1),
+            'subprocesses': self.subprocesses,
+        }
+
+
+def _sample_loop():
+    while True:
+        # Sampling holds the lock so stop() never sees a profile mid-sample
+        with _active_lock:
+            while not _active:
+                _active_lock.wait()
+            frames = sys._current_frames()
+            for profile in _active.values():
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.sample(frame)
+            frame = frames = None  # Don't keep other threads' frames alive while sleeping
+        time.sleep(PROFILE_INTERVAL)
+
+
+def start(method, path):
+    """Start profiling the current thread; returns the Profile"""
+    global _sampler
+    profile = Profile(threading.get_ident(), method, path)
+    _local.profile = profile
+    with _active_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name='request-profiler', daemon=True)
+            _sampler.start()
+        _active[profile.thread_id] = profile
+        _active_lock.notify_all()
+    return profile
+
+
+def current():
+    """The Profile of the current thread's request, or None"""
+    return getattr(_local, 'profile', None)
+
+
+def stop(endpoint=None, status=None, profile=None):
+    """
+    Stop profiling `profile` (default: the current thread's) and write its
+    files; returns the summary
+    """
+    profile = profile or current()
+    if profile is None:
+        return None
+    if current() is profile:
+        _local.profile = None
+    with _active_lock:
+        _active.pop(profile.thread_id, None)
+    summary = profile.summary(endpoint, status)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{profile.id}.folded"), 'w') as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in profile.stacks.items())
+    with open(os.path.join(PROFILE_DIR, f"{profile.id}.json"), 'w') as f:
+        json.dump(summary, f)
+    _prune()
+    print(f"Profiled {profile.method} {profile.path}: {summary['duration_ms']} ms, "
+          f"{summary['samples']} samples, {len(profile.sql)} SQL statements, "
+          f"{profile.rows_fetched} rows fetched -> {profile.id}")
+    return summary
+
+
+def _prune():
+    try:
+        names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    except FileNotFoundError:
+        return
+    for name in names[:-PROFILE_KEEP]:
+        for ext in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name[:-len('.json')] + ext))
+            except FileNotFoundError:
+                pass
+
+
+def record(kind, label, seconds, rows=None):
+    """
+    Add a timed 'sql' or 'subprocess' event to the current request's profile,
+    if any. `rows` is a statement's rowcount (None or -1 when not known yet).
+    """
+    profile = current()
+    if profile is None:
+        return
+    event = {'ms': round(seconds * 1000, 2), 'at_ms': round((time.perf_counter() - profile.started - seconds) * 1000, 1)}
+    if kind == 'sql':
+        rows = rows if rows is not None and rows >= 0 else None
+        profile.sql.append({'statement': ' '.join(label.split())[:SQL_TEXT_LIMIT], 'rows': rows, **event})
+    else:
+        profile.subprocesses.append({'command': label, **event})
+
+
+def fetched(count):
+    """Count rows handed to the current request's code"""
+    profile = current()
+    if profile is not None:
+        profile.rows_fetched += count
+
+
+class ProfiledCursor:
+    """Cursor wrapper timing execute()/executemany() and counting fetched rows for the current profile"""
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, params)
+        finally:
+            record('sql', query.decode() if isinstance(query, bytes) else str(query), time.perf_counter() - started,
+                   self._cursor.rowcount)
+
+    def executemany(self, query, params_seq):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, params_seq)
+        finally:
+            record('sql', str(query), time.perf_counter() - started, self._cursor.rowcount)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        fetched(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        # Named cursors fetch `itersize` rows per round trip while iterating
+        for row in self._cursor:
+            fetched(1)
+            yield row
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+def list_profiles(limit=50):
+    """Summaries of the newest profiles, without their per-statement detail"""
+    try:
+        names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({key: summary.get(key) for key in
+                         ('id', 'method', 'path', 'endpoint', 'status', 'started_at', 'duration_ms',
+                          'samples', 'sql_ms', 'rows_fetched', 'subprocess_ms')})
+    return profiles
+
+
+def profile_path(profile_id, ext):
+    """Path of a profile file, or None for an unknown or malformed id"""
+    if not profile_id.replace('-', '').isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}{ext}")
+    return path if os.path.exists(path) else None
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Segment-parallel encoding for long videos
+The video stream is cut at keyframes into SEGMENT_SECONDS pieces that encode
+at the same time in the scheduler's slots; the encoded pieces are then joined
+without re-encoding and muxed with the audio
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+import media_scheduler
+from media_scheduler import run_ffmpeg
+from transcode_video import VIDEO_ENCODE_ARGS, AUDIO_ENCODE_ARGS
+from settings import settings
+
+# Target segment length, and the shortest video worth splitting (SEGMENT_SECONDS,
+# SEGMENT_MIN_DURATION settings)
+SEGMENT_SECONDS = settings.segment_seconds
+SEGMENT_MIN_DURATION = settings.segment_min_duration
+
+# Segments stop this far short of the next keyframe so no frame is encoded twice
+BOUNDARY_EPSILON = 0.0005
+
+# Working files live next to the upload (same disk) under a hidden directory
+WORK_DIR_PREFIX = '.segments-'
+
+
+class SegmentFailed(Exception):
+    pass
+
+
+def encode_timeout(duration):
+    """ENCODE_TIMEOUT, raised for long inputs to ENCODE_TIMEOUT_PER_SECOND per second of video"""
+    return max(settings.encode_timeout, int(duration * settings.encode_timeout_per_second))
+
+
+def should_segment(decision):
+    """Worth splitting: a video re-encode long enough, with more than one slot to spread it over"""
+    return (decision['video'] == 'encode' and decision['duration'] >= SEGMENT_MIN_DURATION
+            and media_scheduler.ENCODE_SLOTS > 1)
+
+
+def keyframe_times(path):
+    """Timestamps of the first video stream's keyframes, read from packet flags without decoding"""
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path
+    ], capture_output=True, text=True, timeout=settings.remux_timeout)
+    times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                times.append(float(pts_time))
+            except ValueError:
+                pass
+    return sorted(times)
+
+
+def plan_segments(keyframes, duration, segment_seconds=SEGMENT_SECONDS):
+    """
+    (start, length) pairs covering the whole video, each starting on a
+    keyframe at least `segment_seconds` after the previous start. The last
+    segment runs to the end (length None) and is at least half a segment long.
+    """
+    starts = [0.0]
+    for t in keyframes:
+        if t - starts[-1] >= segment_seconds and duration - t >= segment_seconds / 2:
+            starts.append(t)
+    segments = [(start, next_start - start - BOUNDARY_EPSILON) for start, next_start in zip(starts, starts[1:])]
+    return segments + [(starts[-1], None)]
+
+
+class SegmentProgress:
+    """
+    Combines the -progress reports of parallel segment encodes into one
+    report for a media_jobs.ProgressTracker. Once the job is cancelled, or a
+    segment fails, every segment's callback returns False so they all stop.
+    """
+
+    def __init__(self, on_progress, count):
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.done = [0.0] * count
+        self.speeds = {}
+        self.stopped = False
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+
+    def callback(self, index, length):
+        def report(block):
+            with self.lock:
+                if self.stopped:
+                    return False
+                out_time_us = block.get('out_time_us') or block.get('out_time_ms')
+                if out_time_us and out_time_us.lstrip('-').isdigit():
+                    self.done[index] = max(0, int(out_time_us)) / 1_000_000
+                try:
+                    self.speeds[index] = float(block.get('speed', '').rstrip('x'))
+                except ValueError:
+                    pass
+                if block.get('progress') == 'end':
+                    self.done[index] = length if length is not None else self.done[index]
+                    self.speeds.pop(index, None)
+                if self.on_progress is None:
+                    return True
+                combined = {}
+                if block:
+                    # Segments run side by side, so their speeds add up
+                    combined = {'out_time_us': str(int(sum(self.done) * 1_000_000)), 'progress': 'continue',
+                                'speed': f"{sum(self.speeds.values())}x", 'fps': block.get('fps', '')}
+                if self.on_progress(combined) is False:
+                    self.stopped = True
+                    return False
+                return True
+        return report
+
+
+def encode_segmented(input_path, output_path, decision, priority=0, on_progress=None):
+    """
+    Encode `input_path` to an MP4 at `output_path` as parallel segments.
+    Returns a CompletedProcess like run_ffmpeg (returncode 0 on success), or
+    None when the video has too few keyframes to split, or they can't be read
+    in time; the caller then encodes in a single pass. Raises EncodeCancelled
+    if the job is cancelled.
+    """
+    try:
+        keyframes = keyframe_times(input_path)
+    except subprocess.TimeoutExpired:
+        print(f"Reading keyframes of {os.path.basename(input_path)} timed out, encoding in one pass")
+        return None
+    segments = plan_segments(keyframes, decision['duration'])
+    if len(segments) < 2:
+        return None
+    print(f"Encoding {os.path.basename(input_path)} as {len(segments)} segments")
+    decision['segments'] = len(segments)
+
+    work_dir = tempfile.mkdtemp(prefix=WORK_DIR_PREFIX, dir=os.path.dirname(input_path) or '.')
+    progress = SegmentProgress(on_progress, len(segments))
+
+    def encode(index):
+        start, length = segments[index]
+        segment_path = os.path.join(work_dir, f"{index:05d}.mkv")
+        cmd = ['ffmpeg']
+        if start:
+            cmd += ['-ss', f"{start:.6f}"]  # Input seek: starts right on the keyframe
+        cmd += ['-i', input_path]
+        if length is not None:
+            cmd += ['-t', f"{length:.6f}"]
+        cmd += ['-map', '0:v:0', '-an', *VIDEO_ENCODE_ARGS,
+                '-threads', str(media_scheduler.ENCODE_THREADS), '-y', segment_path]
+        try:
+            result = run_ffmpeg(
+                cmd,
+                priority=priority,
+                timeout=encode_timeout(length if length is not None else decision['duration'] - start),
+                on_progress=progress.callback(index, length)
+            )
+        except subprocess.TimeoutExpired:
+            raise SegmentFailed(f"segment {index} timed out")
+        if result.returncode != 0 or not os.path.exists(segment_path):
+            raise SegmentFailed(f"segment {index}: {result.stderr[-2000:]}")
+        return segment_path
+
+    try:
+        with ThreadPoolExecutor(max_workers=media_scheduler.ENCODE_SLOTS) as pool:
+            futures = [pool.submit(encode, index) for index in range(len(segments))]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            if pending:
+                # A segment failed (or the job was cancelled): no point finishing the others
+                progress.stop()
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+        errors = [future.exception() for future in futures if not future.cancelled() and future.exception()]
+        failures = [e for e in errors if isinstance(e, SegmentFailed)]
+        if failures:
+            return subprocess.CompletedProcess([], 1, '', f"Segment encode failed: {failures[0]}")
+        if errors:
+            raise errors[0]  # EncodeCancelled, or anything unexpected
+
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            f.writelines(f"file '{index:05d}.mkv'\n" for index in range(len(segments)))
+        cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path, '-i', input_path, '-map', '0:v:0']
+        if decision['audio']:
+            cmd += ['-map', '1:a:0']
+            cmd += AUDIO_ENCODE_ARGS if decision['audio'] == 'encode' else ['-c:a', 'copy']
+        cmd += ['-c:v', 'copy', '-movflags', '+faststart', '-y', output_path]
+        print(f"Running: {' '.join(cmd)}")
+        return run_ffmpeg(cmd, priority=priority, timeout=max(settings.remux_timeout, encode_timeout(decision['duration']) // 4))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Deployment settings shared by the app, gunicorn and the CLI scripts
+Each field can be set with the upper-cased environment variable (DATABASE_URL,
+DB_POOL_MAX, ...) or a KEY=VALUE line in settings.env (path overridable with
+SETTINGS_FILE); the environment wins. Everything is validated once, at import.
+
+    python3 settings.py    # print the effective settings
+"""
+
+import os
+import sys
+from dataclasses import dataclass, fields
+
+SETTINGS_FILE = os.environ.get('SETTINGS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.env'))
+
+DEV_SECRET_KEY = 'your-secret-key-change-this-in-production'
+
+# Values that are never printed
+SECRET_FIELDS = ('database_url', 'database_replica_urls', 'secret_key')
+
+
+class SettingsError(Exception):
+    """Raised at startup when settings are missing or invalid"""
+
+
+@dataclass(frozen=True)
+class Settings:
+    app_env: str = 'development'  # 'development' or 'production'
+    secret_key: str = DEV_SECRET_KEY
+
+    # Database: a libpq DSN or postgres:// URL, and connections kept per process.
+    # No default; db.py requires it when a connection is opened, so tools that
+    # never touch the database (transcode_video.py ...) run without it
+    database_url: str = ''
+    db_pool_min: int = 1
+    db_pool_max: int = 10
+    db_pool_timeout: float = 10.0  # seconds to wait for a free pooled connection
+    slow_query_ms: int = 250  # registered queries slower than this are logged
+    # Read replicas for read-only routes: comma-separated DSNs/URLs, and how far
+    # behind the primary (seconds) a replica may be before reads go to the primary
+    database_replica_urls: str = ''
+    replica_max_lag: float = 5.0
+
+    # gunicorn (see gunicorn.conf.py); threads serve SSE streams and uploads
+    gunicorn_workers: int = 3
+    gunicorn_threads: int = 4
+    gunicorn_timeout: int = 300
+    gunicorn_bind: str = ''  # empty: gunicorn's default ($PORT or 127.0.0.1:8000)
+    # /changes/stream connections per worker process. Each holds a thread and a
+    # database connection for as long as the tab is open, so 0 turns SSE off
+    # and clients poll /changes instead
+    change_stream_max: int = 0
+
+    # Request profiling (request_profiler.py): admins send X-Profile: 1, and this
+    # fraction (0-1) of all requests is profiled as well
+    profile_sample_rate: float = 0.0
+    profile_interval_ms: int = 5
+    profile_dir: str = 'profiles'
+    profile_keep: int = 100
+
+    # Caches and streamed listings
+    cache_ttl: int = 300  # seconds; upper bound on staleness of shared caches
+    stream_batch_size: int = 1000
+
+    # Video encoding; 0 slots/threads means derive from the CPU count
+    video_preset: str = 'ultrafast'
+    video_crf: int = 23
+    audio_bitrate: str = '128k'
+    encode_slots: int = 0
+    encode_threads: int = 0
+    encode_timeout: int = 300
+    encode_timeout_per_second: float = 3.0  # long videos get this many seconds per second of input
+    orientation_timeout: int = 180
+    remux_timeout: int = 120
+    probe_timeout: int = 10
+    # Videos at least SEGMENT_MIN_DURATION seconds long encode as parallel segments of about SEGMENT_SECONDS
+    segment_seconds: int = 60
+    segment_min_duration: int = 180
+
+    # Display copies of photos (image_pipeline.py): longest side in px, quality, 'jpeg' or 'webp'
+    image_max_dimension: int = 2048
+    image_quality: int = 82
+    image_format: str = 'jpeg'
+
+    # Uploads, in MB
+    max_request_mb: int = 4096
+    max_video_mb: int = 2048
+    max_audio_mb: int = 200
+    max_image_mb: int = 25
+    max_document_mb: int = 50
+
+    # Upload admission (upload_admission.py); 0 means no limit. Uploads beyond
+    # the limits get 429, and 507 when the uploads volume would drop below
+    # UPLOAD_MIN_FREE_MB
+    upload_max_concurrent: int = 8
+    upload_max_concurrent_per_user: int = 2
+    upload_max_pending_mb: int = 8192
+    upload_max_pending_mb_per_user: int = 4096
+    upload_min_free_mb: int = 2048
+    upload_retry_after: int = 30  # seconds, sent as Retry-After
+    upload_lease_ttl: int = 7200  # seconds before a crashed worker's lease is dropped
+
+    # File garbage collection
+    gc_batch_size: int = 200
+    orphan_sweep_interval: int = 3600
+    orphan_grace_period: int = 86400
+
+    # Retention (media_storage.py), in seconds: intermediates are deleted this
+    # long after processing; originals with a served copy move to the cold
+    # tier directory after RETENTION_COLD_AFTER_SECONDS (0 keeps them hot)
+    retention_interval: int = 3600
+    retention_intermediate_seconds: int = 3600
+    retention_cold_after_seconds: int = 604800
+    cold_storage_dir: str = 'uploads_cold'
+
+    def validate(self):
+        errors = []
+        if self.app_env not in ('development', 'production'):
+            errors.append("APP_ENV must be 'development' or 'production'")
+        if self.app_env == 'production' and self.secret_key == DEV_SECRET_KEY:
+            errors.append("SECRET_KEY must be set in production")
+        if self.db_pool_min < 0 or self.db_pool_max < max(1, self.db_pool_min):
+            errors.append("DB_POOL_MAX must be at least 1 and at least DB_POOL_MIN")
+        if not 0 <= self.video_crf <= 51:
+            errors.append("VIDEO_CRF must be between 0 and 51")
+        if self.video_preset not in ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+                                     'medium', 'slow', 'slower', 'veryslow'):
+            errors.append(f"VIDEO_PRESET '{self.video_preset}' is not an x264 preset")
+        if not 1 <= self.image_quality <= 100:
+            errors.append("IMAGE_QUALITY must be between 1 and 100")
+        if self.change_stream_max and self.change_stream_max >= self.gunicorn_threads:
+            errors.append("CHANGE_STREAM_MAX must be less than GUNICORN_THREADS so API requests keep a thread")
+        if self.profile_sample_rate > 1:
+            errors.append("PROFILE_SAMPLE_RATE must be between 0 and 1")
+        if self.image_format not in ('jpeg', 'webp'):
+            errors.append("IMAGE_FORMAT must be 'jpeg' or 'webp'")
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if field.type in (int, float) and value < 0:
+                errors.append(f"{field.name.upper()} can't be negative")
+        for name in ('gunicorn_workers', 'gunicorn_threads', 'db_pool_timeout', 'replica_max_lag', 'cache_ttl',
+                     'stream_batch_size', 'image_max_dimension', 'encode_timeout', 'orientation_timeout',
+                     'remux_timeout', 'probe_timeout', 'segment_seconds', 'upload_retry_after',
+                     'upload_lease_ttl', 'gc_batch_size', 'retention_interval',
+                     'profile_interval_ms', 'profile_keep'):
+            if getattr(self, name) <= 0:
+                errors.append(f"{name.upper()} must be greater than 0")
+        return errors
+
+
+def read_settings_file(path):
+    """KEY=VALUE lines; blank lines and # comments are ignored"""
+    values = {}
+    if not os.path.exists(path):
+        return values
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if '=' not in line:
+                raise SettingsError(f"{path}:{number}: expected KEY=VALUE")
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip().strip('"\'')
+    return values
+
+
+def convert(field, raw):
+    if field.type is bool:
+        if raw.lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if raw.lower() in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError(raw)
+    return field.type(raw)
+
+
+def load(environ=None, path=SETTINGS_FILE):
+    """Build Settings from defaults, the settings file and the environment"""
+    environ = os.environ if environ is None else environ
+    file_values = read_settings_file(path)
+    values = {}
+    errors = []
+    for field in fields(Settings):
+        key = field.name.upper()
+        raw = environ.get(key, file_values.get(key))
+        if raw is None:
+            continue
+        try:
+            values[field.name] = convert(field, raw)
+        except ValueError:
+            errors.append(f"{key}={raw!r} is not a valid {field.type.__name__}")
+    if errors:
+        raise SettingsError("Invalid settings: " + "; ".join(errors))
+    loaded = Settings(**values)
+    errors = loaded.validate()
+    if errors:
+        raise SettingsError("Invalid settings: " + "; ".join(errors))
+    return loaded
+
+
+settings = load()
+
+
+if __name__ == "__main__":
+    for field in fields(Settings):
+        value = getattr(settings, field.name)
+        if field.name in SECRET_FIELDS and value:
+            value = '********'
+        print(f"{field.name.upper()}={value}")
+    sys.exit(0)
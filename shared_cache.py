@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Read-through caches for data every user reads and few users write
+Each worker keeps its own copy; writers NOTIFY so every worker drops it on commit
+"""
+
+import time
+import select
+import threading
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from db import get_db_connection
+from settings import settings
+
+CACHE_CHANNEL = 'cache_invalidate'
+
+# Upper bound on staleness if a notification is ever missed
+DEFAULT_TTL = settings.cache_ttl  # seconds
+LISTEN_RECONNECT_DELAY = 5  # seconds
+
+_caches = {}
+_start_lock = threading.Lock()
+_started = False
+
+
+class ReadThroughCache:
+    """
+    One cached value, loaded by `loader()` on first use and after
+    invalidation. Concurrent misses wait for a single load instead of all
+    hitting the database.
+    """
+
+    def __init__(self, name, loader, ttl=DEFAULT_TTL):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded_at = None
+        self.generation = 0
+
+    def get(self):
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl:
+                return self.value
+            generation = self.generation
+            value = self.loader()
+            # Don't keep a value that was invalidated while it was loading
+            if generation == self.generation:
+                self.value = value
+                self.loaded_at = time.monotonic()
+            return value
+
+    def invalidate(self):
+        self.generation += 1
+        self.loaded_at = None
+
+
+def register(name, loader, ttl=DEFAULT_TTL):
+    cache = ReadThroughCache(name, loader, ttl)
+    _caches[name] = cache
+    return cache
+
+
+def notify_invalidation(cur, name):
+    """Tell every worker to drop cache `name` once the caller's transaction commits"""
+    cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, name))
+
+
+def invalidate_all():
+    for cache in _caches.values():
+        cache.invalidate()
+
+
+def _listen_loop():
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection(dedicated=True)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CACHE_CHANNEL}")
+            # Anything may have changed while we weren't listening
+            invalidate_all()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    cache = _caches.get(conn.notifies.pop(0).payload)
+                    if cache:
+                        cache.invalidate()
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+            invalidate_all()
+            time.sleep(LISTEN_RECONNECT_DELAY)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start_cache_listener():
+    """Start the invalidation listener thread once per process"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        threading.Thread(target=_listen_loop, name='cache-invalidation', daemon=True).start()
+        _started = True
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+In-memory cache for the HTML pages
+Inline <script>/<style> blocks are split into content-hashed files, and every
+body is kept precompressed (gzip, and brotli when installed) with an ETag
+"""
+
+import os
+import re
+import gzip
+import hashlib
+import threading
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip alone still works
+    brotli = None
+
+PAGES = ('timeline.html', 'login.html')
+
+INLINE_SCRIPT = re.compile(r'<script>(.*?)</script>', re.S)
+INLINE_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+
+# Pages revalidate on every load (cheap 304s); hashed assets never change
+PAGE_CACHE_CONTROL = 'no-cache'
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    """One response body with its precompressed variants"""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants = {'identity': body}
+        gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gzipped) < len(body):
+            self.variants['gzip'] = gzipped
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding):
+        return f'"{self.digest[:16]}-{encoding}"'
+
+
+class AssetCache:
+    def __init__(self, root='.', pages=PAGES):
+        self.root = root
+        self.pages = pages
+        self.lock = threading.Lock()
+        self.mtimes = {}
+        self.page_assets = {}
+        # Older hashed files stay available so pages already loaded keep working after a reload
+        self.files = {}
+
+    def load(self):
+        with self.lock:
+            for name in self.pages:
+                self._build_page(name)
+
+    def _build_page(self, name):
+        path = os.path.join(self.root, name)
+        try:
+            self.mtimes[name] = os.path.getmtime(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+        except FileNotFoundError:
+            self.page_assets.pop(name, None)
+            return
+        stem = os.path.splitext(name)[0]
+        counter = {'js': 0, 'css': 0}
+
+        def extract(kind, content_type, tag):
+            def replace(match):
+                body = match.group(1).encode('utf-8')
+                asset = Asset(body, content_type)
+                counter[kind] += 1
+                filename = f"{stem}-{counter[kind]}.{asset.digest[:12]}.{kind}"
+                self.files[filename] = asset
+                return tag(f"/assets/{filename}")
+            return replace
+
+        html = INLINE_STYLE.sub(extract('css', 'text/css; charset=utf-8',
+                                        lambda url: f'<link rel="stylesheet" href="{url}">'), html)
+        html = INLINE_SCRIPT.sub(extract('js', 'application/javascript; charset=utf-8',
+                                         lambda url: f'<script src="{url}"></script>'), html)
+        self.page_assets[name] = Asset(html.encode('utf-8'), 'text/html; charset=utf-8')
+        print(f"Cached {name} ({len(html)} bytes, {counter['js']} scripts, {counter['css']} styles)")
+
+    def _reload_if_changed(self, name):
+        try:
+            mtime = os.path.getmtime(os.path.join(self.root, name))
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self.mtimes.get(name):
+            with self.lock:
+                self._build_page(name)
+
+    def page(self, name, check_changes=False):
+        """Cached page, rebuilt first when `check_changes` (dev) and the file changed"""
+        if check_changes or name not in self.mtimes:
+            self._reload_if_changed(name)
+        return self.page_assets.get(name)
+
+    def asset(self, filename):
+        return self.files.get(filename)
+
+
+def asset_response(asset, cache_control):
+    """Serve the best encoding the client accepts, answering 304 when its ETag matches"""
+    accepted = request.headers.get('Accept-Encoding', '')
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in asset.variants and candidate in accepted:
+            encoding = candidate
+            break
+    etag = asset.etag(encoding)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(asset.variants[encoding], content_type=asset.content_type, headers=headers)
@@ -8,12 +8,41 @@ import os
 import sys
 import subprocess
 import tempfile
+import media_scheduler
+from media_scheduler import run_ffmpeg
+from settings import settings
 
-def transcode_video(input_path):
+# Changes with the encode settings below so reprocess_media.py knows
+# existing outputs are stale; bump the suffix for other encoder changes
+ENCODER_VERSION = f'libx264-{settings.video_preset}-crf{settings.video_crf}-aac{settings.audio_bitrate}-v1'
+
+# Encode settings shared with video_pipeline.py and fix_video_orientation.py
+# (VIDEO_PRESET, VIDEO_CRF and AUDIO_BITRATE settings)
+VIDEO_ENCODE_ARGS = [
+    '-c:v', 'libx264',                      # H.264 codec
+    '-preset', settings.video_preset,       # ultrafast by default
+    '-crf', str(settings.video_crf),        # 23: good quality, reasonable file size
+]
+AUDIO_ENCODE_ARGS = [
+    '-c:a', 'aac',                          # AAC audio codec
+    '-b:a', settings.audio_bitrate,         # Audio bitrate
+]
+
+def transcode_video(input_path, priority=None):
     """
     Transcode video to web-compatible H.264 format with optimized settings
     Returns the path to the transcoded file, or None if failed
+    Encodes wait for a scheduler slot; smaller `priority` runs first (default: file size)
     """
+    # Timeout scaled to the duration; ENCODE_TIMEOUT when it can't be probed
+    from video_pipeline import probe
+    from segment_encode import encode_timeout
+    try:
+        timeout = encode_timeout(probe(input_path)['duration'] or 0)
+    except Exception as e:
+        print(f"Could not probe {os.path.basename(input_path)} for its duration: {e}")
+        timeout = encode_timeout(0)
+
     try:
         if not os.path.exists(input_path):
             print(f"Input file not found: {input_path}")
@@ -31,24 +60,21 @@ def transcode_video(input_path):
         cmd = [
             'ffmpeg',
             '-i', input_path,
-            '-c:v', 'libx264',           # H.264 codec
-            '-preset', 'ultrafast',       # Fastest encoding preset
-            '-crf', '23',                 # Good quality, reasonable file size
-            '-c:a', 'aac',               # AAC audio codec
-            '-b:a', '128k',              # Audio bitrate
+            *VIDEO_ENCODE_ARGS,
+            *AUDIO_ENCODE_ARGS,
             '-movflags', '+faststart',    # Optimize for web streaming
+            '-threads', str(media_scheduler.ENCODE_THREADS),  # Share the CPU with other encodes
             '-y',                         # Overwrite output file
             output_path
         ]
         
         print(f"Running: {' '.join(cmd)}")
         
-        # Run transcoding with timeout
-        result = subprocess.run(
+        # Run transcoding once a slot is free
+        result = run_ffmpeg(
             cmd,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout
+            priority=file_size if priority is None else priority,
+            timeout=timeout
         )
         
         if result.returncode == 0 and os.path.exists(output_path):
@@ -62,7 +88,7 @@ def transcode_video(input_path):
             return None
             
     except subprocess.TimeoutExpired:
-        print("Transcoding timed out after 5 minutes")
+        print(f"Transcoding timed out after {timeout} seconds")
         return None
     except Exception as e:
         print(f"Error during transcoding: {e}")
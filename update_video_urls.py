@@ -3,20 +3,24 @@
 Script to update video URLs in the database to point to transcoded web-compatible versions.
 """
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import os
 from pathlib import Path
+from db import get_db_connection
 
-def get_db_connection():
-    """Get database connection"""
-    conn = psycopg2.connect(
-        dbname="timeline_db",
-        user="timeline_user",
-        password="Paradox*456*",
-        host="localhost"
-    )
-    return conn
+def upload_names():
+    """Names of every file in uploads/, from a single directory scan"""
+    if not os.path.isdir('uploads'):
+        return set()
+    return set(os.listdir('uploads'))
+
+def apply_updates(cur, updates):
+    """Write (media_id, new_url) pairs with batched UPDATEs"""
+    execute_values(cur, """
+        UPDATE media SET file_url = v.file_url
+        FROM (VALUES %s) AS v(id, file_url)
+        WHERE media.id = v.id
+    """, updates, page_size=500)
 
 def update_video_urls():
     """
@@ -36,6 +40,8 @@ def update_video_urls():
         media_records = cur.fetchall()
         print(f"Found {len(media_records)} video records in database")
         
+        existing = upload_names()
+        updates = []
         updated_count = 0
         
         for record in media_records:
@@ -44,23 +50,16 @@ def update_video_urls():
             
             # Check if transcoded version exists
             transcoded_name = file_name.replace('.mp4', '_web.mp4')
-            transcoded_path = f"uploads/{transcoded_name}"
-            
-            if os.path.exists(transcoded_path):
+            if transcoded_name in existing:
                 new_url = f"/uploads/{transcoded_name}"
-                
-                # Update the database
-                cur.execute("""
-                    UPDATE media 
-                    SET file_url = %s 
-                    WHERE id = %s
-                """, (new_url, record['id']))
+                updates.append((record['id'], new_url))
                 
                 print(f"Updated media ID {record['id']}: {old_url} -> {new_url}")
                 updated_count += 1
             else:
                 print(f"No transcoded version found for {file_name}")
         
+        apply_updates(cur, updates)
         conn.commit()
         print(f"\nSuccessfully updated {updated_count} video URLs")
         
@@ -89,6 +88,8 @@ def update_to_fixed_videos():
         media_records = cur.fetchall()
         print(f"Found {len(media_records)} video records in database")
         
+        existing = upload_names()
+        updates = []
         updated_count = 0
         
         for record in media_records:
@@ -101,23 +102,16 @@ def update_to_fixed_videos():
             else:
                 fixed_name = file_name.replace('.mp4', '_web_fixed.mp4')
             
-            fixed_path = f"uploads/{fixed_name}"
-            
-            if os.path.exists(fixed_path):
+            if fixed_name in existing:
                 new_url = f"/uploads/{fixed_name}"
-                
-                # Update the database
-                cur.execute("""
-                    UPDATE media 
-                    SET file_url = %s 
-                    WHERE id = %s
-                """, (new_url, record['id']))
+                updates.append((record['id'], new_url))
                 
                 print(f"Updated media ID {record['id']}: {old_url} -> {new_url}")
                 updated_count += 1
             else:
                 print(f"No fixed version found for {file_name}")
         
+        apply_updates(cur, updates)
         conn.commit()
         print(f"\nSuccessfully updated {updated_count} video URLs to fixed orientation")
         
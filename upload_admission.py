@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Admission control for uploads
+Each upload holds a lease (upload_leases table) from before its body is read
+until its processing finishes, so every worker sees the same totals. New
+uploads get 429 while the user's or the site's concurrent uploads or pending
+bytes are at their limit, and 507 when they would leave the uploads volume
+with less than UPLOAD_MIN_FREE_MB.
+"""
+
+from db import get_db_connection
+from settings import settings
+from upload_validation import UploadRejected, MB, MIN_FREE_BYTES, free_bytes
+
+# Limits (UPLOAD_* settings); 0 means no limit
+MAX_CONCURRENT = settings.upload_max_concurrent
+MAX_CONCURRENT_PER_USER = settings.upload_max_concurrent_per_user
+MAX_PENDING_BYTES = settings.upload_max_pending_mb * MB
+MAX_PENDING_BYTES_PER_USER = settings.upload_max_pending_mb_per_user * MB
+
+RETRY_AFTER = settings.upload_retry_after
+LEASE_TTL = settings.upload_lease_ttl
+
+# pg_advisory_xact_lock key that serialises admissions across workers
+ADMISSION_LOCK = 4604
+
+
+def _over(limit, current, adding=0):
+    return limit and current and current + adding > limit
+
+
+def admit(user_id, size):
+    """
+    Take a lease for an upload of `size` bytes (the request's Content-Length)
+    by `user_id`; returns the lease id for release(). Raises UploadRejected
+    (429 or 507, with a retry_after) when the upload can't be admitted now.
+    A single upload is always admitted when nothing else is pending, so a
+    file larger than a byte limit is refused by the size limits, not here.
+    """
+    size = size or 0
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (ADMISSION_LOCK,))
+        cur.execute("DELETE FROM upload_leases WHERE expires_at < CURRENT_TIMESTAMP")
+        cur.execute("""
+            SELECT count(*), COALESCE(sum(bytes), 0),
+                   count(*) FILTER (WHERE user_id = %s), COALESCE(sum(bytes) FILTER (WHERE user_id = %s), 0)
+            FROM upload_leases
+        """, (user_id, user_id))
+        uploads, pending, user_uploads, user_pending = (int(value) for value in cur.fetchone())
+
+        refusal = None
+        if _over(MAX_CONCURRENT_PER_USER, user_uploads, 1):
+            refusal = f"You already have {user_uploads} uploads in progress"
+        elif _over(MAX_PENDING_BYTES_PER_USER, user_pending, size):
+            refusal = f"You already have {user_pending // MB} MB of uploads in progress"
+        elif _over(MAX_CONCURRENT, uploads, 1) or _over(MAX_PENDING_BYTES, pending, size):
+            refusal = "Too many uploads in progress"
+        if refusal:
+            conn.rollback()
+            raise UploadRejected(f"{refusal}, try again later", 429, RETRY_AFTER)
+
+        # Pending uploads haven't all reached the disk yet, so count them as used
+        if free_bytes() - pending - size < MIN_FREE_BYTES:
+            conn.rollback()
+            print(f"Upload refused: less than {MIN_FREE_BYTES // MB} MB would be left free")
+            raise UploadRejected("Upload storage is full, try again later", 507, RETRY_AFTER)
+
+        cur.execute("""
+            INSERT INTO upload_leases (user_id, bytes, expires_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            RETURNING id
+        """, (user_id, size, LEASE_TTL))
+        lease_id = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+        return lease_id
+    finally:
+        conn.close()
+
+
+def release(lease_id):
+    """End an upload's lease; errors are logged, the lease then expires on its own"""
+    if lease_id is None:
+        return
+    try:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM upload_leases WHERE id = %s", (lease_id,))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Error releasing upload lease {lease_id}: {e}")
+
+
+def admission_stats():
+    """Uploads in progress against the limits, and free space, for monitoring"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT count(*), COALESCE(sum(bytes), 0), count(DISTINCT user_id)
+            FROM upload_leases WHERE expires_at >= CURRENT_TIMESTAMP
+        """)
+        uploads, pending, users = (int(value) for value in cur.fetchone())
+        cur.close()
+    finally:
+        conn.close()
+    return {
+        'uploads': uploads,
+        'pending_mb': pending // MB,
+        'users': users,
+        'max_concurrent': MAX_CONCURRENT,
+        'max_concurrent_per_user': MAX_CONCURRENT_PER_USER,
+        'max_pending_mb': MAX_PENDING_BYTES // MB,
+        'max_pending_mb_per_user': MAX_PENDING_BYTES_PER_USER // MB,
+        'free_mb': free_bytes() // MB,
+        'min_free_mb': MIN_FREE_BYTES // MB,
+    }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Streaming validation for uploads
+Multipart file parts are written straight to a temp file in uploads/ while we
+check size limits, sniff the format from the first bytes and hash the data.
+Nothing lands under its final name until process_upload() commits it.
+"""
+
+import os
+import uuid
+import shutil
+import hashlib
+from flask import Request
+from settings import settings
+
+UPLOADS_DIR = 'uploads'
+
+MB = 1024 * 1024
+
+# Largest request accepted at all (Flask answers 413 before reading the body)
+MAX_REQUEST_SIZE = settings.max_request_mb * MB
+
+# Per-file limits by kind of file
+SIZE_LIMITS = {
+    'video': settings.max_video_mb * MB,
+    'audio': settings.max_audio_mb * MB,
+    'image': settings.max_image_mb * MB,
+    'document': settings.max_document_mb * MB,
+}
+
+# Bytes needed to recognise every format below
+SNIFF_BYTES = 64
+
+# Multipart boundaries and part headers around a single file
+MULTIPART_OVERHEAD = 16 * 1024
+
+TEMP_PREFIX = '.upload-'
+
+# Free space kept on the uploads volume (UPLOAD_MIN_FREE_MB); streaming uploads
+# re-check it every DISK_CHECK_BYTES
+MIN_FREE_BYTES = settings.upload_min_free_mb * MB
+DISK_CHECK_BYTES = 64 * MB
+
+
+class UploadRejected(Exception):
+    """
+    An upload that failed validation or wasn't admitted; `status` is the HTTP
+    status to answer with, `retry_after` (seconds) is sent as Retry-After
+    """
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+    def response(self):
+        """Flask (body, status, headers) for this rejection"""
+        headers = {'Retry-After': str(self.retry_after)} if self.retry_after else {}
+        return {"error": self.message}, self.status, headers
+
+
+def free_bytes():
+    """Free space on the volume holding uploads/"""
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    return shutil.disk_usage(UPLOADS_DIR).free
+
+
+def kind_of(content_type):
+    """'video', 'audio', 'image', 'document' or None for a MIME type"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    major = content_type.split('/')[0]
+    if major in ('video', 'audio', 'image'):
+        return major
+    if content_type == 'application/pdf' or major == 'text' or content_type.startswith('application/vnd.openxmlformats'):
+        return 'document'
+    return None
+
+
+def sniff(head):
+    """
+    Identify a file from its first bytes. Returns (kind, mime type), or None
+    when it isn't a format we accept.
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image', 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image', 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image', 'image/gif'
+    if head[:4] == b'RIFF':
+        form = head[8:12]
+        if form == b'WEBP':
+            return 'image', 'image/webp'
+        if form == b'WAVE':
+            return 'audio', 'audio/wav'
+        if form == b'AVI ':
+            return 'video', 'video/x-msvideo'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'M4A ', b'M4B '):
+            return 'audio', 'audio/mp4'
+        if brand in (b'heic', b'heix', b'mif1', b'avif'):
+            return 'image', 'image/avif' if brand == b'avif' else 'image/heic'
+        if brand == b'qt  ':
+            return 'video', 'video/quicktime'
+        return 'video', 'video/mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video', 'video/webm'
+    if head.startswith(b'OggS'):
+        return 'audio', 'audio/ogg'  # may also be video; the declared type decides
+    if head.startswith(b'fLaC'):
+        return 'audio', 'audio/flac'
+    if head.startswith(b'ID3') or (len(head) > 1 and head[0] == 0xff and head[1] & 0xe0 == 0xe0):
+        return 'audio', 'audio/mpeg'
+    if head.startswith(b'%PDF-'):
+        return 'document', 'application/pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return 'document', 'application/zip'
+    return None
+
+
+class UploadStream:
+    """
+    Writable temp file for one multipart file part. Enforces the size limit
+    and format check as data arrives and hashes it on the way through.
+    A rejected part stops being written to disk; with `abort` set the
+    rejection is raised immediately so the request ends early.
+    """
+
+    def __init__(self, declared_type, declared_size=None, abort=False):
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        self.path = os.path.join(UPLOADS_DIR, f"{TEMP_PREFIX}{uuid.uuid4()}")
+        self.file = open(self.path, 'w+b')
+        self.declared_type = declared_type
+        self.kind = kind_of(declared_type)
+        self.content_type = declared_type
+        self.abort = abort
+        self.size = 0
+        self.disk_checked_at = 0
+        self.head = b''
+        self.sniffed = False
+        self.sha256 = hashlib.sha256()
+        self.rejection = None
+        self.committed = False
+        if declared_size is not None:
+            self._check_size(declared_size)
+
+    def _reject(self, message, status, retry_after=None):
+        if self.rejection is None:
+            self.rejection = UploadRejected(message, status, retry_after)
+            self.file.truncate(0)
+        if self.abort:
+            self.close()
+            raise self.rejection
+
+    def _check_size(self, size):
+        limit = SIZE_LIMITS.get(self.kind)
+        if limit is not None and size > limit:
+            self._reject(f"{self.kind.capitalize()} files can be at most {limit // MB} MB", 413)
+
+    def _sniff(self):
+        self.sniffed = True
+        detected = sniff(self.head)
+        if detected is None:
+            # Plain text has no signature; accept it when declared and binary-free
+            if self.kind == 'document' and self.declared_type.startswith('text/') and b'\0' not in self.head:
+                return
+            self._reject("Unsupported file format", 415)
+            return
+        kind, mime_type = detected
+        if mime_type == 'audio/ogg' and self.kind == 'video':
+            kind, mime_type = 'video', 'video/ogg'
+        if self.kind is None:
+            # Generic declared type (e.g. application/octet-stream): trust the bytes
+            self.kind, self.content_type = kind, mime_type
+            self._check_size(self.size)
+        elif kind != self.kind:
+            self._reject(f"File content is {mime_type}, not {self.declared_type}", 415)
+
+    def write(self, data):
+        if self.rejection is not None:
+            return len(data)  # Drain the rest of the part without storing it
+        if not self.sniffed:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self._sniff()
+        self.size += len(data)
+        self._check_size(self.size)
+        if self.size - self.disk_checked_at >= DISK_CHECK_BYTES:
+            self.disk_checked_at = self.size
+            if free_bytes() - len(data) < MIN_FREE_BYTES:
+                self._reject("Upload storage is full, try again later", 507, settings.upload_retry_after)
+        if self.rejection is not None:
+            return len(data)
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def validate(self):
+        """Finish checks that need the whole part; raises UploadRejected"""
+        if self.rejection is None and not self.sniffed:
+            self._sniff()
+        if self.rejection is None and self.kind is None:
+            self._reject("Unsupported file format", 415)
+        if self.rejection is not None:
+            raise self.rejection
+
+    def commit(self, path):
+        """Validate, then atomically move the completed file to `path`"""
+        self.validate()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path, path)
+        self.committed = True
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        # seek/read/tell etc. for the form parser and FileStorage
+        if name == 'file':
+            raise AttributeError(name)
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams file parts into UploadStreams"""
+
+    # Endpoints that take exactly one file: reject from the request size and stop at the first problem
+    single_file_endpoints = ('upload_file',)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        single = self.endpoint in self.single_file_endpoints
+        declared_size = content_length
+        if declared_size is None and single and total_content_length is not None:
+            declared_size = max(0, total_content_length - MULTIPART_OVERHEAD)
+        return UploadStream(content_type or '', declared_size=declared_size, abort=single)
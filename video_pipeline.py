@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Probe-driven video processing
+Serves compatible files as-is, remuxes when only the container/layout is wrong,
+and re-encodes only the streams browsers can't play
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import subprocess
+from psycopg2.extras import Json
+import media_scheduler
+from media_scheduler import run_ffmpeg, EncodeCancelled
+from transcode_video import VIDEO_ENCODE_ARGS, AUDIO_ENCODE_ARGS
+from media_jobs import ProgressTracker
+from segment_encode import should_segment, encode_segmented, encode_timeout
+from settings import settings
+
+# Stream codecs browsers play in each container
+MP4_VIDEO_CODECS = ('h264',)
+MP4_AUDIO_CODECS = ('aac', 'mp3')
+WEBM_VIDEO_CODECS = ('vp8', 'vp9', 'av1')
+WEBM_AUDIO_CODECS = ('opus', 'vorbis')
+
+REMUX_TIMEOUT = settings.remux_timeout  # seconds; stream copies are I/O bound
+ENCODE_TIMEOUT = settings.encode_timeout  # minimum; scaled up for long videos (segment_encode.encode_timeout)
+
+
+def probe(path):
+    """Container and first video/audio stream codecs, via one ffprobe call"""
+    result = subprocess.run([
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-show_format', '-show_streams', path
+    ], capture_output=True, text=True, timeout=settings.probe_timeout)
+    info = json.loads(result.stdout or '{}')
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    try:
+        duration = float(info.get('format', {}).get('duration', 0))
+    except ValueError:
+        duration = 0
+    return {
+        'format': info.get('format', {}).get('format_name', ''),
+        'duration': duration,
+        'video_codec': video.get('codec_name') if video else None,
+        'audio_codec': audio.get('codec_name') if audio else None,
+    }
+
+
+def moov_before_mdat(path):
+    """True when an MP4/MOV has its index (moov) ahead of the media data, so playback can start early"""
+    file_size = os.path.getsize(path)
+    offset = 0
+    with open(path, 'rb') as f:
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size, box_type = struct.unpack('>I4s', header[:8])
+            if box_size == 1 and len(header) == 16:
+                box_size = struct.unpack('>Q', header[8:16])[0]
+            elif box_size == 0:
+                box_size = file_size - offset
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat' or box_size < 8:
+                return False
+            offset += box_size
+    return False
+
+
+def plan(path, info, force_encode=False):
+    """
+    Decide what to do with a video. Returns a decision dict:
+    action is 'passthrough', 'remux' or 'transcode'; video/audio are
+    'copy', 'encode' or None (no such stream); container is the output format.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    vcodec, acodec = info['video_codec'], info['audio_codec']
+    is_mp4 = 'mp4' in info['format'] or 'mov' in info['format']
+    is_matroska = 'matroska' in info['format'] or 'webm' in info['format']
+    decision = {**info, 'faststart': None}
+
+    if vcodec is None:
+        return {**decision, 'action': 'passthrough', 'container': None, 'video': None, 'audio': None,
+                'reason': 'no video stream'}
+
+    # VP8/VP9/AV1 with Opus/Vorbis (or no audio) plays natively as WebM
+    if not force_encode and vcodec in WEBM_VIDEO_CODECS and (acodec is None or acodec in WEBM_AUDIO_CODECS):
+        audio = 'copy' if acodec else None
+        if is_matroska and ext == '.webm':
+            return {**decision, 'action': 'passthrough', 'container': 'webm', 'video': 'copy', 'audio': audio,
+                    'reason': 'already WebM-compatible'}
+        return {**decision, 'action': 'remux', 'container': 'webm', 'video': 'copy', 'audio': audio,
+                'reason': 'WebM-compatible streams in another container'}
+
+    video = 'copy' if vcodec in MP4_VIDEO_CODECS and not force_encode else 'encode'
+    audio = None if acodec is None else ('copy' if acodec in MP4_AUDIO_CODECS else 'encode')
+    if video == 'copy' and audio != 'encode':
+        faststart = is_mp4 and moov_before_mdat(path)
+        decision['faststart'] = faststart
+        if faststart and ext in ('.mp4', '.m4v'):
+            return {**decision, 'action': 'passthrough', 'container': 'mp4', 'video': video, 'audio': audio,
+                    'reason': 'already web-ready MP4'}
+        return {**decision, 'action': 'remux', 'container': 'mp4', 'video': video, 'audio': audio,
+                'reason': 'compatible streams, moving index to the front' if is_mp4 else 'compatible streams in another container'}
+    encoded = [name for name, how in (('video', video), ('audio', audio)) if how == 'encode']
+    return {**decision, 'action': 'transcode', 'container': 'mp4', 'video': video, 'audio': audio,
+            'reason': f"re-encoding {' and '.join(encoded)}"}
+
+
+def build_command(input_path, output_path, decision):
+    cmd = ['ffmpeg', '-i', input_path, '-map', '0:v:0']
+    if decision['audio']:
+        cmd += ['-map', '0:a:0']
+    cmd += VIDEO_ENCODE_ARGS if decision['video'] == 'encode' else ['-c:v', 'copy']
+    if decision['audio'] == 'encode':
+        cmd += AUDIO_ENCODE_ARGS
+    elif decision['audio'] == 'copy':
+        cmd += ['-c:a', 'copy']
+    if decision['container'] == 'mp4':
+        cmd += ['-movflags', '+faststart']  # Index first so playback starts immediately
+    if decision['video'] == 'encode':
+        cmd += ['-threads', str(media_scheduler.ENCODE_THREADS)]
+    return cmd + ['-y', output_path]
+
+
+def process_video(input_path, priority=None, force_encode=False, job_id=None):
+    """
+    Probe a video and make it browser-ready with the least work.
+    Returns (output_path, decision); output_path is the input for passthrough
+    and None when ffmpeg failed. The decision also records the elapsed time.
+    With a `job_id` (see media_jobs.py) progress is reported as the encode
+    runs; if the job is cancelled the partial output is removed and
+    EncodeCancelled propagates. Long video re-encodes are split into
+    segments encoded in parallel (segment_encode.py).
+    """
+    started = time.monotonic()
+    decision = plan(input_path, probe(input_path), force_encode)
+    print(f"Video decision for {os.path.basename(input_path)}: {decision['action']} ({decision['reason']})")
+
+    if decision['action'] == 'passthrough':
+        decision['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+        return input_path, decision
+
+    base_name = os.path.splitext(input_path)[0]
+    output_path = f"{base_name}_web.{decision['container']}"
+    priority = os.path.getsize(input_path) if priority is None else priority
+    tracker = ProgressTracker(job_id, decision['duration']) if job_id else None
+    try:
+        result = None
+        if should_segment(decision):
+            result = encode_segmented(input_path, output_path, decision, priority, tracker)
+        if result is None:
+            cmd = build_command(input_path, output_path, decision)
+            print(f"Running: {' '.join(cmd)}")
+            result = run_ffmpeg(
+                cmd,
+                priority=priority,
+                timeout=encode_timeout(decision['duration']) if decision['action'] == 'transcode' else REMUX_TIMEOUT,
+                on_progress=tracker
+            )
+        ok = result.returncode == 0 and os.path.exists(output_path)
+        if not ok:
+            print(f"Video {decision['action']} failed: {result.stderr}")
+    except subprocess.TimeoutExpired:
+        print(f"Video {decision['action']} timed out")
+        ok = False
+    except EncodeCancelled:
+        print(f"Video {decision['action']} cancelled, removing partial output")
+        remove_partial(output_path)
+        raise
+    decision['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+    return (output_path if ok else None), decision
+
+
+def remove_partial(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def record_decision(cur, source_url, output_url, decision):
+    """Keep the processing decision for later inspection (media_processing table)"""
+    cur.execute("""
+        INSERT INTO media_processing (source_url, output_url, action, decision, elapsed_ms)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (source_url, output_url, decision['action'], Json(decision), decision.get('elapsed_ms')))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python video_pipeline.py <input_video_path>")
+        sys.exit(1)
+
+    output, decision = process_video(sys.argv[1])
+    print(json.dumps(decision, indent=2))
+    sys.exit(0 if output else 1)